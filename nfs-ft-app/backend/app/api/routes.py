@@ -1,21 +1,48 @@
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
 import logging
 import shutil
 import uuid
 
-from fastapi import APIRouter, Body, File, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Body, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from app.core.config import settings
+from app.services.batch import batch_summary, expand_batch_inputs, run_batch, write_batch_report
 from app.services.file_processor import NFSFTFileProcessor, PisaFTFileProcessor, PisaRicevuteFTFileProcessor, CompareFTFileProcessor
+from app.services.input_cache import ParsedInputCache
+from app.services.metrics import MetricsRegistry, TaskActivity
+from app.services.periods import parse_months
+from app.services.task_events import TaskEvents, task_event_stream
+from app.services.task_store import TaskStore
+from app.services.uploads import UploadLimitRoute, limit_upload_size, save_upload
+from app.services.worker_pool import WorkerPool
 
 
-router = APIRouter()
+router = APIRouter(route_class=UploadLimitRoute)
 logger = logging.getLogger(__name__)
-executor = ThreadPoolExecutor(max_workers=4)
-tasks: dict[str, dict] = {}
+executor = ThreadPoolExecutor(max_workers=settings.PROCESSING_WORKERS)
+# Un batch invia i singoli file a ``executor`` e ne attende i risultati: l'attesa gira
+# in questi thread, così non occupa un worker di elaborazione.
+batch_executor = ThreadPoolExecutor(max_workers=settings.PROCESSING_WORKERS)
+worker_pool = WorkerPool(
+    settings.PROCESSING_BACKEND,
+    max_workers=settings.PROCESSING_WORKERS,
+    max_tasks_per_child=settings.PROCESSING_MAX_TASKS_PER_CHILD,
+)
+input_cache = (
+    ParsedInputCache(settings.CACHE_DIR, settings.PARSED_CACHE_MAX_BYTES, settings.FILE_RETENTION_HOURS)
+    if settings.PARSED_CACHE_ENABLED
+    else None
+)
+task_events = TaskEvents()
+task_activity = TaskActivity(settings.PROCESSING_WORKERS)
+metrics_registry = MetricsRegistry(task_activity)
+task_store = TaskStore(settings.TASK_DB_PATH, settings.FILE_RETENTION_HOURS, on_change=task_events.notify)
 
 
 def _ensure_dirs() -> None:
@@ -23,44 +50,109 @@ def _ensure_dirs() -> None:
     settings.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def _submit(fn, *args) -> Future:
+    task_activity.submitted()
+    return executor.submit(task_activity.track, fn, *args)
+
+
+async def _store_upload(file: UploadFile, upload_path: Path) -> None:
+    stored = await save_upload(file, upload_path, settings.MAX_FILE_SIZE)
+    if input_cache is not None:
+        input_cache.remember_hash(stored.path, stored.sha256)
+
+
 def _run_single_file_task(task_id: str, processor, upload_path: Path, output_path: Path) -> None:
-    tasks[task_id]["status"] = "processing"
+    task_store.mark_processing(task_id)
     try:
-        stats = processor.process_file(upload_path, output_path)
-        tasks[task_id]["status"] = "done"
-        tasks[task_id]["summary"] = stats
-        tasks[task_id]["download_url"] = f"/api/download/{task_id}"
+        stats = worker_pool.run(processor.process_file, upload_path, output_path)
+        metrics_registry.observe_job(type(processor).__name__, "done", stats.get("stages", []))
+        task_store.mark_done(task_id, stats, f"/api/download/{task_id}")
         upload_path.unlink(missing_ok=True)
     except Exception as exc:
-        tasks[task_id]["status"] = "error"
-        tasks[task_id]["error"] = str(exc)
+        metrics_registry.observe_job(type(processor).__name__, "error")
+        task_store.mark_error(task_id, str(exc))
         upload_path.unlink(missing_ok=True)
         output_path.unlink(missing_ok=True)
 
 
+def _compare_read_workers() -> int:
+    # Col backend a processi ogni worker esegue un confronto alla volta: gli basta un processo di lettura.
+    return 1 if settings.PROCESSING_BACKEND == "process" else settings.PROCESSING_WORKERS
+
+
 def _run_compare_task(
     task_id: str,
     upload_path_nfs: Path,
     upload_path_pisa: Path,
     output_path: Path,
+    months: Optional[List[str]] = None,
 ) -> None:
-    tasks[task_id]["status"] = "processing"
+    task_store.mark_processing(task_id)
     try:
-        summary = CompareFTFileProcessor().process_files(upload_path_nfs, upload_path_pisa, output_path)
-        tasks[task_id]["status"] = "done"
-        tasks[task_id]["summary"] = summary
-        tasks[task_id]["download_url"] = f"/api/download/{task_id}"
+        processor = CompareFTFileProcessor(
+            input_cache=input_cache,
+            compact_frames=settings.COMPACT_FRAMES,
+            memory_report=settings.MEMORY_REPORT,
+            months=months,
+            parallel_load=settings.COMPARE_PARALLEL_LOAD,
+            on_progress=partial(task_store.set_progress, task_id),
+            parallel_load_workers=_compare_read_workers(),
+        )
+        summary = worker_pool.run(processor.process_files, upload_path_nfs, upload_path_pisa, output_path)
+        metrics_registry.observe_job(CompareFTFileProcessor.__name__, "done", summary.get("stages", []))
+        task_store.mark_done(task_id, summary, f"/api/download/{task_id}")
         upload_path_nfs.unlink(missing_ok=True)
         upload_path_pisa.unlink(missing_ok=True)
     except Exception as exc:
-        tasks[task_id]["status"] = "error"
-        tasks[task_id]["error"] = str(exc)
+        metrics_registry.observe_job(CompareFTFileProcessor.__name__, "error")
+        task_store.mark_error(task_id, str(exc))
         upload_path_nfs.unlink(missing_ok=True)
         upload_path_pisa.unlink(missing_ok=True)
         output_path.unlink(missing_ok=True)
 
 
+def _batch_processor(kind: str):
+    if kind == "pisa":
+        return PisaRicevuteFTFileProcessor(
+            input_cache=input_cache,
+            detail_preview_rows=settings.DETAIL_PREVIEW_ROWS or None,
+            compact_frames=settings.COMPACT_FRAMES,
+            memory_report=settings.MEMORY_REPORT,
+        )
+    return NFSFTFileProcessor(
+        input_cache=input_cache,
+        compact_frames=settings.COMPACT_FRAMES,
+        memory_report=settings.MEMORY_REPORT,
+    )
+
+
+def _run_batch_task(task_id: str, kind: str, sources: List[Tuple[str, Path]], batch_dir: Path, output_path: Path) -> None:
+    task_store.mark_processing(task_id)
+    try:
+        task_store.set_progress(task_id, {"total": len(sources), "completed": 0, "failed": 0})
+        results = run_batch(
+            sources,
+            lambda: _batch_processor(kind),
+            partial(_submit, worker_pool.run),
+            on_progress=lambda progress: task_store.set_progress(task_id, progress),
+        )
+        job = (PisaRicevuteFTFileProcessor if kind == "pisa" else NFSFTFileProcessor).__name__
+        for result in results:
+            metrics_registry.observe_job(job, result["status"], result.get("stats", {}).get("stages", []))
+        summary = batch_summary(results)
+        if summary["failed"] == summary["files"]:
+            raise ValueError(f"Nessun file del batch elaborato: {results[0].get('error', '')}")
+        write_batch_report(results, output_path)
+        task_store.mark_done(task_id, summary, f"/api/download/{task_id}")
+    except Exception as exc:
+        task_store.mark_error(task_id, str(exc))
+        output_path.unlink(missing_ok=True)
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+
 @router.post("/process-file")
+@limit_upload_size(settings.MAX_FILE_SIZE)
 async def process_file(file: UploadFile = File(...)):
     file_ext = Path(file.filename).suffix.lower()
     if file_ext not in settings.ALLOWED_EXTENSIONS:
@@ -75,19 +167,17 @@ async def process_file(file: UploadFile = File(...)):
 
     try:
         _ensure_dirs()
-        with upload_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        file_size = upload_path.stat().st_size
-        if file_size > settings.MAX_FILE_SIZE:
-            upload_path.unlink()
-            raise HTTPException(
-                status_code=400,
-                detail=f"File troppo grande. Dimensione massima: {settings.MAX_FILE_SIZE / 1024 / 1024:.0f}MB",
-            )
-
-        tasks[task_id] = {"status": "queued", "file_id": task_id}
-        executor.submit(_run_single_file_task, task_id, NFSFTFileProcessor(), upload_path, output_path)
+        await _store_upload(file, upload_path)
+        await run_in_threadpool(NFSFTFileProcessor.preflight, upload_path)
+
+        task_store.create(task_id, output_path)
+        processor = NFSFTFileProcessor(
+            input_cache=input_cache,
+            compact_frames=settings.COMPACT_FRAMES,
+            memory_report=settings.MEMORY_REPORT,
+            on_progress=partial(task_store.set_progress, task_id),
+        )
+        _submit(_run_single_file_task, task_id, processor, upload_path, output_path)
 
         return {
             "success": True,
@@ -107,6 +197,7 @@ async def process_file(file: UploadFile = File(...)):
 
 
 @router.post("/process-file-pisa")
+@limit_upload_size(settings.MAX_FILE_SIZE)
 async def process_file_pisa(file: UploadFile = File(...)):
     file_ext = Path(file.filename).suffix.lower()
     if file_ext not in settings.ALLOWED_EXTENSIONS:
@@ -121,19 +212,18 @@ async def process_file_pisa(file: UploadFile = File(...)):
 
     try:
         _ensure_dirs()
-        with upload_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        file_size = upload_path.stat().st_size
-        if file_size > settings.MAX_FILE_SIZE:
-            upload_path.unlink()
-            raise HTTPException(
-                status_code=400,
-                detail=f"File troppo grande. Dimensione massima: {settings.MAX_FILE_SIZE / 1024 / 1024:.0f}MB",
-            )
-
-        tasks[task_id] = {"status": "queued", "file_id": task_id}
-        executor.submit(_run_single_file_task, task_id, PisaRicevuteFTFileProcessor(), upload_path, output_path)
+        await _store_upload(file, upload_path)
+        await run_in_threadpool(PisaRicevuteFTFileProcessor.preflight, upload_path)
+
+        task_store.create(task_id, output_path)
+        processor = PisaRicevuteFTFileProcessor(
+            input_cache=input_cache,
+            detail_preview_rows=settings.DETAIL_PREVIEW_ROWS or None,
+            compact_frames=settings.COMPACT_FRAMES,
+            memory_report=settings.MEMORY_REPORT,
+            on_progress=partial(task_store.set_progress, task_id),
+        )
+        _submit(_run_single_file_task, task_id, processor, upload_path, output_path)
 
         return {
             "success": True,
@@ -153,7 +243,19 @@ async def process_file_pisa(file: UploadFile = File(...)):
 
 
 @router.post("/process-compare")
-async def process_compare(file_nfs: UploadFile = File(...), file_pisa: UploadFile = File(...)):
+@limit_upload_size(2 * settings.MAX_FILE_SIZE)
+async def process_compare(
+    file_nfs: UploadFile = File(...),
+    file_pisa: UploadFile = File(...),
+    mesi: Optional[str] = Form(None),
+):
+    months = [value for value in mesi.split(",") if value.strip()] if mesi else None
+    if months is not None:
+        try:
+            parse_months(months)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+
     file_ext_nfs = Path(file_nfs.filename).suffix.lower()
     file_ext_pisa = Path(file_pisa.filename).suffix.lower()
     if file_ext_nfs not in settings.ALLOWED_EXTENSIONS or file_ext_pisa not in settings.ALLOWED_EXTENSIONS:
@@ -169,25 +271,12 @@ async def process_compare(file_nfs: UploadFile = File(...), file_pisa: UploadFil
 
     try:
         _ensure_dirs()
-        with upload_path_nfs.open("wb") as buffer:
-            shutil.copyfileobj(file_nfs.file, buffer)
-        with upload_path_pisa.open("wb") as buffer:
-            shutil.copyfileobj(file_pisa.file, buffer)
-
-        file_size_nfs = upload_path_nfs.stat().st_size
-        file_size_pisa = upload_path_pisa.stat().st_size
-        if file_size_nfs > settings.MAX_FILE_SIZE or file_size_pisa > settings.MAX_FILE_SIZE:
-            if upload_path_nfs.exists():
-                upload_path_nfs.unlink()
-            if upload_path_pisa.exists():
-                upload_path_pisa.unlink()
-            raise HTTPException(
-                status_code=400,
-                detail=f"File troppo grande. Dimensione massima: {settings.MAX_FILE_SIZE / 1024 / 1024:.0f}MB",
-            )
+        await _store_upload(file_nfs, upload_path_nfs)
+        await _store_upload(file_pisa, upload_path_pisa)
+        await run_in_threadpool(CompareFTFileProcessor.preflight, upload_path_nfs, upload_path_pisa)
 
-        tasks[task_id] = {"status": "queued", "file_id": task_id}
-        executor.submit(_run_compare_task, task_id, upload_path_nfs, upload_path_pisa, output_path)
+        task_store.create(task_id, output_path)
+        _submit(_run_compare_task, task_id, upload_path_nfs, upload_path_pisa, output_path, months)
 
         return {
             "success": True,
@@ -212,36 +301,84 @@ async def process_compare(file_nfs: UploadFile = File(...), file_pisa: UploadFil
         raise HTTPException(status_code=500, detail="Errore durante il confronto dei file")
 
 
+@router.post("/process-batch")
+@limit_upload_size(settings.BATCH_MAX_TOTAL_SIZE)
+async def process_batch(files: List[UploadFile] = File(...), tipo: str = Form("nfs")):
+    if tipo not in ("nfs", "pisa"):
+        raise HTTPException(status_code=400, detail="Tipo di batch non valido. Valori ammessi: nfs, pisa")
+    if len(files) > settings.BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Troppi file nel batch. Massimo: {settings.BATCH_MAX_FILES}")
+    allowed_extensions = set(settings.ALLOWED_EXTENSIONS) | {".zip"}
+    for file in files:
+        if Path(file.filename).suffix.lower() not in allowed_extensions:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Formato file non valido: {file.filename}. Formati supportati: {', '.join(sorted(allowed_extensions))}",
+            )
+
+    task_id = str(uuid.uuid4())
+    batch_dir = settings.UPLOAD_DIR / f"{task_id}_batch"
+    output_path = settings.OUTPUT_DIR / f"{task_id}_output.xlsx"
+
+    try:
+        _ensure_dirs()
+        batch_dir.mkdir()
+        uploads: List[Tuple[str, Path]] = []
+        for idx, file in enumerate(files):
+            upload_path = batch_dir / f"{idx:03d}_input{Path(file.filename).suffix.lower()}"
+            try:
+                await _store_upload(file, upload_path)
+            except ValueError as exc:
+                raise HTTPException(status_code=400, detail=str(exc))
+            uploads.append((Path(file.filename).name, upload_path))
+        try:
+            sources = await run_in_threadpool(
+                expand_batch_inputs,
+                uploads,
+                batch_dir,
+                tuple(settings.ALLOWED_EXTENSIONS),
+                settings.MAX_FILE_SIZE,
+                settings.BATCH_MAX_FILES,
+                settings.BATCH_MAX_TOTAL_SIZE,
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+
+        task_store.create(task_id, output_path)
+        batch_executor.submit(_run_batch_task, task_id, tipo, sources, batch_dir, output_path)
+
+        return {
+            "success": True,
+            "task_id": task_id,
+        }
+    except HTTPException:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise
+    except Exception as exc:
+        logger.error("Errore batch: %s", str(exc))
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise HTTPException(status_code=500, detail="Errore durante il caricamento del batch")
+
+
 @router.get("/task/{task_id}")
 async def get_task_status(task_id: str):
-    task = tasks.get(task_id)
+    task = await run_in_threadpool(task_store.get, task_id)
     if not task:
-        output_path = settings.OUTPUT_DIR / f"{task_id}_output.xlsx"
-        if output_path.exists():
-            return {
-                "status": "done",
-                "file_id": task_id,
-                "download_url": f"/api/download/{task_id}",
-            }
-
-        artifacts = list(settings.UPLOAD_DIR.glob(f"{task_id}*"))
-        if artifacts:
-            latest_mtime = max(p.stat().st_mtime for p in artifacts)
-            if datetime.now().timestamp() - latest_mtime > 20 * 60:
-                return {
-                    "status": "error",
-                    "file_id": task_id,
-                    "error": "Elaborazione scaduta. Ricarica il file e riprova.",
-                }
-            return {
-                "status": "processing",
-                "file_id": task_id,
-            }
-
         raise HTTPException(status_code=404, detail="Task non trovato")
     return task
 
 
+@router.get("/task/{task_id}/events")
+async def stream_task_status(task_id: str, request: Request):
+    if not await run_in_threadpool(task_store.get, task_id):
+        raise HTTPException(status_code=404, detail="Task non trovato")
+    return StreamingResponse(
+        task_event_stream(task_store, task_events, task_id, request.is_disconnected, settings.TASK_EVENTS_POLL_SECONDS),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/close-day")
 async def close_day(payload: dict = Body(...)):
     message = str(payload.get("message", "")).strip()
@@ -277,6 +414,11 @@ async def download_file(file_id: str):
     )
 
 
+@router.get("/metrics")
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @router.get("/health")
 async def health_check():
     return {"status": "ok", "service": "NFS/FT File Processor"}
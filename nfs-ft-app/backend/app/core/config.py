@@ -6,14 +6,35 @@ class Settings(BaseSettings):
     BASE_DIR: Path = Path(__file__).resolve().parent.parent.parent
     UPLOAD_DIR: Path = BASE_DIR / "uploads"
     OUTPUT_DIR: Path = BASE_DIR / "outputs"
+    CACHE_DIR: Path = BASE_DIR / "cache"
+    TASK_DB_PATH: Path = BASE_DIR / "tasks.db"
 
     MAX_FILE_SIZE: int = 62914560
     ALLOWED_EXTENSIONS: set = {".xlsx"}
+    BATCH_MAX_FILES: int = 50
+    BATCH_MAX_TOTAL_SIZE: int = 524288000
 
     ALLOWED_ORIGINS: str = "http://localhost:5173,http://localhost:3000"
 
     FILE_RETENTION_HOURS: int = 24
 
+    PARSED_CACHE_ENABLED: bool = True
+    PARSED_CACHE_MAX_BYTES: int = 1073741824
+
+    DETAIL_PREVIEW_ROWS: int = 0
+
+    COMPACT_FRAMES: bool = False
+    MEMORY_REPORT: bool = False
+    # Lettura del file Pisa in processi separati durante il confronto: aggiunge fino a
+    # PROCESSING_WORKERS processi (uno per worker col backend "process").
+    COMPARE_PARALLEL_LOAD: bool = False
+
+    TASK_EVENTS_POLL_SECONDS: float = 2.0
+
+    PROCESSING_BACKEND: str = "thread"
+    PROCESSING_WORKERS: int = 4
+    PROCESSING_MAX_TASKS_PER_CHILD: int = 20
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,188 @@
+from concurrent.futures import Future, as_completed
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import logging
+import zipfile
+
+from openpyxl import Workbook
+from openpyxl.styles import Alignment, Font, PatternFill
+
+
+logger = logging.getLogger(__name__)
+
+BatchSource = Tuple[str, Path]
+ProgressCallback = Callable[[Dict[str, Any]], None]
+SubmitFn = Callable[..., "Future[Any]"]
+
+COPY_CHUNK_SIZE = 1024 * 1024
+SUMMARY_COUNTERS = ("total_records", "fase2_records", "fase3_records", "duplicates_removed")
+
+
+def expand_batch_inputs(
+    uploads: Sequence[BatchSource],
+    work_dir: Path,
+    allowed_extensions: Sequence[str],
+    max_file_size: int,
+    max_files: int,
+    max_total_size: int,
+) -> List[BatchSource]:
+    """File da elaborare nel batch: i file caricati e i file Excel contenuti negli archivi ZIP.
+
+    Dagli archivi si estraggono solo i file con estensione ammessa (esclusi cartelle,
+    file nascosti e ``__MACOSX``), ciascuno con un nome univoco in ``work_dir``. Il
+    batch fallisce se un file estratto supera ``max_file_size``, se i file da
+    elaborare sono più di ``max_files`` o se insieme superano ``max_total_size`` byte.
+    """
+    sources: List[BatchSource] = []
+    total_size = 0
+    too_many = ValueError(f"Troppi file nel batch. Massimo: {max_files}")
+    too_large_total = ValueError(f"Batch troppo grande. Dimensione massima: {max_total_size // (1024 * 1024)}MB")
+    for name, path in uploads:
+        if Path(name).suffix.lower() != ".zip":
+            total_size += path.stat().st_size
+            if len(sources) >= max_files:
+                raise too_many
+            if total_size > max_total_size:
+                raise too_large_total
+            sources.append((name, path))
+            continue
+        try:
+            archive = zipfile.ZipFile(path)
+        except zipfile.BadZipFile:
+            raise ValueError(f"Archivio ZIP non valido: {name}")
+        with archive:
+            for info in archive.infolist():
+                member = PurePosixPath(info.filename)
+                if info.is_dir() or "__MACOSX" in member.parts or member.name.startswith((".", "~$")):
+                    continue
+                if member.suffix.lower() not in allowed_extensions:
+                    continue
+                if len(sources) >= max_files:
+                    raise too_many
+                too_large = ValueError(f"File troppo grande nell'archivio {name}: {member.name}")
+                if info.file_size > max_file_size:
+                    raise too_large
+                if total_size + info.file_size > max_total_size:
+                    raise too_large_total
+                target = work_dir / f"{len(sources):03d}_{member.name}"
+                written = 0
+                # La dimensione dichiarata nell'archivio non è affidabile: si controlla durante l'estrazione.
+                with archive.open(info) as src, target.open("wb") as dst:
+                    for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b""):
+                        written += len(chunk)
+                        if written > max_file_size:
+                            raise too_large
+                        if total_size + written > max_total_size:
+                            raise too_large_total
+                        dst.write(chunk)
+                total_size += written
+                sources.append((f"{name}/{member}", target))
+
+    if not sources:
+        raise ValueError("Nessun file Excel da elaborare nel batch")
+    return sources
+
+
+def run_batch(
+    sources: Sequence[BatchSource],
+    processor_factory: Callable[[], Any],
+    submit: SubmitFn,
+    on_progress: Optional[ProgressCallback] = None,
+) -> List[Dict[str, Any]]:
+    """Elabora i file, ognuno con un proprio processor, e ne raccoglie i riepiloghi.
+
+    Ogni file è un job a sé inviato con ``submit`` (l'executor condiviso dell'API),
+    così il batch rispetta il numero di worker configurato. ``process_file`` viene
+    chiamato senza file di output: del singolo file serve solo il riepilogo.
+    L'errore su un file non interrompe gli altri: viene riportato nel risultato
+    della sorgente. I risultati seguono l'ordine di ``sources``.
+    """
+    results: List[Dict[str, Any]] = [{"source": name, "status": "queued"} for name, _ in sources]
+    progress = {"total": len(sources), "completed": 0, "failed": 0}
+
+    futures = {submit(processor_factory().process_file, path): idx for idx, (_, path) in enumerate(sources)}
+    for future in as_completed(futures):
+        result = results[futures[future]]
+        try:
+            result["stats"] = future.result()
+            result["status"] = "done"
+        except Exception as exc:
+            logger.error("Errore elaborazione batch %s: %s", result["source"], str(exc))
+            result["status"] = "error"
+            result["error"] = str(exc)
+            progress["failed"] += 1
+        progress["completed"] += 1
+        if on_progress is not None:
+            on_progress(dict(progress))
+
+    return results
+
+
+def batch_summary(results: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    total = {name: 0 for name in SUMMARY_COUNTERS}
+    for result in results:
+        for name in SUMMARY_COUNTERS:
+            total[name] += int(result.get("stats", {}).get(name, 0))
+    return {
+        "files": len(results),
+        "failed": sum(1 for result in results if result["status"] == "error"),
+        "total": total,
+        "sources": [_source_summary(result) for result in results],
+    }
+
+
+def _source_summary(result: Dict[str, Any]) -> Dict[str, Any]:
+    entry = {"source": result["source"], "status": result["status"], **result.get("stats", {})}
+    if "error" in result:
+        entry["error"] = result["error"]
+    return entry
+
+
+def write_batch_report(results: Sequence[Dict[str, Any]], output_path: Path) -> None:
+    """Cartella di lavoro con una riga di riepilogo per sorgente, il totale e il dettaglio per protocollo."""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Riepilogo batch"
+
+    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+    header_font = Font(bold=True, color="FFFFFF")
+    total_fill = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
+    total_font = Font(bold=True)
+
+    def write_header(sheet, headers: List[str]) -> None:
+        sheet.append(headers)
+        for cell in sheet[1]:
+            cell.fill = header_fill
+            cell.font = header_font
+            cell.alignment = Alignment(horizontal="center", vertical="center")
+
+    write_header(ws, ["Sorgente", "Esito", "Record totali", "Fase 2", "Fase 3", "Duplicati rimossi", "Errore"])
+    for result in results:
+        stats = result.get("stats", {})
+        ws.append(
+            [
+                result["source"],
+                "Elaborato" if result["status"] == "done" else "Errore",
+                *(stats.get(name, 0) for name in SUMMARY_COUNTERS),
+                result.get("error", ""),
+            ]
+        )
+    total = batch_summary(results)["total"]
+    ws.append(["TOTALE", None, *(total[name] for name in SUMMARY_COUNTERS), None])
+    for cell in ws[ws.max_row]:
+        cell.fill = total_fill
+        cell.font = total_font
+    for letter, width in zip("ABCDEFG", (40, 12, 14, 10, 10, 18, 50)):
+        ws.column_dimensions[letter].width = width
+
+    ws_protocols = wb.create_sheet("Protocolli")
+    write_header(ws_protocols, ["Sorgente", "Fase", "Protocollo", "Numero"])
+    for result in results:
+        stats = result.get("stats", {})
+        for fase, key in (("Fase 2", "protocols_fase2"), ("Fase 3", "protocols_fase3")):
+            for protocol, count in stats.get(key, {}).items():
+                ws_protocols.append([result["source"], fase, protocol, count])
+    for letter, width in zip("ABCD", (40, 10, 16, 12)):
+        ws_protocols.column_dimensions[letter].width = width
+
+    wb.save(output_path)
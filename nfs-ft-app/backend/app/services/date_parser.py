@@ -0,0 +1,78 @@
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+
+ISO_DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+# Valori che pd.to_datetime ignora quando deduce il formato dal primo elemento.
+NAT_STRINGS = frozenset({"NaT", "nat", "NAT", "nan", "NaN", "NAN", "now", "today"})
+
+
+def _first_non_null(values: np.ndarray) -> Any:
+    for value in values:
+        if pd.isna(value):
+            continue
+        if isinstance(value, str) and (value == "" or value in NAT_STRINGS):
+            continue
+        return value
+    return None
+
+
+class DateParser:
+    """Conversione in date che analizza ogni valore distinto una sola volta.
+
+    Le colonne vengono fattorizzate: si convertono solo i valori distinti e il
+    risultato viene riportato sulle righe tramite i codici. Come ``pd.to_datetime``
+    il formato è dedotto dal primo valore non nullo della colonna; i valori già
+    convertiti con lo stesso formato vengono riusati tra tutte le colonne del job.
+    """
+
+    def __init__(self) -> None:
+        self._parsed: Dict[Tuple[bool, Optional[str]], Dict[Any, pd.Timestamp]] = {}
+
+    def to_datetime(self, series: pd.Series, dayfirst: bool = False) -> pd.Series:
+        """Equivale a ``pd.to_datetime(series, errors="coerce", dayfirst=dayfirst)``."""
+        if not self._is_text(series):
+            return pd.to_datetime(series, errors="coerce", dayfirst=dayfirst)
+        codes, uniques = pd.factorize(series)
+        parsed = self._parse_values(np.asarray(uniques, dtype=object), dayfirst)
+        return self._expand(parsed, codes, series)
+
+    def to_datetime_iso_or_dayfirst(self, series: pd.Series) -> pd.Series:
+        """Date ``AAAA-MM-GG`` lette come ISO, tutte le altre con il giorno per primo."""
+        if not self._is_text(series):
+            iso_mask = series.astype(str).str.strip().str.match(ISO_DATE_PATTERN)
+            parsed_iso = pd.to_datetime(series.where(iso_mask), errors="coerce", dayfirst=False)
+            return parsed_iso.fillna(pd.to_datetime(series.where(~iso_mask), errors="coerce", dayfirst=True))
+        codes, uniques = pd.factorize(series)
+        values = pd.Series(np.asarray(uniques, dtype=object), dtype=object)
+        iso_mask = values.astype(str).str.strip().str.match(ISO_DATE_PATTERN).to_numpy(dtype=bool)
+        parsed_iso = self._parse_values(values.where(iso_mask).to_numpy(), dayfirst=False)
+        parsed_other = self._parse_values(values.where(~iso_mask).to_numpy(), dayfirst=True)
+        return self._expand(parsed_iso.fillna(parsed_other), codes, series)
+
+    def _is_text(self, series: pd.Series) -> bool:
+        return series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+
+    def _parse_values(self, values: np.ndarray, dayfirst: bool) -> pd.Series:
+        first = _first_non_null(values)
+        if first is None:
+            return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce", dayfirst=dayfirst)
+        date_format = guess_datetime_format(first, dayfirst=dayfirst) if type(first) is str else None
+        memo = self._parsed.setdefault((dayfirst, date_format), {})
+        missing = [value for value in dict.fromkeys(values) if value not in memo]
+        if missing:
+            parsed = pd.to_datetime(
+                pd.Index(missing, dtype=object),
+                format=date_format or "mixed",
+                dayfirst=dayfirst,
+                errors="coerce",
+            )
+            memo.update(zip(missing, parsed))
+        return pd.Series(pd.DatetimeIndex([memo[value] for value in values]))
+
+    def _expand(self, parsed: pd.Series, codes: np.ndarray, series: pd.Series) -> pd.Series:
+        values = parsed.array.take(codes, allow_fill=True)
+        return pd.Series(values, index=series.index, name=series.name)
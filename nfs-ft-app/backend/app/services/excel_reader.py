@@ -0,0 +1,265 @@
+from itertools import chain, islice
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from xml.etree import ElementTree
+import logging
+import re
+import zipfile
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+
+from app.services.progress import ROWS_PROGRESS_STEP
+
+
+logger = logging.getLogger(__name__)
+
+HEADER_SCAN_ROWS = 25
+
+SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PACKAGE_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+CELL_REF_PATTERN = re.compile(r"^([A-Z]+)(\d+)$")
+DIMENSION_ROWS_PATTERN = re.compile(r"(\d+)$")
+# Byte compressi per riga di un export NFS tipico (10-15 colonne), usati se il foglio non dichiara le dimensioni.
+XLSX_BYTES_PER_ROW = 50
+
+HeaderRowFinder = Callable[[List[List[Any]]], Optional[int]]
+ColumnSelector = Callable[[List[Any]], List[int]]
+RowsCallback = Callable[[int], None]
+
+
+def _convert_value(value: Any) -> Any:
+    # Stessa conversione delle celle usata da pd.read_excel con openpyxl.
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        as_int = int(value)
+        if as_int == value:
+            return as_int
+        return float(value)
+    if isinstance(value, str) and value in ERROR_CODES:
+        return np.nan
+    return value
+
+
+def _convert_row(row: tuple) -> List[Any]:
+    converted = [_convert_value(value) for value in row]
+    while converted and converted[-1] == "":
+        converted.pop()
+    return converted
+
+
+def read_excel_streaming(
+    input_path: Path,
+    header_row_finder: Optional[HeaderRowFinder] = None,
+    column_selector: Optional[ColumnSelector] = None,
+    header_scan_rows: int = HEADER_SCAN_ROWS,
+    dtype: Any = None,
+    on_rows: Optional[RowsCallback] = None,
+) -> pd.DataFrame:
+    """Legge il primo foglio di un file xlsx in un'unica passata in modalità read-only.
+
+    Le prime ``header_scan_rows`` righe vengono passate a ``header_row_finder`` per
+    individuare la riga di intestazione (se non trovata si usa la prima riga); il
+    resto dello stesso stream diventa il corpo del DataFrame. Se ``column_selector``
+    è indicato riceve la riga di intestazione e restituisce gli indici delle colonne
+    da materializzare: le altre vengono scartate riga per riga durante la lettura.
+    La conversione dei valori e l'inferenza dei tipi sono le stesse di ``pd.read_excel``.
+    ``on_rows`` riceve il numero di righe lette ogni ``ROWS_PROGRESS_STEP`` righe.
+    """
+    wb = load_workbook(input_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+
+        head = list(islice(rows, header_scan_rows))
+        header_row_idx = header_row_finder([_convert_row(row) for row in head]) if header_row_finder else None
+        head = head[header_row_idx or 0 :]
+        indices = column_selector(_convert_row(head[0])) if column_selector and head else None
+
+        data: List[List[Any]] = []
+        last_row_with_data = -1
+        for idx, row in enumerate(chain(head, rows)):
+            # Le righe vuote finali si calcolano sulla riga completa, come in pd.read_excel.
+            if any(value is not None and value != "" for value in row):
+                last_row_with_data = idx
+            if indices is not None:
+                row = tuple(row[i] if i < len(row) else None for i in indices)
+            data.append(_convert_row(row))
+            if on_rows is not None and len(data) % ROWS_PROGRESS_STEP == 0:
+                on_rows(ROWS_PROGRESS_STEP)
+        if on_rows is not None and len(data) % ROWS_PROGRESS_STEP:
+            on_rows(len(data) % ROWS_PROGRESS_STEP)
+    finally:
+        wb.close()
+
+    data = data[: last_row_with_data + 1]
+    if not data:
+        return pd.DataFrame()
+
+    max_width = max(len(row) for row in data)
+    for row in data:
+        if len(row) < max_width:
+            row.extend([""] * (max_width - len(row)))
+
+    try:
+        parser = TextParser(data, header=0, dtype=dtype, skip_blank_lines=False)
+        return parser.read()
+    except EmptyDataError:
+        return pd.DataFrame()
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def _part_path(target: str) -> str:
+    # I target delle relazioni sono relativi a xl/ oppure assoluti nel pacchetto.
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return str(PurePosixPath("xl") / target)
+
+
+def _workbook_parts(archive: zipfile.ZipFile) -> Tuple[str, Optional[str]]:
+    """Percorso del primo foglio di lavoro e della tabella delle stringhe condivise."""
+    rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    targets = {rel.get("Id"): rel for rel in rels.iter(f"{PACKAGE_REL_NS}Relationship")}
+    shared_strings = next(
+        (_part_path(rel.get("Target")) for rel in targets.values() if rel.get("Type", "").endswith("/sharedStrings")),
+        None,
+    )
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    for sheet in workbook.iter(f"{SHEET_NS}sheet"):
+        rel = targets.get(sheet.get(f"{REL_NS}id"))
+        # Come openpyxl si considerano solo i fogli di lavoro (non i fogli grafico).
+        if rel is not None and rel.get("Type", "").endswith("/worksheet"):
+            return _part_path(rel.get("Target")), shared_strings
+    raise KeyError("Nessun foglio di lavoro nel file")
+
+
+def _string_text(element: ElementTree.Element) -> str:
+    # Testo semplice o rich text; la guida fonetica (rPh) viene ignorata.
+    parts = []
+    for child in element:
+        if child.tag == f"{SHEET_NS}t":
+            parts.append(child.text or "")
+        elif child.tag == f"{SHEET_NS}r":
+            parts.extend(t.text or "" for t in child.iter(f"{SHEET_NS}t"))
+    return "".join(parts)
+
+
+def _read_shared_strings(archive: zipfile.ZipFile, part: Optional[str], wanted: Set[int]) -> Dict[int, str]:
+    """Solo le stringhe condivise indicate, fermando la lettura all'indice più alto richiesto."""
+    strings: Dict[int, str] = {}
+    if not wanted or part is None:
+        return strings
+    last = max(wanted)
+    with archive.open(part) as stream:
+        index = 0
+        for _, element in ElementTree.iterparse(stream):
+            if element.tag != f"{SHEET_NS}si":
+                continue
+            if index in wanted:
+                strings[index] = _string_text(element)
+            element.clear()
+            if index >= last:
+                break
+            index += 1
+    return strings
+
+
+def _cell_value(cell: ElementTree.Element) -> Any:
+    # Le stringhe condivise restano come ("s", indice) e si risolvono dopo aver letto le righe.
+    kind = cell.get("t", "n")
+    if kind == "inlineStr":
+        inline = cell.find(f"{SHEET_NS}is")
+        return _string_text(inline) if inline is not None else None
+    raw = cell.findtext(f"{SHEET_NS}v")
+    if raw is None:
+        return None
+    if kind == "s":
+        return ("s", int(raw))
+    if kind == "b":
+        return raw == "1"
+    if kind in ("str", "e", "d"):
+        return raw
+    try:
+        return float(raw)
+    except ValueError:
+        return raw
+
+
+def read_header_rows(input_path: Path, max_rows: int = HEADER_SCAN_ROWS) -> List[List[Any]]:
+    """Prime ``max_rows`` righe del primo foglio lette direttamente dall'archivio xlsx.
+
+    Serve al controllo preliminare delle intestazioni: dal foglio si leggono solo le
+    righe richieste e dalla tabella delle stringhe condivise solo fino all'ultima
+    stringa usata, senza caricare il resto della cartella di lavoro. Le righe hanno
+    la stessa forma di quelle passate a ``header_row_finder`` da
+    ``read_excel_streaming`` (le date restano numeri seriali, gli stili non si leggono).
+    Solleva ``zipfile.BadZipFile`` o ``KeyError`` se il file non è un xlsx leggibile.
+    """
+    with zipfile.ZipFile(input_path) as archive:
+        sheet_part, shared_part = _workbook_parts(archive)
+        rows: List[List[Any]] = []
+        with archive.open(sheet_part) as stream:
+            for _, element in ElementTree.iterparse(stream):
+                if element.tag != f"{SHEET_NS}row":
+                    continue
+                # Le righe vuote non sono scritte nel file: si ricompongono come fa openpyxl.
+                row_number = int(element.get("r", len(rows) + 1))
+                while len(rows) < min(row_number - 1, max_rows):
+                    rows.append([])
+                if len(rows) >= max_rows:
+                    break
+                values: List[Any] = []
+                for cell in element.iter(f"{SHEET_NS}c"):
+                    match = CELL_REF_PATTERN.match(cell.get("r", ""))
+                    column = _column_index(match.group(1)) if match else len(values)
+                    values.extend([None] * (column + 1 - len(values)))
+                    values[column] = _cell_value(cell)
+                rows.append(values)
+                element.clear()
+                if len(rows) >= max_rows:
+                    break
+
+        wanted = {value[1] for row in rows for value in row if isinstance(value, tuple)}
+        strings = _read_shared_strings(archive, shared_part, wanted)
+
+    return [
+        _convert_row(tuple(strings.get(value[1], "") if isinstance(value, tuple) else value for value in row))
+        for row in rows
+    ]
+
+
+def estimate_row_count(input_path: Path) -> int:
+    """Righe attese nel primo foglio, per stimare l'avanzamento della lettura.
+
+    Si usa il riferimento ``<dimension>`` all'inizio del foglio; se manca o non è
+    significativo si stima dalla dimensione del file.
+    """
+    try:
+        with zipfile.ZipFile(input_path) as archive:
+            sheet_part, _ = _workbook_parts(archive)
+            with archive.open(sheet_part) as stream:
+                for _, element in ElementTree.iterparse(stream, events=("start",)):
+                    if element.tag == f"{SHEET_NS}dimension":
+                        match = DIMENSION_ROWS_PATTERN.search(element.get("ref", ""))
+                        if match and int(match.group(1)) > 1:
+                            return int(match.group(1))
+                    if element.tag in (f"{SHEET_NS}dimension", f"{SHEET_NS}sheetData"):
+                        break
+    except Exception as exc:
+        logger.debug("Dimensioni del foglio non disponibili: %s", str(exc))
+    return max(1, Path(input_path).stat().st_size // XLSX_BYTES_PER_ROW)
@@ -1,17 +1,54 @@
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import copy
 import logging
+import pickle
 import re
+import zipfile
 
+import numpy as np
 import pandas as pd
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Alignment, Font, PatternFill
 from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
 
+from app.services.date_parser import DateParser
+from app.services.excel_reader import estimate_row_count, read_excel_streaming, read_header_rows
+from app.services.frame_memory import MemoryReport, compact_frame
+from app.services.header_resolver import HeaderResolver
+from app.services.input_cache import ParsedInputCache, load_cached
+from app.services.metrics import StageTimer
+from app.services.money import cents_to_amount, to_cents
+from app.services.periods import month_keys, month_label, month_sheet_suffix, parse_months, partition_by_month, select_months
+from app.services.progress import ROWS_PROGRESS_STEP, ProgressCallback, ProgressReporter
+from app.services.worker_pool import shared_process_pool
+
 
 logger = logging.getLogger(__name__)
 
+# Le selezioni (df[mask], df[colonne]) non vengono copiate: con il copy-on-write
+# di pandas 3 (requirements.txt) le modifiche successive non toccano il DataFrame di origine.
+
+
+def sdi_empty_mask(sdi_series: pd.Series, zero_is_empty: bool = True) -> pd.Series:
+    """Righe senza identificativo SDI, cioè fatture cartacee.
+
+    Classificazione unica per riepiloghi, fogli e confronto: vuoto, "nan", "none",
+    "null" e, con ``zero_is_empty``, un valore numerico pari a zero.
+    """
+    normalized = sdi_series.astype(str).str.strip().where(~sdi_series.isna(), "")
+    normalized = normalized.str.lower().str.replace(",", ".", regex=False)
+    empty_text_mask = normalized.isin(["", "nan", "none", "null"])
+    if not zero_is_empty:
+        return empty_text_mask
+    numeric = pd.to_numeric(normalized, errors="coerce")
+    zero_mask = numeric.eq(0) & ~numeric.isna()
+    return empty_text_mask | zero_mask
+
 
 class NFSFTFileProcessor:
     PROTOCOLLI_FASE2 = ["P", "2P", "LABI"]
@@ -92,180 +129,199 @@ class NFSFTFileProcessor:
         "RA_IMPOSTA": 0.0,
     }
 
-    def __init__(self) -> None:
+    EXCEL_MAX_ROWS = 1048576
+
+    FAT_DATREG_ALIASES = ("DATA_REG_FATTURA", "FAT_REG_FATTURA", "DATAREGFATTURA", "FATREGFATTURA", "DATAREGISTRAZIONE")
+    PROCESSED_HEADER_MAP = {
+        "RAGIONESOCIALE": "C_NOME",
+        "PROTOCOLLO": "FAT_PROT",
+        "NPROTOCOLLO": "FAT_NUM",
+        "NFATTURE": "FAT_NDOC",
+        "DATAFATTURE": "FAT_DATDOC",
+        "DATAREGISTRAZIONE": "FAT_DATREG",
+        "IMPOSTA": "FAT_TOTIVA",
+        "TOTIMPONIBILE": "IMPONIBILE",
+        "TOTIMPFATTURE": "FAT_TOTFAT",
+        "RITCODICETRIBUTO": "RA_CODTRIB",
+        "RITIMPOSTA": "RA_IMPOSTA",
+        "RITIMP": "RA_IMPON",
+        "IDENTIFICATIVOSDI": "TMC_G8",
+    }
+    FAT_DATREG_ALT_MAP = {
+        "DATAREGFATTURA": "FAT_DATREG",
+        "DATAREG_FATTURA": "FAT_DATREG",
+        "FATREGFATTURA": "FAT_DATREG",
+        "FATREG_FATTURA": "FAT_DATREG",
+        "DATA_REG_FATTURA": "FAT_DATREG",
+        "FAT_REG_FATTURA": "FAT_DATREG",
+    }
+    HEADER_ROW_KEYS = frozenset(REQUIRED_COLUMNS) | frozenset(OPTIONAL_COLUMNS_DEFAULTS) | {"DATA_REG_FATTURA", "FAT_REG_FATTURA"}
+    # Intestazioni dell'export NFS originale.
+    HEADER_RESOLVER = HeaderResolver(
+        list(zip(REQUIRED_COLUMNS, REQUIRED_COLUMNS))
+        + list(zip(OPTIONAL_COLUMNS_DEFAULTS, OPTIONAL_COLUMNS_DEFAULTS))
+        + [(alias, "FAT_DATREG") for alias in FAT_DATREG_ALIASES],
+        required=REQUIRED_COLUMNS,
+    )
+    # Accetta anche le intestazioni del file già elaborato ("Ragione sociale", "Protocollo", ...).
+    PROCESSED_HEADER_RESOLVER = HeaderResolver(
+        list(PROCESSED_HEADER_MAP.items())
+        + list(FAT_DATREG_ALT_MAP.items())
+        + list(zip(REQUIRED_COLUMNS, REQUIRED_COLUMNS))
+        + list(zip(OPTIONAL_COLUMNS_DEFAULTS, OPTIONAL_COLUMNS_DEFAULTS))
+        + [(alias, "FAT_DATREG") for alias in FAT_DATREG_ALIASES],
+        required=REQUIRED_COLUMNS,
+    )
+    # Nell'export NFS anche un identificativo SDI pari a zero indica una fattura cartacea.
+    SDI_ZERO_IS_EMPTY = True
+
+    def __init__(
+        self,
+        input_cache: Optional[ParsedInputCache] = None,
+        detail_preview_rows: Optional[int] = None,
+        compact_frames: bool = False,
+        memory_report: bool = False,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> None:
         self.all_protocols = self.PROTOCOLLI_FASE2 + self.PROTOCOLLI_FASE3
+        self.input_cache = input_cache
+        self.detail_preview_rows = detail_preview_rows
+        self.compact_frames = compact_frames
+        self.memory_report = MemoryReport(type(self).__name__, enabled=memory_report)
+        self.progress = ProgressReporter(on_progress)
+        self.timings = StageTimer()
+        self.date_parser = DateParser()
+
+    def _load_cached(self, input_path: Path, variant: str, loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        return load_cached(self.input_cache, input_path, variant, loader)
+
+    def _compact(self, df: pd.DataFrame) -> pd.DataFrame:
+        return compact_frame(df) if self.compact_frames else df
 
     def validate_file(self, df: pd.DataFrame) -> None:
-        def normalize_col_name(value: Any) -> str:
-            text = str(value).strip().upper()
-            return re.sub(r"[^A-Z0-9]", "", text)
+        plan = self.HEADER_RESOLVER.resolve(df.columns)
+        df.columns = list(plan.labels)
 
-        df.columns = [str(c).strip() for c in df.columns]
-        normalized_to_original = {normalize_col_name(c): c for c in df.columns}
-
-        for canonical in list(self.REQUIRED_COLUMNS) + list(self.OPTIONAL_COLUMNS_DEFAULTS.keys()):
-            if canonical in df.columns:
-                continue
-            key = normalize_col_name(canonical)
-            original = normalized_to_original.get(key)
-            if original and original in df.columns:
-                df.rename(columns={original: canonical}, inplace=True)
-
-        if "FAT_DATREG" not in df.columns:
-            for alt in ("DATA_REG_FATTURA", "FAT_REG_FATTURA", "DATAREGFATTURA", "FATREGFATTURA", "DATAREGISTRAZIONE"):
-                original = normalized_to_original.get(normalize_col_name(alt))
-                if original and original in df.columns:
-                    df.rename(columns={original: "FAT_DATREG"}, inplace=True)
-                    break
-
-        missing_cols = [col for col in self.REQUIRED_COLUMNS if col not in df.columns]
-        if missing_cols:
-            raise ValueError(f"Colonne mancanti: {', '.join(missing_cols)}")
+        if plan.missing:
+            raise ValueError(f"Colonne mancanti: {', '.join(plan.missing)}")
 
         for col, default in self.OPTIONAL_COLUMNS_DEFAULTS.items():
             if col not in df.columns:
                 df[col] = default
 
-    def _read_excel_flexible(self, input_path: Path) -> pd.DataFrame:
+    @classmethod
+    def preflight(cls, input_path: Path) -> None:
+        """Controllo rapido delle intestazioni subito dopo il caricamento.
+
+        Legge solo le prime righe del file e solleva ``ValueError`` con lo stesso
+        messaggio di ``validate_file`` se mancano colonne obbligatorie.
+        """
+        header = cls._sniff_nfs_header(input_path)
+        if header is None:
+            return
+        missing = cls.HEADER_RESOLVER.resolve(header).missing
+        if missing:
+            raise ValueError(f"Colonne mancanti: {', '.join(missing)}")
+
+    @staticmethod
+    def _sniff_header_rows(input_path: Path) -> Optional[List[List[Any]]]:
         try:
-            df = pd.read_excel(input_path)
-            if len(df.columns) > 0:
-                df.columns = [str(c).strip() for c in df.columns]
-                has_real_headers = any(col and not col.lower().startswith("unnamed") for col in df.columns)
-                if has_real_headers:
-                    return df
-        except Exception:
-            pass
-
-        try:
-            raw = pd.read_excel(input_path, header=None, nrows=25)
-        except Exception:
-            return pd.read_excel(input_path)
-
-        wanted = set(self.REQUIRED_COLUMNS) | set(self.OPTIONAL_COLUMNS_DEFAULTS.keys()) | {"DATA_REG_FATTURA", "FAT_REG_FATTURA"}
-        wanted_upper = {str(x).strip().upper() for x in wanted}
-
-        header_row_idx: Optional[int] = None
-        for idx in range(len(raw)):
-            values = raw.iloc[idx].tolist()
+            return read_header_rows(input_path)
+        except zipfile.BadZipFile:
+            raise ValueError("Il file caricato non è un file Excel (.xlsx) valido")
+        except Exception as exc:
+            # Struttura non prevista: il controllo si salta e decide la lettura completa.
+            logger.warning("Controllo preliminare delle intestazioni non riuscito: %s", str(exc))
+            return None
+
+    @classmethod
+    def _sniff_nfs_header(cls, input_path: Path) -> Optional[List[Any]]:
+        """Intestazione NFS come la vede ``_read_excel_flexible`` con la proiezione delle colonne."""
+        rows = cls._sniff_header_rows(input_path)
+        if rows is None:
+            return None
+        if not rows:
+            return []
+        header = rows[cls._find_header_row(rows) or 0]
+        return [str(header[i]).strip() for i in cls.PROCESSED_HEADER_RESOLVER.select_columns(header)]
+
+    @classmethod
+    def _find_header_row(cls, rows: List[List[Any]]) -> Optional[int]:
+        for idx, values in enumerate(rows):
             normalized = {str(v).strip().upper() for v in values if v is not None and str(v).strip() != ""}
-            if len(normalized & wanted_upper) >= 5:
-                header_row_idx = idx
-                break
+            if len(normalized & cls.HEADER_ROW_KEYS) >= 5:
+                return idx
+        return None
 
-        if header_row_idx is None:
-            return pd.read_excel(input_path)
+    def _read_excel_flexible(
+        self,
+        input_path: Path,
+        project_columns: bool = False,
+        on_rows: Optional[Callable[[int], None]] = None,
+    ) -> pd.DataFrame:
+        try:
+            df = read_excel_streaming(
+                input_path,
+                header_row_finder=self._find_header_row,
+                column_selector=self.PROCESSED_HEADER_RESOLVER.select_columns if project_columns else None,
+                on_rows=on_rows,
+            )
+        except Exception as exc:
+            logger.warning("Lettura in streaming non riuscita, uso pd.read_excel: %s", str(exc))
+            df = pd.read_excel(input_path)
 
-        df = pd.read_excel(input_path, header=header_row_idx)
         df.columns = [str(c).strip() for c in df.columns]
         return df
 
-    def _filter_january_2025(self, df: pd.DataFrame, date_column: str) -> pd.DataFrame:
-        if date_column not in df.columns:
-            return df.iloc[0:0].copy()
-        date_series = pd.to_datetime(df[date_column], errors="coerce")
-        start = pd.Timestamp(year=2025, month=1, day=1)
-        end = pd.Timestamp(year=2025, month=1, day=31)
-        mask = date_series.between(start, end)
-        return df[mask].copy()
-
-    def _split_by_sdi(self, df: pd.DataFrame, sdi_column: str) -> tuple[pd.DataFrame, pd.DataFrame]:
-        sdi_series = df[sdi_column]
-        normalized = sdi_series.astype(str).str.strip().where(~sdi_series.isna(), "")
-        normalized = normalized.str.lower().str.replace(",", ".", regex=False)
-        empty_text_mask = normalized.isin(["", "nan", "none", "null"])
-        numeric = pd.to_numeric(normalized, errors="coerce")
-        zero_mask = numeric.eq(0) & ~numeric.isna()
-        empty_mask = empty_text_mask | zero_mask
-        cartacee_df = df[empty_mask].copy()
-        elettroniche_df = df[~empty_mask].copy()
+    def _sdi_empty_mask(self, sdi_series: pd.Series) -> pd.Series:
+        return sdi_empty_mask(sdi_series, zero_is_empty=self.SDI_ZERO_IS_EMPTY)
+
+    def _split_by_sdi(
+        self, df: pd.DataFrame, sdi_column: str, empty_mask: Optional[pd.Series] = None
+    ) -> tuple[pd.DataFrame, pd.DataFrame]:
+        if empty_mask is None:
+            empty_mask = self._sdi_empty_mask(df[sdi_column])
+        cartacee_df = df[empty_mask]
+        elettroniche_df = df[~empty_mask]
         return cartacee_df, elettroniche_df
 
-    def process_file(self, input_path: Path, output_path: Path) -> Dict[str, Any]:
+    def process_file(self, input_path: Path, output_path: Optional[Path] = None) -> Dict[str, Any]:
+        """Elabora il file e restituisce il riepilogo; senza ``output_path`` (batch) non scrive l'output."""
         try:
             logger.info("Caricamento file: %s", input_path)
-            df = self._read_excel_flexible(input_path)
+            self.progress.start()
+            self.timings.start()
+            self.memory_report.start()
+            self.progress.stage("lettura", rows_total=estimate_row_count(input_path))
+            self.timings.mark("lettura")
+            df = self._load_cached(
+                input_path,
+                "nfs",
+                lambda: self._read_excel_flexible(input_path, project_columns=True, on_rows=self.progress.advance),
+            )
             df.columns = [str(c).strip() for c in df.columns]
+            df = self._compact(df)
+            self.memory_report.record("lettura", df)
 
+            self.progress.stage("validazione")
+            self.timings.mark("intestazioni")
             self.validate_file(df)
 
-            df["FAT_PROT"] = df["FAT_PROT"].astype(str).str.strip().str.upper()
-            totale_iniziale = len(df)
-            df_senza_duplicati = df.drop_duplicates(subset=["FAT_NDOC", "C_NOME"]).copy()
-            duplicati_rimossi = totale_iniziale - len(df_senza_duplicati)
-            df_filtrato = df_senza_duplicati[df_senza_duplicati["FAT_PROT"].isin(self.all_protocols)].copy()
-
-            if len(df_filtrato) == 0:
-                raise ValueError("Nessun protocollo valido trovato nel file")
-
-            df_filtrato["RA_CODTRIB"] = (
-                df_filtrato["RA_CODTRIB"]
-                .astype(str)
-                .str.strip()
-                .where(lambda value: value.isin(["I9", "RO"]), "")
-            )
-
-            colonne_ordinate = [
-                "C_NOME",
-                "FAT_DATDOC",
-                "FAT_NDOC",
-                "FAT_DATREG",
-                "FAT_PROT",
-                "FAT_NUM",
-                "FAT_TOTIVA",
-                "IMPONIBILE",
-                "FAT_TOTFAT",
-                "RA_CODTRIB",
-                "RA_IMPOSTA",
-                "RA_IMPON",
-                "TMC_G8",
-            ]
-
-            df_finale = df_filtrato[colonne_ordinate].copy()
-            df_finale.columns = [
-                "Ragione Sociale",
-                "Data Fatture",
-                "N. Fatture",
-                "Data Registrazione",
-                "Protocollo",
-                "N. Protocollo",
-                "Imposta",
-                "Tot. Imponibile",
-                "Tot. Imp. Fatture",
-                "Rit. Codice Tributo",
-                "Rit. Imposta",
-                "Rit. Imp.",
-                "Identificativo SDI",
-            ]
-
-            df_finale["Data Fatture"] = pd.to_datetime(df_finale["Data Fatture"], errors="coerce")
-            df_finale["Data Registrazione"] = pd.to_datetime(df_finale["Data Registrazione"], errors="coerce")
-
-            df_finale = df_finale.sort_values("Data Registrazione")
-
-            df_dati = df_finale.copy()
-            if "Data Registrazione" in df_dati.columns:
-                df_dati["Imponibile"] = df_dati["Data Registrazione"]
-                df_dati = df_dati.drop(columns=["Data Registrazione"], errors="ignore")
-            df_dati = df_dati.drop(columns=["Tot. Imponibile"], errors="ignore")
-            ordered_columns = [
-                "Ragione Sociale",
-                "Data Fatture",
-                "N. Fatture",
-                "Protocollo",
-                "N. Protocollo",
-                "Imposta",
-                "Imponibile",
-                "Tot. Imp. Fatture",
-                "Rit. Codice Tributo",
-                "Rit. Imposta",
-                "Rit. Imp.",
-                "Identificativo SDI",
-            ]
-            df_dati = df_dati[[col for col in ordered_columns if col in df_dati.columns]]
-
-            stats = self._calculate_stats(df_finale, duplicati_rimossi)
-            self._create_excel_output(df_finale, output_path, display_df=df_dati)
+            self.progress.stage("deduplica")
+            df_finale, df_dati, duplicati_rimossi = self._build_output_frames(df)
+            self.progress.stage("aggregazione")
+            self.timings.mark("aggregazione")
+            cartacee_mask = self._sdi_empty_mask(df_finale["Identificativo SDI"])
+            stats = self._calculate_stats(df_finale, duplicati_rimossi, cartacee_mask)
+            self.memory_report.record("elaborazione", df_finale, df_dati)
+            if output_path is not None:
+                self.progress.stage("scrittura", rows_total=len(df_dati))
+                self._create_excel_output(df_finale, output_path, display_df=df_dati, cartacee_mask=cartacee_mask)
+                self.memory_report.record("output")
+            stats["stages"] = self.timings.finish()
+            if self.memory_report.enabled:
+                stats["memory"] = self.memory_report.finish()
+            self.progress.finish()
 
             logger.info("File elaborato con successo: %s", stats)
             return stats
@@ -273,10 +329,90 @@ class NFSFTFileProcessor:
             logger.error("Errore elaborazione file: %s", str(exc))
             raise
 
-    def _calculate_stats(self, df: pd.DataFrame, duplicates_removed: int) -> Dict[str, Any]:
-        cartacee_df, elettroniche_df = self._split_by_sdi(df, "Identificativo SDI")
-        fase2_count = int(len(cartacee_df))
-        fase3_count = int(len(elettroniche_df))
+    def _build_output_frames(self, df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, int]:
+        self.timings.mark("deduplica")
+        df["FAT_PROT"] = df["FAT_PROT"].astype(str).str.strip().str.upper()
+        totale_iniziale = len(df)
+        df_senza_duplicati = df.drop_duplicates(subset=["FAT_NDOC", "C_NOME"])
+        duplicati_rimossi = totale_iniziale - len(df_senza_duplicati)
+        df_filtrato = df_senza_duplicati[df_senza_duplicati["FAT_PROT"].isin(self.all_protocols)]
+
+        if len(df_filtrato) == 0:
+            raise ValueError("Nessun protocollo valido trovato nel file")
+
+        self.timings.mark("normalizzazione")
+        df_filtrato["RA_CODTRIB"] = (
+            df_filtrato["RA_CODTRIB"]
+            .astype(str)
+            .str.strip()
+            .where(lambda value: value.isin(["I9", "RO"]), "")
+        )
+
+        colonne_ordinate = [
+            "C_NOME",
+            "FAT_DATDOC",
+            "FAT_NDOC",
+            "FAT_DATREG",
+            "FAT_PROT",
+            "FAT_NUM",
+            "FAT_TOTIVA",
+            "IMPONIBILE",
+            "FAT_TOTFAT",
+            "RA_CODTRIB",
+            "RA_IMPOSTA",
+            "RA_IMPON",
+            "TMC_G8",
+        ]
+
+        df_finale = df_filtrato[colonne_ordinate]
+        df_finale.columns = [
+            "Ragione Sociale",
+            "Data Fatture",
+            "N. Fatture",
+            "Data Registrazione",
+            "Protocollo",
+            "N. Protocollo",
+            "Imposta",
+            "Tot. Imponibile",
+            "Tot. Imp. Fatture",
+            "Rit. Codice Tributo",
+            "Rit. Imposta",
+            "Rit. Imp.",
+            "Identificativo SDI",
+        ]
+
+        df_finale["Data Fatture"] = self.date_parser.to_datetime(df_finale["Data Fatture"])
+        df_finale["Data Registrazione"] = self.date_parser.to_datetime(df_finale["Data Registrazione"])
+
+        df_finale = df_finale.sort_values("Data Registrazione")
+
+        # Nel foglio Dati la colonna "Imponibile" riporta la data di registrazione.
+        df_dati = df_finale.drop(columns=["Tot. Imponibile"]).rename(columns={"Data Registrazione": "Imponibile"})
+        ordered_columns = [
+            "Ragione Sociale",
+            "Data Fatture",
+            "N. Fatture",
+            "Protocollo",
+            "N. Protocollo",
+            "Imposta",
+            "Imponibile",
+            "Tot. Imp. Fatture",
+            "Rit. Codice Tributo",
+            "Rit. Imposta",
+            "Rit. Imp.",
+            "Identificativo SDI",
+        ]
+        df_dati = df_dati[[col for col in ordered_columns if col in df_dati.columns]]
+
+        return df_finale, df_dati, duplicati_rimossi
+
+    def _calculate_stats(
+        self, df: pd.DataFrame, duplicates_removed: int, cartacee_mask: Optional[pd.Series] = None
+    ) -> Dict[str, Any]:
+        if cartacee_mask is None:
+            cartacee_mask = self._sdi_empty_mask(df["Identificativo SDI"])
+        fase2_count = int(cartacee_mask.sum())
+        fase3_count = int(len(df) - fase2_count)
         protocols_fase2 = {"Cartacee": fase2_count}
         protocols_fase3 = {"Elettroniche": fase3_count}
 
@@ -290,18 +426,25 @@ class NFSFTFileProcessor:
         }
 
     def _count_by_protocol(self, df: pd.DataFrame, protocols: list) -> Dict[str, int]:
-        counts = {}
-        for prot in protocols:
-            counts[prot] = len(df[df["Protocollo"] == prot])
-        return counts
+        counts = df["Protocollo"].value_counts()
+        return {prot: int(counts.get(prot, 0)) for prot in protocols}
+
+    def _aggregate_by_protocol(self, df: pd.DataFrame, cartacee_mask: pd.Series, protocols: list) -> pd.DataFrame:
+        imponibile = to_cents(df["Tot. Imponibile"])
+        grouped = imponibile.groupby([cartacee_mask.to_numpy(), df["Protocollo"].to_numpy()])
+        totals = pd.DataFrame({"count": grouped.size(), "imponibile": grouped.sum()})
+        totals = totals.reindex(pd.MultiIndex.from_product([[True, False], protocols]), fill_value=0)
+        totals["imponibile"] = cents_to_amount(totals["imponibile"])
+        return totals
 
     def _create_excel_output(
         self,
         df: pd.DataFrame,
         output_path: Path,
         display_df: Optional[pd.DataFrame] = None,
+        cartacee_mask: Optional[pd.Series] = None,
     ) -> None:
-        wb = Workbook()
+        wb = Workbook(write_only=True)
 
         header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
         header_font = Font(bold=True, color="FFFFFF")
@@ -318,17 +461,20 @@ class NFSFTFileProcessor:
             total_font,
             date_columns=["Data Fatture", "Data Registrazione", "Imponibile"],
             money_columns=["Imposta", "Tot. Imponibile", "Tot. Imp. Fatture", "Rit. Imposta", "Rit. Imp."],
-            use_active=True,
         )
 
-        cartacee_df, elettroniche_df = self._split_by_sdi(df, "Identificativo SDI")
+        self.timings.mark("aggregazione")
         all_protocols = self.PROTOCOLLI_FASE2 + self.PROTOCOLLI_FASE3
         all_descriptions = {**self.DESCRIZIONI_FASE2, **self.DESCRIZIONI_FASE3}
+        if cartacee_mask is None:
+            cartacee_mask = self._sdi_empty_mask(df["Identificativo SDI"])
+        protocol_totals = self._aggregate_by_protocol(df, cartacee_mask, all_protocols)
 
+        self.timings.mark("scrittura", sheet="Fatture Cartacee")
         ws_nota2 = wb.create_sheet("Fatture Cartacee")
         self._create_summary_sheet(
             ws_nota2,
-            cartacee_df,
+            protocol_totals.loc[True],
             all_protocols,
             all_descriptions,
             header_fill,
@@ -337,10 +483,11 @@ class NFSFTFileProcessor:
             total_font,
         )
 
+        self.timings.mark("scrittura", sheet="Fatture Elettroniche")
         ws_nota3 = wb.create_sheet("Fatture Elettroniche")
         self._create_summary_sheet(
             ws_nota3,
-            elettroniche_df,
+            protocol_totals.loc[False],
             all_protocols,
             all_descriptions,
             header_fill,
@@ -349,8 +496,33 @@ class NFSFTFileProcessor:
             total_font,
         )
 
+        self.timings.mark("salvataggio")
         wb.save(output_path)
 
+    def _append_styled_row(
+        self,
+        ws,
+        values: List[Any],
+        fill: Optional[PatternFill] = None,
+        font: Optional[Font] = None,
+        alignment: Optional[Alignment] = None,
+        number_formats: Optional[Dict[int, str]] = None,
+    ) -> None:
+        number_formats = number_formats or {}
+        row = []
+        for idx, value in enumerate(values):
+            cell = WriteOnlyCell(ws, value=value)
+            if fill is not None:
+                cell.fill = fill
+            if font is not None:
+                cell.font = font
+            if alignment is not None:
+                cell.alignment = alignment
+            if idx in number_formats:
+                cell.number_format = number_formats[idx]
+            row.append(cell)
+        ws.append(row)
+
     def _add_dataframe_sheet(
         self,
         wb: Workbook,
@@ -365,110 +537,122 @@ class NFSFTFileProcessor:
         date_format: str = "mm/dd/yyyy",
         add_totals: bool = True,
         auto_size: bool = True,
-        use_active: bool = False,
+        max_rows_per_sheet: Optional[int] = None,
     ):
-        ws = wb.active if use_active else wb.create_sheet(title)
-        ws.title = title
-
-        for r in dataframe_to_rows(df, index=False, header=True):
-            ws.append(r)
-
-        for cell in ws[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
+        self.timings.mark("scrittura", sheet=title)
+        max_rows_per_sheet = max_rows_per_sheet or self.EXCEL_MAX_ROWS
+        columns = list(df.columns)
 
+        column_widths: Dict[str, float] = {}
         if auto_size:
             sample_rows = 50
-            max_row = min(ws.max_row, sample_rows + 1)
-            for column in ws.iter_cols(max_row=max_row):
-                max_len = max((len(str(c.value or "")) for c in column), default=8)
-                letter = column[0].column_letter
-                ws.column_dimensions[letter].width = min(max_len + 2, 45)
+            sample = [columns] + list(islice(dataframe_to_rows(df, index=False, header=False), sample_rows))
+            for idx in range(len(columns)):
+                max_len = max((len(str(row[idx] or "")) for row in sample), default=8)
+                column_widths[get_column_letter(idx + 1)] = min(max_len + 2, 45)
 
         date_columns = date_columns or []
         money_columns = money_columns or []
         money_columns = [column for column in money_columns if column in df.columns]
-        header_index = {cell.value: cell.column for cell in ws[1]}
         money_format = "#,##0.00"
 
+        column_formats: Dict[int, str] = {}
         for column_name in date_columns:
-            column_index = header_index.get(column_name)
-            if column_index:
-                for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=column_index, max_col=column_index):
-                    for cell in row:
-                        if cell.value is not None:
-                            cell.number_format = date_format
-
+            if column_name in columns:
+                column_formats[columns.index(column_name)] = date_format
         for column_name in money_columns:
-            column_index = header_index.get(column_name)
-            if column_index:
-                for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=column_index, max_col=column_index):
-                    for cell in row:
-                        if cell.value is not None:
-                            cell.number_format = money_format
+            column_formats[columns.index(column_name)] = money_format
+
+        pages = 0
+        ws = None
+        sheet_rows = 0
+
+        def open_page():
+            nonlocal pages, ws, sheet_rows
+            pages += 1
+            ws = wb.create_sheet(title if pages == 1 else f"{title} ({pages})")
+            for letter, width in column_widths.items():
+                ws.column_dimensions[letter].width = width
+            self._append_styled_row(
+                ws,
+                columns,
+                fill=header_fill,
+                font=header_font,
+                alignment=Alignment(horizontal="center", vertical="center"),
+            )
+            sheet_rows = 1
+
+        open_page()
+        self.progress.advance(0, sheet=title)
+        written = 0
+        for values in dataframe_to_rows(df, index=False, header=False):
+            if sheet_rows >= max_rows_per_sheet:
+                open_page()
+            for idx, number_format in column_formats.items():
+                if values[idx] is not None:
+                    cell = WriteOnlyCell(ws, value=values[idx])
+                    cell.number_format = number_format
+                    values[idx] = cell
+            ws.append(values)
+            sheet_rows += 1
+            written += 1
+            if written % ROWS_PROGRESS_STEP == 0:
+                self.progress.advance(ROWS_PROGRESS_STEP)
+        self.progress.advance(written % ROWS_PROGRESS_STEP)
 
         if money_columns and add_totals:
-            totals = {}
+            if sheet_rows >= max_rows_per_sheet:
+                open_page()
+            total_row = ["TOTALE"] + [""] * (len(columns) - 1)
             for column_name in money_columns:
-                totals[column_name] = pd.to_numeric(df[column_name], errors="coerce").sum()
-            total_row = ["TOTALE"] + [""] * (len(df.columns) - 1)
-            for column_name, total_value in totals.items():
-                total_row[df.columns.get_loc(column_name)] = total_value
-            ws.append(total_row)
-            total_row_index = ws.max_row
-            for cell in ws[total_row_index]:
-                cell.fill = total_fill
-                cell.font = total_font
-            for column_name in money_columns:
-                column_index = header_index.get(column_name)
-                if column_index:
-                    ws.cell(row=total_row_index, column=column_index).number_format = money_format
+                total_row[columns.index(column_name)] = cents_to_amount(to_cents(df[column_name]).sum())
+            self._append_styled_row(
+                ws,
+                total_row,
+                fill=total_fill,
+                font=total_font,
+                number_formats={columns.index(column_name): money_format for column_name in money_columns},
+            )
 
         return ws
 
-    def _create_summary_sheet(self, ws, df, protocols, descriptions, header_fill, header_font, total_fill, total_font):
-        ws["A1"] = "PROTOCOLLO"
-        ws["B1"] = "DESCRIZIONE"
-        ws["C1"] = "NUMERO TOTALE"
-        ws["D1"] = "IMPONIBILE"
+    def _create_summary_sheet(self, ws, totals, protocols, descriptions, header_fill, header_font, total_fill, total_font):
+        ws.column_dimensions["A"].width = 15
+        ws.column_dimensions["B"].width = 40
+        ws.column_dimensions["C"].width = 20
+        ws.column_dimensions["D"].width = 20
 
-        for cell in ws[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
+        self._append_styled_row(
+            ws,
+            ["PROTOCOLLO", "DESCRIZIONE", "NUMERO TOTALE", "IMPONIBILE"],
+            fill=header_fill,
+            font=header_font,
+            alignment=Alignment(horizontal="center", vertical="center"),
+        )
 
         money_format = "#,##0.00"
         row = 2
         for prot in protocols:
-            count = len(df[df["Protocollo"] == prot])
-            imponibile_totale = pd.to_numeric(
-                df.loc[df["Protocollo"] == prot, "Tot. Imponibile"], errors="coerce"
-            ).sum()
-            ws[f"A{row}"] = prot
-            ws[f"B{row}"] = descriptions[prot]
-            ws[f"C{row}"] = count
-            ws[f"D{row}"] = imponibile_totale
-            ws[f"D{row}"].number_format = money_format
+            count = int(totals.at[prot, "count"])
+            imponibile_totale = float(totals.at[prot, "imponibile"])
+            self._append_styled_row(
+                ws,
+                [prot, descriptions[prot], count, imponibile_totale],
+                number_formats={3: money_format},
+            )
             row += 1
 
-        ws[f"A{row}"] = "TOTALE"
-        ws[f"A{row}"].font = total_font
-        ws[f"C{row}"] = f"=SUM(C2:C{row - 1})"
-        ws[f"C{row}"].font = total_font
-        ws[f"D{row}"] = f"=SUM(D2:D{row - 1})"
-        ws[f"D{row}"].number_format = money_format
-        for cell in ws[row]:
-            cell.fill = total_fill
-            cell.font = total_font
-
-        ws.column_dimensions["A"].width = 15
-        ws.column_dimensions["B"].width = 40
-        ws.column_dimensions["C"].width = 20
-        ws.column_dimensions["D"].width = 20
+        self._append_styled_row(
+            ws,
+            ["TOTALE", None, f"=SUM(C2:C{row - 1})", f"=SUM(D2:D{row - 1})"],
+            fill=total_fill,
+            font=total_font,
+            number_formats={3: money_format},
+        )
 
 
 class PisaFTFileProcessor(NFSFTFileProcessor):
+    SDI_ZERO_IS_EMPTY = False
     SELECTED_LETTERS = ["H", "C", "D", "E", "F", "O", "L", "J", "A"]
     RENAME_MAP = {
         "H": "Ragione Sociale",
@@ -477,13 +661,58 @@ class PisaFTFileProcessor(NFSFTFileProcessor):
     }
     MONEY_COLUMNS = ["Imponibile", "Imp.Tot. Fatture"]
     USECOLS_RANGE = "A:O"
-    MAX_DETAIL_ROWS = 5000
+    # Mesi di pagamento elaborati se non indicati (AAAA-MM, oppure ALL_MONTHS per tutti).
+    DEFAULT_MONTHS = ("2025-01",)
+
+    def __init__(
+        self,
+        input_cache: Optional[ParsedInputCache] = None,
+        detail_preview_rows: Optional[int] = None,
+        compact_frames: bool = False,
+        memory_report: bool = False,
+        months: Optional[Sequence[str]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> None:
+        super().__init__(
+            input_cache=input_cache,
+            detail_preview_rows=detail_preview_rows,
+            compact_frames=compact_frames,
+            memory_report=memory_report,
+            on_progress=on_progress,
+        )
+        self.months = parse_months(months or self.DEFAULT_MONTHS)
+
+    @classmethod
+    def preflight(cls, input_path: Path) -> None:
+        # Le colonne sono posizionali: basta che le prime righe arrivino fino all'ultima lettera usata.
+        rows = cls._sniff_header_rows(input_path)
+        if rows is None:
+            return
+        width = max((len(row) for row in rows), default=0)
+        missing_letters = [
+            letter for letter, index in zip(cls.SELECTED_LETTERS, cls._letters_to_indices(cls.SELECTED_LETTERS)) if index >= width
+        ]
+        if missing_letters:
+            raise ValueError(f"Colonne mancanti: {', '.join(missing_letters)}")
 
     def process_file(self, input_path: Path, output_path: Path) -> Dict[str, Any]:
         try:
             logger.info("Caricamento file Pisa Pagato: %s", input_path)
-            df = pd.read_excel(input_path, usecols=self.USECOLS_RANGE, dtype=str)
+            self.progress.start()
+            self.timings.start()
+            self.memory_report.start()
+            self.progress.stage("lettura")
+            self.timings.mark("lettura")
+            df = self._load_cached(
+                input_path,
+                "pisa-pagato",
+                lambda: pd.read_excel(input_path, usecols=self.USECOLS_RANGE, dtype=str),
+            )
+            df = self._compact(df)
+            self.memory_report.record("lettura", df)
 
+            self.progress.stage("validazione")
+            self.timings.mark("intestazioni")
             required_indices = self._letters_to_indices(self.SELECTED_LETTERS)
             max_index = max(required_indices)
             if df.shape[1] <= max_index:
@@ -492,25 +721,51 @@ class PisaFTFileProcessor(NFSFTFileProcessor):
                 ]
                 raise ValueError(f"Colonne mancanti: {', '.join(missing_letters)}")
 
+            self.timings.mark("normalizzazione")
             data_pagamento_column = df.columns[self._letters_to_indices(["F"])[0]]
             pagamento_series = df[data_pagamento_column]
             pagamento_mask = ~(pagamento_series.isna() | (pagamento_series.astype(str).str.strip() == ""))
-            df_pagato = df[pagamento_mask].copy()
+            df_pagato = df[pagamento_mask]
 
             selected_indices = self._letters_to_indices(self.SELECTED_LETTERS)
             selected_columns = []
             for letter, index in zip(self.SELECTED_LETTERS, selected_indices):
                 selected_columns.append(self.RENAME_MAP.get(letter) or df_pagato.columns[index])
 
-            df_finale = df_pagato.iloc[:, selected_indices].copy()
+            self.progress.stage("aggregazione")
+            self.timings.mark("aggregazione")
+            df_finale = df_pagato.iloc[:, selected_indices]
             df_finale.columns = selected_columns
             data_pagamento_column_name = selected_columns[self.SELECTED_LETTERS.index("F")]
-            df_finale = self._filter_january_2025(df_finale, data_pagamento_column_name)
+            month_key = month_keys(self.date_parser.to_datetime(df_finale[data_pagamento_column_name]))
+            months = select_months(month_key, self.months)
+            month_mask = month_key.isin(months)
+            df_finale = df_finale[month_mask]
+            monthly = partition_by_month(df_finale, month_key[month_mask], months)
 
             sdi_column = df.columns[self._letters_to_indices(["A"])[0]]
-            cartacee_df, elettroniche_df = self._split_by_sdi(df_finale, sdi_column)
+            # Classificazione calcolata una volta e riusata per i fogli mensili.
+            empty_mask = self._sdi_empty_mask(df_finale[sdi_column])
+            cartacee_df, elettroniche_df = self._split_by_sdi(df_finale, sdi_column, empty_mask)
+            monthly_split = {
+                month: self._split_by_sdi(month_df, sdi_column, empty_mask.loc[month_df.index])
+                for month, month_df in monthly.items()
+            }
             df_dati = self._build_pisa_dati(df_finale)
-            self._create_excel_output(df_finale, cartacee_df, elettroniche_df, output_path, display_df=df_dati)
+            self.memory_report.record("elaborazione", df_finale, df_dati)
+            # Con più mesi ogni riga viene scritta anche nel foglio "Dati" del suo mese.
+            self.progress.stage("scrittura", rows_total=len(df_dati) + (len(df_finale) if len(months) > 1 else 0))
+            self._create_excel_output(
+                df_finale,
+                cartacee_df,
+                elettroniche_df,
+                output_path,
+                display_df=df_dati,
+                monthly=monthly if len(months) > 1 else None,
+                monthly_split=monthly_split,
+            )
+            self.memory_report.record("output")
+            self.progress.finish()
             stats = {
                 "total_records": len(df_finale),
                 "fase2_records": len(cartacee_df),
@@ -518,7 +773,18 @@ class PisaFTFileProcessor(NFSFTFileProcessor):
                 "duplicates_removed": 0,
                 "protocols_fase2": {"Cartacee": len(cartacee_df)},
                 "protocols_fase3": {"Elettroniche": len(elettroniche_df)},
+                "months": {
+                    month_label(month): {
+                        "total_records": len(monthly[month]),
+                        "fase2_records": len(cart),
+                        "fase3_records": len(elet),
+                    }
+                    for month, (cart, elet) in monthly_split.items()
+                },
             }
+            stats["stages"] = self.timings.finish()
+            if self.memory_report.enabled:
+                stats["memory"] = self.memory_report.finish()
             logger.info("File Pisa Pagato elaborato con successo: %s", stats)
             return stats
         except Exception as exc:
@@ -532,8 +798,10 @@ class PisaFTFileProcessor(NFSFTFileProcessor):
         elettroniche_df: pd.DataFrame,
         output_path: Path,
         display_df: Optional[pd.DataFrame] = None,
+        monthly: Optional[Dict[pd.Period, pd.DataFrame]] = None,
+        monthly_split: Optional[Dict[pd.Period, tuple[pd.DataFrame, pd.DataFrame]]] = None,
     ) -> None:
-        wb = Workbook()
+        wb = Workbook(write_only=True)
 
         header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
         header_font = Font(bold=True, color="FFFFFF")
@@ -541,25 +809,9 @@ class PisaFTFileProcessor(NFSFTFileProcessor):
         total_font = Font(bold=True)
 
         dati_df = display_df if display_df is not None else df
-        self._add_dataframe_sheet(
-            wb,
-            "Dati",
-            dati_df,
-            header_fill,
-            header_font,
-            total_fill,
-            total_font,
-            date_columns=[column for column in dati_df.columns if "data" in str(column).lower()],
-            date_format="dd/mm/yyyy",
-            money_columns=[
-                column
-                for column in ("Imposta", "Imponibile", "Tot. Imp. Fatture", "Rit. Imposta", "Rit. Imp.")
-                if column in dati_df.columns
-            ],
-            auto_size=False,
-            use_active=True,
-        )
+        self._add_pisa_dati_sheet(wb, "Dati", dati_df, header_fill, header_font, total_fill, total_font)
 
+        self.timings.mark("scrittura", sheet="Fatture Cartacee")
         ws_cartacee = wb.create_sheet("Fatture Cartacee")
         self._create_simple_summary_sheet(
             ws_cartacee,
@@ -570,6 +822,7 @@ class PisaFTFileProcessor(NFSFTFileProcessor):
             total_font,
         )
 
+        self.timings.mark("scrittura", sheet="Fatture Elettroniche")
         ws_elettroniche = wb.create_sheet("Fatture Elettroniche")
         self._create_simple_summary_sheet(
             ws_elettroniche,
@@ -580,8 +833,92 @@ class PisaFTFileProcessor(NFSFTFileProcessor):
             total_font,
         )
 
+        for month, month_df in (monthly or {}).items():
+            suffix = month_sheet_suffix(month)
+            cart, elet = monthly_split[month]
+            self.timings.mark("scrittura", sheet=f"Riepilogo {suffix}")
+            self._create_month_summary_sheet(
+                wb.create_sheet(f"Riepilogo {suffix}"),
+                cart,
+                elet,
+                header_fill,
+                header_font,
+                total_fill,
+                total_font,
+            )
+            self._add_pisa_dati_sheet(
+                wb, f"Dati {suffix}", self._build_pisa_dati(month_df), header_fill, header_font, total_fill, total_font
+            )
+
+        self.timings.mark("salvataggio")
         wb.save(output_path)
 
+    def _add_pisa_dati_sheet(
+        self,
+        wb: Workbook,
+        title: str,
+        dati_df: pd.DataFrame,
+        header_fill: PatternFill,
+        header_font: Font,
+        total_fill: PatternFill,
+        total_font: Font,
+    ) -> None:
+        self._add_dataframe_sheet(
+            wb,
+            title,
+            dati_df,
+            header_fill,
+            header_font,
+            total_fill,
+            total_font,
+            date_columns=[column for column in dati_df.columns if "data" in str(column).lower()],
+            date_format="dd/mm/yyyy",
+            money_columns=[
+                column
+                for column in ("Imposta", "Imponibile", "Tot. Imp. Fatture", "Rit. Imposta", "Rit. Imp.")
+                if column in dati_df.columns
+            ],
+            auto_size=False,
+        )
+
+    def _create_month_summary_sheet(
+        self,
+        ws,
+        cartacee_df: pd.DataFrame,
+        elettroniche_df: pd.DataFrame,
+        header_fill: PatternFill,
+        header_font: Font,
+        total_fill: PatternFill,
+        total_font: Font,
+    ) -> None:
+        ws.column_dimensions["A"].width = 20
+        ws.column_dimensions["B"].width = 20
+        ws.column_dimensions["C"].width = 20
+
+        self._append_styled_row(
+            ws,
+            ["TIPO", "NUMERO TOTALE", "IMPONIBILE"],
+            fill=header_fill,
+            font=header_font,
+            alignment=Alignment(horizontal="center", vertical="center"),
+        )
+
+        money_format = "#,##0.00"
+        cartacee_cents = int(to_cents(cartacee_df["Imponibile"]).sum())
+        elettroniche_cents = int(to_cents(elettroniche_df["Imponibile"]).sum())
+        for tipo, count, cents in (
+            ("Cartacee", len(cartacee_df), cartacee_cents),
+            ("Elettroniche", len(elettroniche_df), elettroniche_cents),
+        ):
+            self._append_styled_row(ws, [tipo, count, cents_to_amount(cents)], number_formats={2: money_format})
+        self._append_styled_row(
+            ws,
+            ["TOTALE", len(cartacee_df) + len(elettroniche_df), cents_to_amount(cartacee_cents + elettroniche_cents)],
+            fill=total_fill,
+            font=total_font,
+            number_formats={2: money_format},
+        )
+
     def _build_pisa_dati(self, df: pd.DataFrame) -> pd.DataFrame:
         selected_columns = list(df.columns)
         col_creditore = selected_columns[0] if len(selected_columns) > 0 else None
@@ -612,17 +949,8 @@ class PisaFTFileProcessor(NFSFTFileProcessor):
         )
         return df_dati
 
-    def _split_by_sdi(self, df: pd.DataFrame, sdi_column: str) -> tuple[pd.DataFrame, pd.DataFrame]:
-        sdi_series = df[sdi_column]
-        normalized = sdi_series.astype(str).str.strip().where(~sdi_series.isna(), "")
-        normalized = normalized.str.lower().str.replace(",", ".", regex=False)
-        empty_text_mask = normalized.isin(["", "nan", "none", "null"])
-        empty_mask = empty_text_mask
-        cartacee_df = df[empty_mask].copy()
-        elettroniche_df = df[~empty_mask].copy()
-        return cartacee_df, elettroniche_df
-
-    def _letters_to_indices(self, letters: list[str]) -> list[int]:
+    @staticmethod
+    def _letters_to_indices(letters: list[str]) -> list[int]:
         return [ord(letter) - ord("A") for letter in letters]
 
     def _create_simple_summary_sheet(
@@ -634,28 +962,29 @@ class PisaFTFileProcessor(NFSFTFileProcessor):
         total_fill: PatternFill,
         total_font: Font,
     ) -> None:
-        ws["A1"] = "NUMERO TOTALE"
-        ws["B1"] = "IMPONIBILE"
-
-        for cell in ws[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-
-        imponibile_totale = pd.to_numeric(df["Imponibile"], errors="coerce").sum()
-        ws["A2"] = len(df)
-        ws["B2"] = imponibile_totale
-        ws["B2"].number_format = "#,##0.00"
-
-        for cell in ws[2]:
-            cell.fill = total_fill
-            cell.font = total_font
-
         ws.column_dimensions["A"].width = 20
         ws.column_dimensions["B"].width = 20
 
+        self._append_styled_row(
+            ws,
+            ["NUMERO TOTALE", "IMPONIBILE"],
+            fill=header_fill,
+            font=header_font,
+            alignment=Alignment(horizontal="center", vertical="center"),
+        )
+
+        imponibile_totale = cents_to_amount(to_cents(df["Imponibile"]).sum())
+        self._append_styled_row(
+            ws,
+            [len(df), imponibile_totale],
+            fill=total_fill,
+            font=total_font,
+            number_formats={1: "#,##0.00"},
+        )
+
 
 class PisaRicevuteFTFileProcessor(NFSFTFileProcessor):
+    SDI_ZERO_IS_EMPTY = False
     PHASE = 1
     INPUT_REQUIRED_COLUMNS = [
         "Creditore",
@@ -680,13 +1009,34 @@ class PisaRicevuteFTFileProcessor(NFSFTFileProcessor):
     ]
     OUTPUT_DATE_COLUMNS = ["Data emissione", "Data documento", "Data pagamento"]
     OUTPUT_MONEY_COLUMNS = ["Ivam", "Imponibile", "Totale fatture"]
-    MAX_DETAIL_ROWS = 5000
 
-    def process_file(self, input_path: Path, output_path: Path) -> Dict[str, Any]:
+    @classmethod
+    def preflight(cls, input_path: Path) -> None:
+        rows = cls._sniff_header_rows(input_path)
+        if rows is None:
+            return
+        # pd.read_excel usa la prima riga come intestazione, con i nomi così come sono.
+        header = {str(value) for value in rows[0]} if rows else set()
+        missing_columns = [col for col in cls.INPUT_REQUIRED_COLUMNS if col not in header]
+        if missing_columns:
+            raise ValueError(f"Colonne mancanti: {', '.join(missing_columns)}")
+
+    def process_file(self, input_path: Path, output_path: Optional[Path] = None) -> Dict[str, Any]:
+        """Come ``NFSFTFileProcessor.process_file``: senza ``output_path`` solo il riepilogo."""
         try:
             logger.info("Caricamento file Pisa Ricevute: %s", input_path)
+            self.progress.start()
+            self.timings.start()
+            self.memory_report.start()
+            self.progress.stage("lettura")
+            self.timings.mark("lettura")
             try:
-                df = pd.read_excel(input_path, usecols=self.INPUT_REQUIRED_COLUMNS, dtype=str)
+                df = self._load_cached(
+                    input_path,
+                    "pisa-ricevute",
+                    lambda: pd.read_excel(input_path, usecols=self.INPUT_REQUIRED_COLUMNS, dtype=str),
+                )
+                df = self._compact(df)
             except ValueError:
                 df_header = pd.read_excel(input_path, nrows=0)
                 missing_columns = [col for col in self.INPUT_REQUIRED_COLUMNS if col not in df_header.columns]
@@ -694,23 +1044,21 @@ class PisaRicevuteFTFileProcessor(NFSFTFileProcessor):
                     raise ValueError(f"Colonne mancanti: {', '.join(missing_columns)}")
                 raise
 
-            totale_fattura = pd.to_numeric(
-                df["Importo fattura"].astype(str).str.replace(",", ".", regex=False),
-                errors="coerce",
-            ).fillna(0)
-            iva = pd.to_numeric(
-                df["IVA"].astype(str).str.replace(",", ".", regex=False),
-                errors="coerce",
-            ).fillna(0)
-            imponibile = totale_fattura - iva
+            self.progress.stage("aggregazione")
+            self.timings.mark("normalizzazione")
+            totale_fattura_cents = to_cents(df["Importo fattura"])
+            iva_cents = to_cents(df["IVA"])
+            totale_fattura = cents_to_amount(totale_fattura_cents)
+            iva = cents_to_amount(iva_cents)
+            imponibile = cents_to_amount(totale_fattura_cents - iva_cents)
 
             df_finale = pd.DataFrame(
                 {
                     "Ragione sociale": df["Creditore"],
                     "N.fatture": df["Numero fattura"],
-                    "Data emissione": pd.to_datetime(df["Data emissione"], errors="coerce"),
-                    "Data documento": pd.to_datetime(df["Data documento"], errors="coerce"),
-                    "Data pagamento": pd.to_datetime(df["Data pagamento"], errors="coerce"),
+                    "Data emissione": self.date_parser.to_datetime(df["Data emissione"]),
+                    "Data documento": self.date_parser.to_datetime(df["Data documento"]),
+                    "Data pagamento": self.date_parser.to_datetime(df["Data pagamento"]),
                     "Ivam": iva,
                     "Imponibile": imponibile,
                     "Totale fatture": totale_fattura,
@@ -718,12 +1066,18 @@ class PisaRicevuteFTFileProcessor(NFSFTFileProcessor):
                 }
             )
             df_finale = df_finale[self.OUTPUT_COLUMNS]
+            self.memory_report.record("lettura", df, df_finale)
 
+            self.timings.mark("aggregazione")
             cartacee_df, elettroniche_df = self._split_by_sdi(df_finale, "Identificativo SDI")
-            display_df = df_finale
-            if len(display_df) > self.MAX_DETAIL_ROWS:
-                display_df = display_df.head(self.MAX_DETAIL_ROWS).copy()
-            self._create_excel_output(df_finale, cartacee_df, elettroniche_df, output_path, display_df=display_df)
+            if output_path is not None:
+                display_df = df_finale
+                if self.detail_preview_rows and len(display_df) > self.detail_preview_rows:
+                    display_df = display_df.head(self.detail_preview_rows)
+                self.progress.stage("scrittura", rows_total=len(display_df))
+                self._create_excel_output(df_finale, cartacee_df, elettroniche_df, output_path, display_df=display_df)
+                self.memory_report.record("output")
+            self.progress.finish()
             stats = {
                 "total_records": len(df_finale),
                 "fase2_records": len(cartacee_df),
@@ -732,6 +1086,9 @@ class PisaRicevuteFTFileProcessor(NFSFTFileProcessor):
                 "protocols_fase2": {"Cartacee": len(cartacee_df)},
                 "protocols_fase3": {"Elettroniche": len(elettroniche_df)},
             }
+            stats["stages"] = self.timings.finish()
+            if self.memory_report.enabled:
+                stats["memory"] = self.memory_report.finish()
             logger.info("File Pisa Ricevute elaborato con successo: %s", stats)
             return stats
         except Exception as exc:
@@ -746,7 +1103,7 @@ class PisaRicevuteFTFileProcessor(NFSFTFileProcessor):
         output_path: Path,
         display_df: Optional[pd.DataFrame] = None,
     ) -> None:
-        wb = Workbook()
+        wb = Workbook(write_only=True)
 
         header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
         header_font = Font(bold=True, color="FFFFFF")
@@ -766,9 +1123,9 @@ class PisaRicevuteFTFileProcessor(NFSFTFileProcessor):
             date_format="dd/mm/yyyy",
             money_columns=self.OUTPUT_MONEY_COLUMNS,
             auto_size=False,
-            use_active=True,
         )
 
+        self.timings.mark("scrittura", sheet="Fatture Cartacee")
         ws_cartacee = wb.create_sheet("Fatture Cartacee")
         self._create_simple_summary_sheet(
             ws_cartacee,
@@ -779,6 +1136,7 @@ class PisaRicevuteFTFileProcessor(NFSFTFileProcessor):
             total_font,
         )
 
+        self.timings.mark("scrittura", sheet="Fatture Elettroniche")
         ws_elettroniche = wb.create_sheet("Fatture Elettroniche")
         self._create_simple_summary_sheet(
             ws_elettroniche,
@@ -789,18 +1147,9 @@ class PisaRicevuteFTFileProcessor(NFSFTFileProcessor):
             total_font,
         )
 
+        self.timings.mark("salvataggio")
         wb.save(output_path)
 
-    def _split_by_sdi(self, df: pd.DataFrame, sdi_column: str) -> tuple[pd.DataFrame, pd.DataFrame]:
-        sdi_series = df[sdi_column]
-        normalized = sdi_series.astype(str).str.strip().where(~sdi_series.isna(), "")
-        normalized = normalized.str.lower().str.replace(",", ".", regex=False)
-        empty_text_mask = normalized.isin(["", "nan", "none", "null"])
-        empty_mask = empty_text_mask
-        cartacee_df = df[empty_mask].copy()
-        elettroniche_df = df[~empty_mask].copy()
-        return cartacee_df, elettroniche_df
-
     def _create_simple_summary_sheet(
         self,
         ws,
@@ -810,26 +1159,26 @@ class PisaRicevuteFTFileProcessor(NFSFTFileProcessor):
         total_fill: PatternFill,
         total_font: Font,
     ) -> None:
-        ws["A1"] = "NUMERO TOTALE"
-        ws["B1"] = "TOTALE FATTURE"
-
-        for cell in ws[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-
-        totale_fatture = pd.to_numeric(df["Totale fatture"], errors="coerce").sum()
-        ws["A2"] = len(df)
-        ws["B2"] = totale_fatture
-        ws["B2"].number_format = "#,##0.00"
-
-        for cell in ws[2]:
-            cell.fill = total_fill
-            cell.font = total_font
-
         ws.column_dimensions["A"].width = 20
         ws.column_dimensions["B"].width = 20
 
+        self._append_styled_row(
+            ws,
+            ["NUMERO TOTALE", "TOTALE FATTURE"],
+            fill=header_fill,
+            font=header_font,
+            alignment=Alignment(horizontal="center", vertical="center"),
+        )
+
+        totale_fatture = cents_to_amount(to_cents(df["Totale fatture"]).sum())
+        self._append_styled_row(
+            ws,
+            [len(df), totale_fatture],
+            fill=total_fill,
+            font=total_font,
+            number_formats={1: "#,##0.00"},
+        )
+
 
 class CompareFTFileProcessor:
     NFS_REQUIRED_COLUMNS = [
@@ -871,68 +1220,98 @@ class CompareFTFileProcessor:
         "RA_IMPOSTA": 0.0,
         "RA_CODTRIB": "",
     }
+    SDI_TRAILING_ZEROS_PATTERN = r"^(\d+)\.0+$"
+    # Righe per blocco nel riconoscimento dei float nelle colonne SDI miste.
+    SDI_TYPE_CHUNK_ROWS = 65536
+    # Tipi inferiti da pandas per blocchi che non contengono float.
+    SDI_NON_FLOAT_KINDS = frozenset({"empty", "string", "bytes", "integer", "boolean", "decimal", "date", "datetime", "time"})
+    # Regola di business, non una correzione degli arrotondamenti float: l'imponibile
+    # Pisa è ricavato come importo fattura meno IVA e può scostarsi di un centesimo da
+    # quello registrato in NFS, quindi una differenza di un centesimo non va segnalata.
+    AMOUNT_TOLERANCE_CENTS = 1
+    DIFFERENZE_COLUMNS = [
+        "Identificativo SDI",
+        "Esito",
+        "NFS Ragione sociale",
+        "NFS N.fatture",
+        "NFS Datat reg.",
+        "NFS Importo",
+        "Pisa Creditore",
+        "Pisa Numero fattura",
+        "Pisa Data emissione",
+        "Pisa Importo",
+        "Delta Numero",
+        "Delta Importo",
+    ]
+    NFS_HEADER_RESOLVER = NFSFTFileProcessor.PROCESSED_HEADER_RESOLVER
+    PISA_HEADER_RESOLVER = HeaderResolver(
+        list(zip(PISA_REQUIRED_COLUMNS, PISA_REQUIRED_COLUMNS))
+        + [("C", "Numero fattura"), ("F", "Data emissione"), ("Data pagamento", "Data emissione")],
+        required=PISA_REQUIRED_COLUMNS,
+    )
+    # Date usate per assegnare le fatture ai mesi nel confronto per periodo.
+    NFS_PERIOD_COLUMN = "Data Fatture"
+    PISA_PERIOD_COLUMN = "Data emissione"
+    # Processi per la lettura parallela: uno per ogni confronto che può girare insieme agli altri.
+    PARALLEL_LOAD_WORKERS = 2
+    # Nel confronto si leggono due file e la scrittura pesa meno che nell'elaborazione NFS.
+    PROGRESS_STAGE_WEIGHTS = (("lettura", 0.45), ("deduplica", 0.05), ("aggregazione", 0.05), ("scrittura", 0.45))
+
+    def __init__(
+        self,
+        input_cache: Optional[ParsedInputCache] = None,
+        compact_frames: bool = False,
+        memory_report: bool = False,
+        months: Optional[Sequence[str]] = None,
+        parallel_load: bool = False,
+        on_progress: Optional[ProgressCallback] = None,
+        parallel_load_workers: int = PARALLEL_LOAD_WORKERS,
+    ) -> None:
+        self.input_cache = input_cache
+        self.parallel_load = parallel_load
+        self.parallel_load_workers = parallel_load_workers
+        # Senza mesi si confronta tutto il periodo; con ALL_MONTHS ogni mese presente nei dati.
+        self.by_month = months is not None
+        self.months = parse_months(months) if months is not None else None
+        self.compact_frames = compact_frames
+        self.memory_report = MemoryReport(type(self).__name__, enabled=memory_report)
+        self.progress = ProgressReporter(on_progress, weights=self.PROGRESS_STAGE_WEIGHTS)
+        self.timings = StageTimer()
+        self.date_parser = DateParser()
+
+    def _load_cached(self, input_path: Path, variant: str, loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        return load_cached(self.input_cache, input_path, variant, loader)
+
+    def _compact(self, df: pd.DataFrame) -> pd.DataFrame:
+        return compact_frame(df) if self.compact_frames else df
+
+    @classmethod
+    def preflight(cls, nfs_input_path: Path, pisa_input_path: Path) -> None:
+        """Controllo rapido delle intestazioni dei due file, con gli stessi messaggi della lettura completa."""
+        nfs_header = NFSFTFileProcessor._sniff_nfs_header(nfs_input_path)
+        if nfs_header is not None:
+            labels = cls.NFS_HEADER_RESOLVER.resolve(nfs_header).labels
+            missing_nfs = [
+                col for col in cls.NFS_REQUIRED_COLUMNS if col not in labels and col not in cls.NFS_OPTIONAL_DEFAULTS
+            ]
+            if missing_nfs:
+                raise ValueError(f"Colonne mancanti nel file NFS: {', '.join(missing_nfs)}")
 
-    def _normalize_col_name(self, value: Any) -> str:
-        text = str(value).strip().upper()
-        return re.sub(r"[^A-Z0-9]", "", text)
+        pisa_rows = NFSFTFileProcessor._sniff_header_rows(pisa_input_path)
+        if pisa_rows is not None:
+            missing_pisa = cls.PISA_HEADER_RESOLVER.resolve(pisa_rows[0] if pisa_rows else []).missing
+            if missing_pisa:
+                raise ValueError(f"Colonne mancanti nel file Pisa: {', '.join(missing_pisa)}")
 
     def _load_nfs_compare_df(self, nfs_input_path: Path) -> pd.DataFrame:
-        df = pd.read_excel(nfs_input_path)
-        df.columns = [str(c).strip() for c in df.columns]
-
-        normalized_to_original = {self._normalize_col_name(c): c for c in df.columns}
-
-        processed_map = {
-            "RAGIONESOCIALE": "C_NOME",
-            "PROTOCOLLO": "FAT_PROT",
-            "NPROTOCOLLO": "FAT_NUM",
-            "NFATTURE": "FAT_NDOC",
-            "DATAFATTURE": "FAT_DATDOC",
-            "DATAREGISTRAZIONE": "FAT_DATREG",
-            "IMPOSTA": "FAT_TOTIVA",
-            "TOTIMPONIBILE": "IMPONIBILE",
-            "TOTIMPFATTURE": "FAT_TOTFAT",
-            "RITCODICETRIBUTO": "RA_CODTRIB",
-            "RITIMPOSTA": "RA_IMPOSTA",
-            "RITIMP": "RA_IMPON",
-            "IDENTIFICATIVOSDI": "TMC_G8",
-        }
-
-        alt_map = {
-            "DATAREGFATTURA": "FAT_DATREG",
-            "DATAREG_FATTURA": "FAT_DATREG",
-            "DATAREGFATTURA": "FAT_DATREG",
-            "FATREGFATTURA": "FAT_DATREG",
-            "FATREG_FATTURA": "FAT_DATREG",
-            "DATA_REG_FATTURA": "FAT_DATREG",
-            "FAT_REG_FATTURA": "FAT_DATREG",
-        }
-
-        rename_map: dict[str, str] = {}
-        for col in df.columns:
-            norm = self._normalize_col_name(col)
-            mapped = processed_map.get(norm) or alt_map.get(norm)
-            if mapped and mapped not in df.columns:
-                rename_map[col] = mapped
-
-        if rename_map:
-            df = df.rename(columns=rename_map)
-            df.columns = [str(c).strip() for c in df.columns]
-            normalized_to_original = {self._normalize_col_name(c): c for c in df.columns}
-
-        for canonical in self.NFS_REQUIRED_COLUMNS + list(self.NFS_OPTIONAL_DEFAULTS.keys()):
-            if canonical in df.columns:
-                continue
-            original = normalized_to_original.get(self._normalize_col_name(canonical))
-            if original and original in df.columns:
-                df = df.rename(columns={original: canonical})
-
-        if "FAT_DATREG" not in df.columns:
-            for alt in ("DATA_REG_FATTURA", "FAT_REG_FATTURA", "DATAREGFATTURA", "FATREGFATTURA", "DATAREGISTRAZIONE"):
-                original = normalized_to_original.get(self._normalize_col_name(alt))
-                if original and original in df.columns:
-                    df = df.rename(columns={original: "FAT_DATREG"})
-                    break
+        df = self._load_cached(
+            nfs_input_path,
+            "nfs",
+            lambda: NFSFTFileProcessor()._read_excel_flexible(
+                nfs_input_path, project_columns=True, on_rows=self.progress.advance
+            ),
+        )
+        df, _ = self.NFS_HEADER_RESOLVER.rename(df)
 
         for col, default in self.NFS_OPTIONAL_DEFAULTS.items():
             if col not in df.columns:
@@ -942,117 +1321,122 @@ class CompareFTFileProcessor:
         if missing_nfs:
             raise ValueError(f"Colonne mancanti nel file NFS: {', '.join(missing_nfs)}")
 
-        return df[self.NFS_REQUIRED_COLUMNS].copy()
+        return df[self.NFS_REQUIRED_COLUMNS]
 
-    def _parse_date_series(self, series: pd.Series) -> pd.Series:
-        if pd.api.types.is_datetime64_any_dtype(series):
-            return series
-        as_text = series.astype(str).str.strip()
-        iso_mask = as_text.str.match(r"^\d{4}-\d{2}-\d{2}$")
-        parsed_iso = pd.to_datetime(series.where(iso_mask), errors="coerce", dayfirst=False)
-        parsed_other = pd.to_datetime(series.where(~iso_mask), errors="coerce", dayfirst=True)
-        return parsed_iso.fillna(parsed_other)
+    def _load_inputs(self, nfs_input_path: Path, pisa_input_path: Path) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """Legge i due file; con ``parallel_load`` il file Pisa viene letto in un altro processo
+        mentre questo legge il file NFS, quindi l'attesa è quella del più lento dei due."""
+        if not self.parallel_load:
+            return self._load_nfs_input(nfs_input_path), self._load_pisa_input(pisa_input_path)
 
-    def _load_pisa_compare_df(self, pisa_input_path: Path) -> pd.DataFrame:
         try:
-            df_pisa_raw = pd.read_excel(pisa_input_path, usecols=self.PISA_REQUIRED_COLUMNS, dtype=str)
-            return df_pisa_raw[self.PISA_REQUIRED_COLUMNS].copy()
-        except ValueError:
-            df_pisa_raw = pd.read_excel(pisa_input_path, dtype=str)
-            rename_map: dict[str, str] = {}
-
-            if "Numero fattura" not in df_pisa_raw.columns and "C" in df_pisa_raw.columns:
-                rename_map["C"] = "Numero fattura"
-            if "Data emissione" not in df_pisa_raw.columns:
-                if "F" in df_pisa_raw.columns:
-                    rename_map["F"] = "Data emissione"
-                elif "Data pagamento" in df_pisa_raw.columns:
-                    rename_map["Data pagamento"] = "Data emissione"
-            if "Importo fattura" not in df_pisa_raw.columns:
-                if "Importo Fattura" in df_pisa_raw.columns:
-                    rename_map["Importo Fattura"] = "Importo fattura"
-
-            if rename_map:
-                df_pisa_raw = df_pisa_raw.rename(columns=rename_map)
-
-            missing_pisa = [col for col in self.PISA_REQUIRED_COLUMNS if col not in df_pisa_raw.columns]
-            if missing_pisa:
-                raise ValueError(f"Colonne mancanti nel file Pisa: {', '.join(missing_pisa)}")
-            return df_pisa_raw[self.PISA_REQUIRED_COLUMNS].copy()
-
-    def process_files(self, nfs_input_path: Path, pisa_input_path: Path, output_path: Path) -> Dict[str, Any]:
-        df_nfs_raw = self._load_nfs_compare_df(nfs_input_path)
-        df_pisa = self._load_pisa_compare_df(pisa_input_path)
-
-        df_nfs_lookup = df_nfs_raw[["FAT_DATREG", "TMC_G8"]].copy()
-        df_nfs_lookup.rename(columns={"FAT_DATREG": "Datat reg.", "TMC_G8": "Identificativo SDI"}, inplace=True)
-        df_nfs_lookup["Datat reg."] = self._parse_date_series(df_nfs_lookup["Datat reg."])
-        df_nfs_lookup["_SDI_KEY"] = self._normalize_sdi(df_nfs_lookup["Identificativo SDI"])
+            pisa_future = shared_process_pool("compare-input", max_workers=self.parallel_load_workers).submit(
+                self._without_progress()._load_pisa_input, pisa_input_path
+            )
+        except Exception as exc:
+            logger.warning("Lettura parallela non disponibile, leggo i file in sequenza: %s", str(exc))
+            return self._load_nfs_input(nfs_input_path), self._load_pisa_input(pisa_input_path)
 
-        df_nfs_deduped = df_nfs_raw.drop_duplicates(subset=["FAT_NDOC", "C_NOME"]).copy()
-        df_nfs = df_nfs_deduped[self.NFS_REQUIRED_COLUMNS].copy()
-        df_nfs.rename(columns=self.NFS_RENAME_MAP, inplace=True)
-        df_nfs["Data Fatture"] = self._parse_date_series(df_nfs["Data Fatture"])
-        df_nfs["Datat reg."] = self._parse_date_series(df_nfs["Datat reg."])
-        df_nfs["Imponibile"] = pd.to_numeric(df_nfs["Imponibile"], errors="coerce").fillna(0)
+        try:
+            df_nfs_raw = self._load_nfs_input(nfs_input_path)
+        except Exception:
+            pisa_future.cancel()
+            raise
+        try:
+            df_pisa = pisa_future.result()
+        except BrokenProcessPool as exc:
+            logger.warning("Processo di lettura terminato, rileggo il file Pisa: %s", str(exc))
+            df_pisa = self._load_pisa_input(pisa_input_path)
+        except (pickle.PicklingError, TypeError, AttributeError) as exc:
+            # Il processor non è serializzabile (es. un nuovo attributo non picklable): si legge qui.
+            logger.warning("Lettura parallela non disponibile, rileggo il file Pisa: %s", str(exc))
+            df_pisa = self._load_pisa_input(pisa_input_path)
+        return df_nfs_raw, df_pisa
+
+    def _without_progress(self) -> "CompareFTFileProcessor":
+        # La lettura in un altro processo non notifica l'avanzamento: lo fa solo il processo che segue il task.
+        processor = copy.copy(self)
+        processor.progress = ProgressReporter()
+        return processor
+
+    def _load_nfs_input(self, nfs_input_path: Path) -> pd.DataFrame:
+        return self._compact(self._load_nfs_compare_df(nfs_input_path))
+
+    def _load_pisa_input(self, pisa_input_path: Path) -> pd.DataFrame:
+        # In modalità compatta il DataFrame viene ridotto prima di tornare al processo principale.
+        return self._compact(self._load_pisa_compare_df(pisa_input_path))
 
-        df_pisa["Data emissione"] = self._parse_date_series(df_pisa["Data emissione"])
-        df_pisa["Importo fattura"] = pd.to_numeric(
-            df_pisa["Importo fattura"].astype(str).str.replace(",", ".", regex=False),
-            errors="coerce",
-        ).fillna(0)
+    def _parse_date_series(self, series: pd.Series) -> pd.Series:
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return series
+        return self.date_parser.to_datetime_iso_or_dayfirst(series)
 
-        df_nfs["_SDI_KEY"] = self._normalize_sdi(df_nfs["Identificativo SDI"])
-        df_pisa["_SDI_KEY"] = self._normalize_sdi(df_pisa["Identificativo SDI"])
+    def _load_pisa_compare_df(self, pisa_input_path: Path) -> pd.DataFrame:
+        if self.input_cache is not None:
+            df_ricevute = self.input_cache.get(pisa_input_path, "pisa-ricevute")
+            if df_ricevute is not None:
+                return df_ricevute[self.PISA_REQUIRED_COLUMNS]
+        return self._load_cached(pisa_input_path, "pisa-compare", lambda: self._read_pisa_compare_df(pisa_input_path))
+
+    def _read_pisa_compare_df(self, pisa_input_path: Path) -> pd.DataFrame:
+        df_pisa_raw = read_excel_streaming(
+            pisa_input_path,
+            column_selector=self.PISA_HEADER_RESOLVER.select_columns,
+            dtype=str,
+            on_rows=self.progress.advance,
+        )
+        df_pisa_raw, _ = self.PISA_HEADER_RESOLVER.rename(df_pisa_raw)
 
-        nfs_sdi_empty = self._is_empty_sdi(df_nfs["_SDI_KEY"])
-        nfs_cart_mask = nfs_sdi_empty
-        nfs_elet_mask = ~nfs_sdi_empty
-        pisa_cart_mask = self._is_empty_sdi(df_pisa["_SDI_KEY"])
-
-        nfs_cart_count = int(nfs_cart_mask.sum())
-        nfs_elet_count = int(nfs_elet_mask.sum())
-        pisa_cart_count = int(pisa_cart_mask.sum())
-        pisa_elet_count = int((~pisa_cart_mask).sum())
-
-        nfs_cart_amount = round(float(df_nfs.loc[nfs_cart_mask, "Imponibile"].sum()), 2)
-        nfs_elet_amount = round(float(df_nfs.loc[nfs_elet_mask, "Imponibile"].sum()), 2)
-        pisa_cart_amount = round(float(df_pisa.loc[pisa_cart_mask, "Importo fattura"].sum()), 2)
-        pisa_elet_amount = round(float(df_pisa.loc[~pisa_cart_mask, "Importo fattura"].sum()), 2)
-
-        summary = {
-            "period": "Tutto il periodo",
-            "nfs": {
-                "cartacee": {"count": nfs_cart_count, "amount": nfs_cart_amount, "amount_column": "Imponibile"},
-                "elettroniche": {"count": nfs_elet_count, "amount": nfs_elet_amount, "amount_column": "Imponibile"},
-            },
-            "pisa": {
-                "cartacee": {"count": pisa_cart_count, "amount": pisa_cart_amount, "amount_column": "Importo fattura"},
-                "elettroniche": {"count": pisa_elet_count, "amount": pisa_elet_amount, "amount_column": "Importo fattura"},
-            },
-        }
-        for side in ("nfs", "pisa"):
-            for kind in ("cartacee", "elettroniche"):
-                summary[side][kind]["imponibile"] = summary[side][kind]["amount"]
+        missing_pisa = [col for col in self.PISA_REQUIRED_COLUMNS if col not in df_pisa_raw.columns]
+        if missing_pisa:
+            raise ValueError(f"Colonne mancanti nel file Pisa: {', '.join(missing_pisa)}")
+        return df_pisa_raw[self.PISA_REQUIRED_COLUMNS]
 
+    def process_files(self, nfs_input_path: Path, pisa_input_path: Path, output_path: Path) -> Dict[str, Any]:
+        self.progress.start()
+        # Con la lettura parallela le righe del file Pisa non vengono contate.
+        expected_rows = estimate_row_count(nfs_input_path) + (0 if self.parallel_load else estimate_row_count(pisa_input_path))
+        self.progress.stage("lettura", rows_total=expected_rows)
+        self.timings.start()
+        self.memory_report.start()
+        self.timings.mark("lettura")
+        df_nfs_raw, df_pisa = self._load_inputs(nfs_input_path, pisa_input_path)
+        self.memory_report.record("lettura", df_nfs_raw, df_pisa)
+
+        self.progress.stage("deduplica")
+        df_nfs_lookup, df_nfs, df_pisa = self._prepare_compare_frames(df_nfs_raw, df_pisa)
+        self.memory_report.record("normalizzazione", df_nfs_raw, df_nfs_lookup, df_nfs, df_pisa)
+
+        self.progress.stage("aggregazione")
+        self.timings.mark("riconciliazione")
+
+        monthly: Dict[pd.Period, tuple[pd.DataFrame, pd.DataFrame]] = {}
+        if self.by_month:
+            nfs_month = month_keys(df_nfs[self.NFS_PERIOD_COLUMN])
+            pisa_month = month_keys(df_pisa[self.PISA_PERIOD_COLUMN])
+            months = self.months or sorted(set(nfs_month.dropna()) | set(pisa_month.dropna()))
+            nfs_mask = nfs_month.isin(months)
+            pisa_mask = pisa_month.isin(months)
+            df_nfs = df_nfs[nfs_mask]
+            df_pisa = df_pisa[pisa_mask]
+            nfs_by_month = partition_by_month(df_nfs, nfs_month[nfs_mask], months)
+            pisa_by_month = partition_by_month(df_pisa, pisa_month[pisa_mask], months)
+            monthly = {month: (nfs_by_month[month], pisa_by_month[month]) for month in months}
+
+        totals = self._compare_totals(df_nfs, df_pisa)
+        period = ", ".join(month_label(month) for month in monthly) if self.by_month else "Tutto il periodo"
+        summary = {"period": period, **self._compare_summary(totals)}
+
+        self.progress.stage("scrittura", sheet="Confronto")
+        self.timings.mark("scrittura", sheet="Confronto")
         wb = Workbook()
         wb.remove(wb.active)
 
         header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
         header_font = Font(bold=True, color="FFFFFF")
-        self._create_confronto_sheet(
-            wb=wb,
-            nfs_cart_count=nfs_cart_count,
-            nfs_cart_amount=nfs_cart_amount,
-            nfs_elet_count=nfs_elet_count,
-            nfs_elet_amount=nfs_elet_amount,
-            pisa_cart_count=pisa_cart_count,
-            pisa_cart_amount=pisa_cart_amount,
-            pisa_elet_count=pisa_elet_count,
-            pisa_elet_amount=pisa_elet_amount,
-            header_fill=header_fill,
-            header_font=header_font,
-        )
+        self._create_confronto_sheet(wb=wb, header_fill=header_fill, header_font=header_font, **totals)
+        self.progress.advance(0, sheet="Differenze tra file")
+        self.timings.mark("scrittura", sheet="Differenze tra file")
         self._create_fatture_da_verificare_sheet(
             wb=wb,
             df_nfs=df_nfs,
@@ -1061,41 +1445,112 @@ class CompareFTFileProcessor:
             header_font=header_font,
         )
 
+        month_summaries: Dict[str, Any] = {}
+        for month, (month_nfs, month_pisa) in monthly.items():
+            suffix = month_sheet_suffix(month)
+            month_totals = self._compare_totals(month_nfs, month_pisa)
+            month_summaries[month_label(month)] = self._compare_summary(month_totals)
+            self.progress.advance(0, sheet=f"Confronto {suffix}")
+            self.timings.mark("scrittura", sheet=f"Confronto {suffix}")
+            self._create_confronto_sheet(
+                wb=wb, header_fill=header_fill, header_font=header_font, title=f"Confronto {suffix}", **month_totals
+            )
+            self.progress.advance(0, sheet=f"Differenze {suffix}")
+            self.timings.mark("scrittura", sheet=f"Differenze {suffix}")
+            self._create_fatture_da_verificare_sheet(
+                wb=wb,
+                df_nfs=month_nfs,
+                df_pisa=month_pisa,
+                header_fill=header_fill,
+                header_font=header_font,
+                title=f"Differenze {suffix}",
+            )
+        if self.by_month:
+            summary["months"] = month_summaries
+
+        self.timings.mark("salvataggio")
         wb.save(output_path)
+        self.memory_report.record("output")
+        summary["stages"] = self.timings.finish()
+        if self.memory_report.enabled:
+            summary["memory"] = self.memory_report.finish()
+        self.progress.finish()
+        return summary
+
+    def _compare_totals(self, df_nfs: pd.DataFrame, df_pisa: pd.DataFrame) -> Dict[str, int]:
+        nfs_cart_mask = df_nfs["_CARTACEA"]
+        pisa_cart_mask = df_pisa["_CARTACEA"]
+        return {
+            "nfs_cart_count": int(nfs_cart_mask.sum()),
+            "nfs_cart_cents": int(df_nfs.loc[nfs_cart_mask, "_CENTESIMI"].sum()),
+            "nfs_elet_count": int((~nfs_cart_mask).sum()),
+            "nfs_elet_cents": int(df_nfs.loc[~nfs_cart_mask, "_CENTESIMI"].sum()),
+            "pisa_cart_count": int(pisa_cart_mask.sum()),
+            "pisa_cart_cents": int(df_pisa.loc[pisa_cart_mask, "_CENTESIMI"].sum()),
+            "pisa_elet_count": int((~pisa_cart_mask).sum()),
+            "pisa_elet_cents": int(df_pisa.loc[~pisa_cart_mask, "_CENTESIMI"].sum()),
+        }
+
+    def _compare_summary(self, totals: Dict[str, int]) -> Dict[str, Any]:
+        summary: Dict[str, Any] = {}
+        for side, amount_column in (("nfs", "Imponibile"), ("pisa", "Importo fattura")):
+            summary[side] = {}
+            for kind, prefix in (("cartacee", "cart"), ("elettroniche", "elet")):
+                amount = cents_to_amount(totals[f"{side}_{prefix}_cents"])
+                summary[side][kind] = {
+                    "count": totals[f"{side}_{prefix}_count"],
+                    "amount": amount,
+                    "amount_column": amount_column,
+                    "imponibile": amount,
+                }
         return summary
 
-    def _filter_january_2025(self, df: pd.DataFrame, date_column: str) -> pd.DataFrame:
-        if date_column not in df.columns:
-            return df.iloc[0:0].copy()
-        date_series = self._parse_date_series(df[date_column])
-        start = pd.Timestamp(year=2025, month=1, day=1)
-        end = pd.Timestamp(year=2025, month=1, day=31)
-        mask = date_series.between(start, end)
-        return df[mask].copy()
-
-    def _is_empty_sdi(self, series: pd.Series) -> pd.Series:
-        normalized = series.astype(str).str.strip().where(~series.isna(), "")
-        normalized = normalized.str.lower().str.replace(",", ".", regex=False)
-        empty_text_mask = normalized.isin(["", "nan", "none", "null"])
-        numeric = pd.to_numeric(normalized, errors="coerce")
-        zero_mask = numeric.eq(0) & ~numeric.isna()
-        return empty_text_mask | zero_mask
+    def _prepare_compare_frames(
+        self, df_nfs_raw: pd.DataFrame, df_pisa: pd.DataFrame
+    ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        self.timings.mark("normalizzazione")
+        df_nfs_lookup = df_nfs_raw[["FAT_DATREG", "TMC_G8"]]
+        df_nfs_lookup.rename(columns={"FAT_DATREG": "Datat reg.", "TMC_G8": "Identificativo SDI"}, inplace=True)
+        df_nfs_lookup["Datat reg."] = self._parse_date_series(df_nfs_lookup["Datat reg."])
+        df_nfs_lookup["_SDI_KEY"] = self._normalize_sdi(df_nfs_lookup["Identificativo SDI"])
+
+        self.timings.mark("deduplica")
+        df_nfs_deduped = df_nfs_raw.drop_duplicates(subset=["FAT_NDOC", "C_NOME"])
+        self.timings.mark("normalizzazione")
+        df_nfs = df_nfs_deduped[self.NFS_REQUIRED_COLUMNS]
+        df_nfs.rename(columns=self.NFS_RENAME_MAP, inplace=True)
+        df_nfs["Data Fatture"] = self._parse_date_series(df_nfs["Data Fatture"])
+        df_nfs["Datat reg."] = self._parse_date_series(df_nfs["Datat reg."])
+        df_nfs["_CENTESIMI"] = to_cents(df_nfs["Imponibile"])
+        df_nfs["Imponibile"] = cents_to_amount(df_nfs["_CENTESIMI"])
+
+        df_pisa["Data emissione"] = self._parse_date_series(df_pisa["Data emissione"])
+        df_pisa["_CENTESIMI"] = to_cents(df_pisa["Importo fattura"])
+        df_pisa["Importo fattura"] = cents_to_amount(df_pisa["_CENTESIMI"])
+
+        df_nfs["_SDI_KEY"] = self._normalize_sdi(df_nfs["Identificativo SDI"])
+        df_pisa["_SDI_KEY"] = self._normalize_sdi(df_pisa["Identificativo SDI"])
+        df_nfs["_CARTACEA"] = sdi_empty_mask(df_nfs["_SDI_KEY"])
+        df_pisa["_CARTACEA"] = sdi_empty_mask(df_pisa["_SDI_KEY"])
+
+        return df_nfs_lookup, df_nfs, df_pisa
 
     def _create_confronto_sheet(
         self,
         wb: Workbook,
         nfs_cart_count: int,
-        nfs_cart_amount: float,
+        nfs_cart_cents: int,
         nfs_elet_count: int,
-        nfs_elet_amount: float,
+        nfs_elet_cents: int,
         pisa_cart_count: int,
-        pisa_cart_amount: float,
+        pisa_cart_cents: int,
         pisa_elet_count: int,
-        pisa_elet_amount: float,
+        pisa_elet_cents: int,
         header_fill: PatternFill,
         header_font: Font,
+        title: str = "Confronto",
     ) -> None:
-        ws = wb.create_sheet("Confronto")
+        ws = wb.create_sheet(title)
         total_fill = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
         total_font = Font(bold=True)
 
@@ -1115,25 +1570,25 @@ class CompareFTFileProcessor:
             cell.alignment = Alignment(horizontal="center", vertical="center")
 
         rows = [
-            ("Cartacee", nfs_cart_count, nfs_cart_amount, pisa_cart_count, pisa_cart_amount),
-            ("Elettroniche", nfs_elet_count, nfs_elet_amount, pisa_elet_count, pisa_elet_amount),
+            ("Cartacee", nfs_cart_count, nfs_cart_cents, pisa_cart_count, pisa_cart_cents),
+            ("Elettroniche", nfs_elet_count, nfs_elet_cents, pisa_elet_count, pisa_elet_cents),
             (
                 "Totale",
                 nfs_cart_count + nfs_elet_count,
-                round(nfs_cart_amount + nfs_elet_amount, 2),
+                nfs_cart_cents + nfs_elet_cents,
                 pisa_cart_count + pisa_elet_count,
-                round(pisa_cart_amount + pisa_elet_amount, 2),
+                pisa_cart_cents + pisa_elet_cents,
             ),
         ]
         money_format = "#,##0.00"
         for row_idx, (categoria, n_num, n_imp, p_num, p_imp) in enumerate(rows, start=2):
             ws.cell(row=row_idx, column=1, value=categoria)
             ws.cell(row=row_idx, column=2, value=n_num)
-            ws.cell(row=row_idx, column=3, value=n_imp).number_format = money_format
+            ws.cell(row=row_idx, column=3, value=cents_to_amount(n_imp)).number_format = money_format
             ws.cell(row=row_idx, column=4, value=p_num)
-            ws.cell(row=row_idx, column=5, value=p_imp).number_format = money_format
+            ws.cell(row=row_idx, column=5, value=cents_to_amount(p_imp)).number_format = money_format
             ws.cell(row=row_idx, column=6, value=n_num - p_num)
-            ws.cell(row=row_idx, column=7, value=round(n_imp - p_imp, 2)).number_format = money_format
+            ws.cell(row=row_idx, column=7, value=cents_to_amount(n_imp - p_imp)).number_format = money_format
 
         for cell in ws[ws.max_row]:
             cell.fill = total_fill
@@ -1147,23 +1602,94 @@ class CompareFTFileProcessor:
         ws.column_dimensions["F"].width = 14
         ws.column_dimensions["G"].width = 16
 
-    def _normalize_sdi(self, series: pd.Series) -> pd.Series:
-        def normalize_value(value: Any) -> str:
-            if pd.isna(value):
-                return ""
-            if isinstance(value, int):
-                return str(value)
-            if isinstance(value, float):
-                if value.is_integer():
-                    return str(int(value))
-                return str(value).strip()
-            text = str(value).strip()
-            match = re.fullmatch(r"(\d+)\.0+", text)
-            if match:
-                return match.group(1)
-            return text
+    def _format_float_sdi(self, values: pd.Series) -> pd.Series:
+        # Equivale a str(int(v)) per i float interi e str(v) per gli altri, con "" per i NaN.
+        array = values.to_numpy(dtype=float, na_value=np.nan)
+        missing = np.isnan(array)
+        integral = ~missing & (array == np.round(array)) & (np.abs(array) < 2**63)
+        text = np.where(integral, array, 0).astype(np.int64).astype(str).astype(object)
+        text[missing] = ""
+        others = np.flatnonzero(~missing & ~integral)
+        for pos, value in zip(others, array[others].tolist()):
+            text[pos] = str(int(value)) if value.is_integer() else str(value)
+        return pd.Series(text, index=values.index, dtype=object)
+
+    def _strip_sdi_text(self, values: pd.Series) -> pd.Series:
+        result = values.str.strip().str.replace(self.SDI_TRAILING_ZEROS_PATTERN, r"\1", regex=True).astype(object)
+        # Il motore regex di pyarrow riconosce in \d solo le cifre ASCII: le altre righe passano da re.
+        non_ascii = ~values.str.isascii().fillna(True).astype(bool)
+        if non_ascii.any():
+            result[non_ascii] = [
+                self._strip_sdi_value(value) for value in values[non_ascii].astype(object).tolist()
+            ]
+        return result
 
-        return series.map(normalize_value)
+    def _strip_sdi_value(self, value: Any) -> Any:
+        if not isinstance(value, str):
+            return value
+        text = value.strip()
+        match = re.fullmatch(self.SDI_TRAILING_ZEROS_PATTERN, text)
+        return match.group(1) if match else text
+
+    def _normalize_sdi(self, series: pd.Series) -> pd.Series:
+        if series.empty:
+            return series.map(str)
+        dtype = series.dtype
+        if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+            result = series.astype(str)
+        elif pd.api.types.is_float_dtype(dtype):
+            result = self._format_float_sdi(series)
+        elif pd.api.types.is_string_dtype(dtype) and dtype != object:
+            result = self._strip_sdi_text(series)
+        else:
+            values = series.astype(object)
+            float_mask = self._float_value_mask(values)
+            # Testo e float si convertono separatamente, ciascuno solo sulle proprie righe.
+            text = np.empty(len(values), dtype=object)
+            if float_mask.any():
+                text[float_mask] = self._format_float_sdi(values[float_mask]).to_numpy()
+            if not float_mask.all():
+                text[~float_mask] = self._strip_sdi_text(values[~float_mask].astype(str)).to_numpy()
+            result = pd.Series(text, index=series.index, dtype=object)
+        return result.where(series.notna(), "").astype(str)
+
+    def _float_value_mask(self, values: pd.Series) -> np.ndarray:
+        # Il tipo si inferisce per blocchi: solo i blocchi con tipi misti vengono scorsi valore per valore.
+        array = values.to_numpy(dtype=object)
+        mask = np.zeros(len(array), dtype=bool)
+        for start in range(0, len(array), self.SDI_TYPE_CHUNK_ROWS):
+            chunk = array[start : start + self.SDI_TYPE_CHUNK_ROWS]
+            kind = pd.api.types.infer_dtype(chunk, skipna=True)
+            if kind == "floating":
+                mask[start : start + len(chunk)] = True
+            elif kind not in self.SDI_NON_FLOAT_KINDS:
+                mask[start : start + len(chunk)] = [isinstance(value, float) for value in chunk]
+        return mask
+
+    def _group_text_values(self, values: pd.Series, keys: pd.Series) -> pd.Series:
+        # Testo dei valori non nulli come lo produce astype(str) sulle sole righe del gruppo.
+        present = values.notna()
+        if not pd.api.types.is_datetime64_any_dtype(values.dtype):
+            return values.astype(str).str.strip().where(present)
+        # Le date senza orario diventano "AAAA-MM-GG" solo se lo sono tutte quelle del gruppo.
+        has_time = present & (values != values.dt.normalize())
+        timed = has_time.groupby(keys).transform("any")
+        text = values.dt.strftime("%Y-%m-%d").astype(object)
+        if timed.any():
+            text[timed] = values[timed].groupby(keys[timed]).transform(lambda group: group.astype(str)).to_numpy()
+        return text.where(present)
+
+    def _classify_outcome(self, to_show: pd.DataFrame) -> pd.Series:
+        nfs_count = to_show["NFS Numero"]
+        pisa_count = to_show["Pisa Numero"]
+        conditions = [
+            (nfs_count > 0) & (pisa_count == 0),
+            (pisa_count > 0) & (nfs_count == 0),
+            to_show["Delta Importo"].abs() > self.AMOUNT_TOLERANCE_CENTS,
+            to_show["Delta Numero"].astype(int) != 0,
+        ]
+        choices = ["Solo NFS", "Solo Pisa", "Importo diverso", "Numero diverso"]
+        return pd.Series(np.select(conditions, choices, default=""), index=to_show.index, dtype=str)
 
     def _create_fatture_da_verificare_sheet(
         self,
@@ -1172,8 +1698,9 @@ class CompareFTFileProcessor:
         df_pisa: pd.DataFrame,
         header_fill: PatternFill,
         header_font: Font,
+        title: str = "Differenze tra file",
     ) -> None:
-        ws = wb.create_sheet("Differenze tra file")
+        ws = wb.create_sheet(title)
 
         headers = [
             "Identificativo SDI",
@@ -1204,11 +1731,11 @@ class CompareFTFileProcessor:
             text = re.sub(r"\s+", "", text)
             return text
 
-        nfs_sdi_empty = self._is_empty_sdi(df_nfs["_SDI_KEY"])
-        pisa_sdi_empty = self._is_empty_sdi(df_pisa["_SDI_KEY"])
+        nfs_sdi_empty = df_nfs["_CARTACEA"]
+        pisa_sdi_empty = df_pisa["_CARTACEA"]
 
-        nfs_non_empty = df_nfs[~nfs_sdi_empty].copy()
-        pisa_non_empty = df_pisa[~pisa_sdi_empty].copy()
+        nfs_non_empty = df_nfs[~nfs_sdi_empty]
+        pisa_non_empty = df_pisa[~pisa_sdi_empty]
 
         def build_side_agg(
             df: pd.DataFrame,
@@ -1218,30 +1745,24 @@ class CompareFTFileProcessor:
             extra_cols: List[str],
             prefix: str,
         ) -> pd.DataFrame:
-            df_local = df.copy()
-            df_local[key_col] = df_local[key_col].astype(str).str.strip()
-            grp = df_local.groupby(key_col, dropna=False)
+            keys = df[key_col].astype(str).str.strip()
+            grp = df.assign(**{key_col: keys}).groupby(key_col, dropna=False)
+            sizes = grp.size()
 
             out = pd.DataFrame(
                 {
-                    "Identificativo SDI": [f"{key_prefix}{key}" for key in grp.size().index.astype(str)],
-                    f"{prefix} Numero": grp.size().values,
+                    "Identificativo SDI": [f"{key_prefix}{key}" for key in sizes.index.astype(str)],
+                    f"{prefix} Numero": sizes.values,
                     f"{prefix} Importo": grp[amount_col].sum().values,
                 }
             )
 
+            texts = pd.DataFrame({col: self._group_text_values(df[col], keys) for col in extra_cols})
+            texts[key_col] = keys
+            text_agg = texts.groupby(key_col, dropna=False).agg(["first", "nunique"]).reindex(sizes.index)
             for col in extra_cols:
-                first_values = grp[col].apply(
-                    lambda s: s.dropna().astype(str).str.strip().iloc[0] if len(s.dropna()) else ""
-                )
-                nunique_values = grp[col].apply(lambda s: s.dropna().astype(str).str.strip().nunique())
-                values: List[str] = []
-                for key in grp.size().index.astype(str):
-                    if int(nunique_values.loc[key]) > 1:
-                        values.append("MULTIPLE")
-                    else:
-                        values.append(str(first_values.loc[key]))
-                out[f"{prefix} {col}"] = values
+                first_values = text_agg[(col, "first")].fillna("").astype(str)
+                out[f"{prefix} {col}"] = first_values.where(text_agg[(col, "nunique")] <= 1, "MULTIPLE").values
 
             return out
 
@@ -1256,7 +1777,7 @@ class CompareFTFileProcessor:
                 nfs_df,
                 key_col=key_col_nfs,
                 key_prefix=key_prefix,
-                amount_col="Imponibile",
+                amount_col="_CENTESIMI",
                 extra_cols=["Ragione sociale", "N.fatture", "Datat reg."],
                 prefix="NFS",
             )
@@ -1264,7 +1785,7 @@ class CompareFTFileProcessor:
                 pisa_df,
                 key_col=key_col_pisa,
                 key_prefix=key_prefix,
-                amount_col="Importo fattura",
+                amount_col="_CENTESIMI",
                 extra_cols=["Creditore", "Numero fattura", "Data emissione"],
                 prefix="Pisa",
             )
@@ -1272,20 +1793,22 @@ class CompareFTFileProcessor:
             merged = nfs_agg.merge(pisa_agg, on="Identificativo SDI", how="outer")
             merged["NFS Numero"] = pd.to_numeric(merged["NFS Numero"], errors="coerce").fillna(0).astype(int)
             merged["Pisa Numero"] = pd.to_numeric(merged["Pisa Numero"], errors="coerce").fillna(0).astype(int)
-            merged["NFS Importo"] = pd.to_numeric(merged["NFS Importo"], errors="coerce").fillna(0.0)
-            merged["Pisa Importo"] = pd.to_numeric(merged["Pisa Importo"], errors="coerce").fillna(0.0)
+            merged["NFS Importo"] = merged["NFS Importo"].fillna(0).astype("int64")
+            merged["Pisa Importo"] = merged["Pisa Importo"].fillna(0).astype("int64")
 
             merged["Delta Numero"] = merged["NFS Numero"] - merged["Pisa Numero"]
-            merged["Delta Importo"] = (merged["NFS Importo"] - merged["Pisa Importo"]).round(2)
+            merged["Delta Importo"] = merged["NFS Importo"] - merged["Pisa Importo"]
 
             is_only_nfs = (merged["NFS Numero"] > 0) & (merged["Pisa Numero"] == 0)
             is_only_pisa = (merged["Pisa Numero"] > 0) & (merged["NFS Numero"] == 0)
             is_diff_amount = (
-                (merged["NFS Numero"] > 0) & (merged["Pisa Numero"] > 0) & (merged["Delta Importo"].abs() > 0.01)
+                (merged["NFS Numero"] > 0)
+                & (merged["Pisa Numero"] > 0)
+                & (merged["Delta Importo"].abs() > self.AMOUNT_TOLERANCE_CENTS)
             )
             is_diff_count = (merged["NFS Numero"] > 0) & (merged["Pisa Numero"] > 0) & (merged["Delta Numero"] != 0)
 
-            return merged[is_only_nfs | is_only_pisa | is_diff_amount | is_diff_count].copy()
+            return merged[is_only_nfs | is_only_pisa | is_diff_amount | is_diff_count]
 
         to_show_elet = build_mismatch_df(
             nfs_df=nfs_non_empty,
@@ -1295,8 +1818,8 @@ class CompareFTFileProcessor:
             key_prefix="",
         )
 
-        nfs_cart = df_nfs[nfs_sdi_empty].copy()
-        pisa_cart = df_pisa[pisa_sdi_empty].copy()
+        nfs_cart = df_nfs[nfs_sdi_empty]
+        pisa_cart = df_pisa[pisa_sdi_empty]
         nfs_cart["_CART_KEY"] = nfs_cart["N.fatture"].map(normalize_text).replace("", "(vuoto)")
         pisa_cart["_CART_KEY"] = pisa_cart["Numero fattura"].map(normalize_text).replace("", "(vuoto)")
 
@@ -1317,49 +1840,28 @@ class CompareFTFileProcessor:
         else:
             to_show = pd.concat([to_show_elet, to_show_cart], ignore_index=True, sort=False)
 
-        def outcome(row: pd.Series) -> str:
-            if row["NFS Numero"] > 0 and row["Pisa Numero"] == 0:
-                return "Solo NFS"
-            if row["Pisa Numero"] > 0 and row["NFS Numero"] == 0:
-                return "Solo Pisa"
-            if abs(float(row["Delta Importo"])) > 0.01:
-                return "Importo diverso"
-            if int(row["Delta Numero"]) != 0:
-                return "Numero diverso"
-            return ""
-
-        if to_show.empty:
-            to_show["Esito"] = pd.Series(dtype=str)
-        else:
-            to_show["Esito"] = to_show.apply(outcome, axis=1)
+        to_show["Esito"] = self._classify_outcome(to_show)
         to_show = to_show.sort_values(by=["Esito", "Identificativo SDI"], ascending=[True, True])
 
+        rows = to_show.reindex(columns=self.DIFFERENZE_COLUMNS)
+        for column in ("NFS Datat reg.", "Pisa Data emissione"):
+            values = rows[column].astype(object)
+            rows[column] = values.where(values != "", None)
+        for column in ("NFS Importo", "Pisa Importo", "Delta Importo"):
+            rows[column] = cents_to_amount(rows[column].fillna(0).astype("int64"))
+        rows["Delta Numero"] = rows["Delta Numero"].fillna(0).astype(int)
+
         money_format = "#,##0.00"
         date_format = "dd/mm/yyyy"
-        row_idx = 2
-        for _, row in to_show.iterrows():
-            ws.cell(row=row_idx, column=1, value=row.get("Identificativo SDI", ""))
-            ws.cell(row=row_idx, column=2, value=row.get("Esito", ""))
-            ws.cell(row=row_idx, column=3, value=row.get("NFS Ragione sociale", ""))
-            ws.cell(row=row_idx, column=4, value=row.get("NFS N.fatture", ""))
-            nfs_date = row.get("NFS Datat reg.", "")
-            pisa_date = row.get("Pisa Data emissione", "")
-            c5 = ws.cell(row=row_idx, column=5, value=nfs_date if nfs_date != "" else None)
-            if c5.value is not None:
-                c5.number_format = date_format
-            c6 = ws.cell(row=row_idx, column=6, value=float(row.get("NFS Importo", 0.0)))
-            c6.number_format = money_format
-            ws.cell(row=row_idx, column=7, value=row.get("Pisa Creditore", ""))
-            ws.cell(row=row_idx, column=8, value=row.get("Pisa Numero fattura", ""))
-            c9 = ws.cell(row=row_idx, column=9, value=pisa_date if pisa_date != "" else None)
-            if c9.value is not None:
-                c9.number_format = date_format
-            c10 = ws.cell(row=row_idx, column=10, value=float(row.get("Pisa Importo", 0.0)))
-            c10.number_format = money_format
-            ws.cell(row=row_idx, column=11, value=int(row.get("Delta Numero", 0)))
-            c12 = ws.cell(row=row_idx, column=12, value=float(row.get("Delta Importo", 0.0)))
-            c12.number_format = money_format
-            row_idx += 1
+        column_formats = {4: date_format, 5: money_format, 8: date_format, 9: money_format, 11: money_format}
+        for values in rows.astype(object).itertuples(index=False, name=None):
+            values = list(values)
+            for idx, number_format in column_formats.items():
+                if values[idx] is not None:
+                    cell = WriteOnlyCell(ws, value=values[idx])
+                    cell.number_format = number_format
+                    values[idx] = cell
+            ws.append(values)
 
         ws.column_dimensions["A"].width = 22
         ws.column_dimensions["B"].width = 16
@@ -1373,307 +1875,3 @@ class CompareFTFileProcessor:
         ws.column_dimensions["J"].width = 18
         ws.column_dimensions["K"].width = 14
         ws.column_dimensions["L"].width = 16
-
-    def _create_differenze_elettroniche_sheet(
-        self,
-        wb: Workbook,
-        df_nfs: pd.DataFrame,
-        df_pisa: pd.DataFrame,
-        nfs_elet_mask: pd.Series,
-        pisa_cart_mask: pd.Series,
-        header_fill: PatternFill,
-        header_font: Font,
-    ) -> None:
-        ws = wb.create_sheet("Differenze Elettroniche SDI")
-
-        headers = [
-            "Sezione",
-            "Identificativo SDI",
-            "NFS Ragione sociale",
-            "NFS N.fatture",
-            "NFS Datat reg.",
-            "NFS Prot.",
-            "NFS Imponibile",
-            "Pisa Creditore",
-            "Pisa Numero fattura",
-            "Pisa Data emissione",
-            "Pisa Importo fattura",
-        ]
-        for col_idx, value in enumerate(headers, start=1):
-            cell = ws.cell(row=1, column=col_idx, value=value)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-
-        money_format = "#,##0.00"
-        date_format = "dd/mm/yyyy"
-
-        nfs_elet = df_nfs[nfs_elet_mask].copy()
-        pisa_elet = df_pisa[~pisa_cart_mask].copy()
-
-        nfs_sdi_empty = self._is_empty_sdi(nfs_elet["_SDI_KEY"])
-        pisa_sdi_empty = self._is_empty_sdi(pisa_elet["_SDI_KEY"])
-        nfs_elet_non_empty = nfs_elet[~nfs_sdi_empty].copy()
-        pisa_elet_non_empty = pisa_elet[~pisa_sdi_empty].copy()
-
-        nfs_keys = set(nfs_elet_non_empty["_SDI_KEY"].astype(str).str.strip())
-        pisa_keys = set(pisa_elet_non_empty["_SDI_KEY"].astype(str).str.strip())
-
-        only_pisa_keys = sorted(pisa_keys - nfs_keys)
-        only_nfs_keys = sorted(nfs_keys - pisa_keys)
-
-        nfs_elet_empty_sdi = nfs_elet[nfs_sdi_empty].copy()
-
-        row_idx = 2
-
-        def write_row(
-            section: str,
-            sdi: str,
-            nfs_row: Optional[pd.Series],
-            pisa_row: Optional[pd.Series],
-        ) -> None:
-            nonlocal row_idx
-            ws.cell(row=row_idx, column=1, value=section)
-            ws.cell(row=row_idx, column=2, value=sdi)
-
-            if nfs_row is not None:
-                ws.cell(row=row_idx, column=3, value=nfs_row.get("Ragione sociale", ""))
-                ws.cell(row=row_idx, column=4, value=nfs_row.get("N.fatture", ""))
-                c5 = ws.cell(row=row_idx, column=5, value=nfs_row.get("Datat reg.", None))
-                if c5.value is not None:
-                    c5.number_format = date_format
-                ws.cell(row=row_idx, column=6, value=nfs_row.get("Prot.", ""))
-                c7 = ws.cell(row=row_idx, column=7, value=float(nfs_row.get("Imponibile", 0.0)))
-                c7.number_format = money_format
-            else:
-                for c in range(3, 8):
-                    ws.cell(row=row_idx, column=c, value="")
-
-            if pisa_row is not None:
-                ws.cell(row=row_idx, column=8, value=pisa_row.get("Creditore", ""))
-                ws.cell(row=row_idx, column=9, value=pisa_row.get("Numero fattura", ""))
-                c10 = ws.cell(row=row_idx, column=10, value=pisa_row.get("Data emissione", None))
-                if c10.value is not None:
-                    c10.number_format = date_format
-                c11 = ws.cell(row=row_idx, column=11, value=float(pisa_row.get("Importo fattura", 0.0)))
-                c11.number_format = money_format
-            else:
-                for c in range(8, 12):
-                    ws.cell(row=row_idx, column=c, value="")
-
-            row_idx += 1
-
-        nfs_first_by_key = (
-            nfs_elet_non_empty.sort_values(by=["Datat reg.", "N.fatture"], na_position="last")
-            .drop_duplicates(subset=["_SDI_KEY"], keep="first")
-            .set_index("_SDI_KEY")
-        )
-        pisa_first_by_key = (
-            pisa_elet_non_empty.sort_values(by=["Data emissione", "Numero fattura"], na_position="last")
-            .drop_duplicates(subset=["_SDI_KEY"], keep="first")
-            .set_index("_SDI_KEY")
-        )
-
-        for key in only_pisa_keys:
-            write_row("Solo Pisa", key, None, pisa_first_by_key.loc[key])
-
-        for key in only_nfs_keys:
-            write_row("Solo NFS", key, nfs_first_by_key.loc[key], None)
-
-        for _, r in nfs_elet_empty_sdi.sort_values(by=["Datat reg.", "N.fatture"], na_position="last").iterrows():
-            write_row("NFS SDI vuoto", "", r, None)
-
-        ws.column_dimensions["A"].width = 14
-        ws.column_dimensions["B"].width = 22
-        ws.column_dimensions["C"].width = 26
-        ws.column_dimensions["D"].width = 14
-        ws.column_dimensions["E"].width = 14
-        ws.column_dimensions["F"].width = 12
-        ws.column_dimensions["G"].width = 16
-        ws.column_dimensions["H"].width = 26
-        ws.column_dimensions["I"].width = 16
-        ws.column_dimensions["J"].width = 16
-        ws.column_dimensions["K"].width = 18
-
-    def _create_differenze_sdi_univoche_sheet(
-        self,
-        wb: Workbook,
-        df_nfs: pd.DataFrame,
-        df_pisa: pd.DataFrame,
-        nfs_elet_mask: pd.Series,
-        pisa_cart_mask: pd.Series,
-        header_fill: PatternFill,
-        header_font: Font,
-    ) -> None:
-        ws = wb.create_sheet("Differenze SDI in Comune")
-
-        headers = [
-            "Identificativo SDI",
-            "NFS Ragione sociale",
-            "NFS N.fatture",
-            "NFS Datat reg.",
-            "NFS Imponibile",
-            "Pisa Creditore",
-            "Pisa Numero fattura",
-            "Pisa Data emissione",
-            "Pisa Importo fattura",
-            "Delta Importo",
-        ]
-        for col_idx, value in enumerate(headers, start=1):
-            cell = ws.cell(row=1, column=col_idx, value=value)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-
-        money_format = "#,##0.00"
-        date_format = "dd/mm/yyyy"
-
-        nfs_elet = df_nfs[nfs_elet_mask].copy()
-        pisa_elet = df_pisa[~pisa_cart_mask].copy()
-
-        nfs_sdi_empty = self._is_empty_sdi(nfs_elet["_SDI_KEY"])
-        pisa_sdi_empty = self._is_empty_sdi(pisa_elet["_SDI_KEY"])
-        nfs_elet = nfs_elet[~nfs_sdi_empty].copy()
-        pisa_elet = pisa_elet[~pisa_sdi_empty].copy()
-
-        nfs_counts = nfs_elet["_SDI_KEY"].value_counts()
-        pisa_counts = pisa_elet["_SDI_KEY"].value_counts()
-
-        common_keys = set(nfs_counts.index) & set(pisa_counts.index)
-        common_unique_keys = sorted(
-            [k for k in common_keys if int(nfs_counts.get(k, 0)) == 1 and int(pisa_counts.get(k, 0)) == 1]
-        )
-
-        nfs_unique = nfs_elet.set_index("_SDI_KEY", drop=False)
-        pisa_unique = pisa_elet.set_index("_SDI_KEY", drop=False)
-
-        row_idx = 2
-        for key in common_unique_keys:
-            nfs_row = nfs_unique.loc[key]
-            pisa_row = pisa_unique.loc[key]
-
-            delta = round(float(nfs_row.get("Imponibile", 0.0)) - float(pisa_row.get("Importo fattura", 0.0)), 2)
-            if abs(delta) <= 0.01:
-                continue
-
-            ws.cell(row=row_idx, column=1, value=key)
-            ws.cell(row=row_idx, column=2, value=nfs_row.get("Ragione sociale", ""))
-            ws.cell(row=row_idx, column=3, value=nfs_row.get("N.fatture", ""))
-            c4 = ws.cell(row=row_idx, column=4, value=nfs_row.get("Datat reg.", None))
-            if c4.value is not None:
-                c4.number_format = date_format
-            c5 = ws.cell(row=row_idx, column=5, value=float(nfs_row.get("Imponibile", 0.0)))
-            c5.number_format = money_format
-
-            ws.cell(row=row_idx, column=6, value=pisa_row.get("Creditore", ""))
-            ws.cell(row=row_idx, column=7, value=pisa_row.get("Numero fattura", ""))
-            c8 = ws.cell(row=row_idx, column=8, value=pisa_row.get("Data emissione", None))
-            if c8.value is not None:
-                c8.number_format = date_format
-            c9 = ws.cell(row=row_idx, column=9, value=float(pisa_row.get("Importo fattura", 0.0)))
-            c9.number_format = money_format
-
-            c10 = ws.cell(row=row_idx, column=10, value=delta)
-            c10.number_format = money_format
-            row_idx += 1
-
-        ws.column_dimensions["A"].width = 22
-        ws.column_dimensions["B"].width = 26
-        ws.column_dimensions["C"].width = 14
-        ws.column_dimensions["D"].width = 14
-        ws.column_dimensions["E"].width = 16
-        ws.column_dimensions["F"].width = 26
-        ws.column_dimensions["G"].width = 16
-        ws.column_dimensions["H"].width = 16
-        ws.column_dimensions["I"].width = 18
-        ws.column_dimensions["J"].width = 16
-
-    def _create_pisa_solo_mese_nfs_sheet(
-        self,
-        wb: Workbook,
-        df_nfs_lookup: pd.DataFrame,
-        df_nfs_jan: pd.DataFrame,
-        df_pisa_jan: pd.DataFrame,
-        nfs_elet_mask: pd.Series,
-        pisa_cart_mask: pd.Series,
-        header_fill: PatternFill,
-        header_font: Font,
-    ) -> None:
-        ws = wb.create_sheet("Pisa Solo - Mese NFS")
-
-        headers = [
-            "Identificativo SDI",
-            "Pisa Creditore",
-            "Pisa Numero fattura",
-            "Pisa Data emissione",
-            "Pisa Importo fattura",
-            "NFS Mesi trovati",
-            "NFS Prima registrazione",
-        ]
-        for col_idx, value in enumerate(headers, start=1):
-            cell = ws.cell(row=1, column=col_idx, value=value)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-
-        money_format = "#,##0.00"
-        date_format = "dd/mm/yyyy"
-
-        pisa_elet = df_pisa_jan[~pisa_cart_mask].copy()
-        pisa_elet = pisa_elet[~self._is_empty_sdi(pisa_elet["_SDI_KEY"])].copy()
-        nfs_elet = df_nfs_jan[nfs_elet_mask].copy()
-        nfs_elet = nfs_elet[~self._is_empty_sdi(nfs_elet["_SDI_KEY"])].copy()
-
-        pisa_keys = set(pisa_elet["_SDI_KEY"].astype(str).str.strip())
-        nfs_keys = set(nfs_elet["_SDI_KEY"].astype(str).str.strip())
-        only_pisa_keys = sorted(pisa_keys - nfs_keys)
-
-        pisa_first_by_key = (
-            pisa_elet.sort_values(by=["Data emissione", "Numero fattura"], na_position="last")
-            .drop_duplicates(subset=["_SDI_KEY"], keep="first")
-            .set_index("_SDI_KEY")
-        )
-
-        df_nfs_lookup_non_empty = df_nfs_lookup[~self._is_empty_sdi(df_nfs_lookup["_SDI_KEY"])].copy()
-        df_nfs_lookup_non_empty["_SDI_KEY_NORM"] = df_nfs_lookup_non_empty["_SDI_KEY"].astype(str).str.strip()
-        df_nfs_lookup_non_empty["_NFS_DATE"] = pd.to_datetime(
-            df_nfs_lookup_non_empty["Datat reg."], errors="coerce", dayfirst=True
-        )
-        df_nfs_lookup_non_empty["_NFS_MONTH"] = df_nfs_lookup_non_empty["_NFS_DATE"].dt.to_period("M").astype(str)
-        nfs_months_by_key = (
-            df_nfs_lookup_non_empty.dropna(subset=["_NFS_MONTH"])
-            .groupby("_SDI_KEY_NORM")["_NFS_MONTH"]
-            .agg(lambda values: sorted(set(values)))
-        )
-        nfs_first_reg_by_key = df_nfs_lookup_non_empty.groupby("_SDI_KEY_NORM")["_NFS_DATE"].min()
-
-        row_idx = 2
-        for key in only_pisa_keys:
-            pisa_row = pisa_first_by_key.loc[key]
-            months = nfs_months_by_key.get(key, [])
-            first_reg = nfs_first_reg_by_key.get(key, None)
-
-            ws.cell(row=row_idx, column=1, value=key)
-            ws.cell(row=row_idx, column=2, value=pisa_row.get("Creditore", ""))
-            ws.cell(row=row_idx, column=3, value=pisa_row.get("Numero fattura", ""))
-
-            c4 = ws.cell(row=row_idx, column=4, value=pisa_row.get("Data emissione", None))
-            if c4.value is not None:
-                c4.number_format = date_format
-            c5 = ws.cell(row=row_idx, column=5, value=float(pisa_row.get("Importo fattura", 0.0)))
-            c5.number_format = money_format
-
-            ws.cell(row=row_idx, column=6, value=", ".join(months))
-            c7 = ws.cell(row=row_idx, column=7, value=first_reg)
-            if c7.value is not None:
-                c7.number_format = date_format
-
-            row_idx += 1
-
-        ws.column_dimensions["A"].width = 22
-        ws.column_dimensions["B"].width = 30
-        ws.column_dimensions["C"].width = 18
-        ws.column_dimensions["D"].width = 16
-        ws.column_dimensions["E"].width = 18
-        ws.column_dimensions["F"].width = 22
-        ws.column_dimensions["G"].width = 20
@@ -0,0 +1,187 @@
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import os
+import threading
+import time
+import weakref
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Colonne di testo con valori distinti sotto questa quota diventano categoriche.
+CATEGORY_MAX_RATIO = 0.5
+STATM_PATH = "/proc/self/statm"
+# Intervallo di campionamento dell'RSS per i picchi di fase.
+RSS_SAMPLE_SECONDS = 0.05
+
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def current_rss_bytes() -> int:
+    """RSS attuale del processo (0 dove ``/proc`` non è disponibile)."""
+    try:
+        with open(STATM_PATH, "rb") as handle:
+            resident_pages = int(handle.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class _RssSampler:
+    """Thread unico che legge l'RSS a intervalli e lo passa ai tracker attivi.
+
+    Il thread parte con il primo tracker e si ferma quando non ce ne sono più; i
+    tracker sono tenuti con riferimenti deboli, così un job interrotto non lascia
+    il campionamento attivo.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._reset()
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._trackers: "weakref.WeakSet[RssPeak]" = weakref.WeakSet()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, tracker: "RssPeak") -> None:
+        with self._lock:
+            self._trackers.add(tracker)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+
+    def discard(self, tracker: "RssPeak") -> None:
+        with self._lock:
+            self._trackers.discard(tracker)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                trackers = list(self._trackers)
+                if not trackers:
+                    self._thread = None
+                    return
+            rss = current_rss_bytes()
+            for tracker in trackers:
+                tracker.observe(rss)
+
+
+_SAMPLER = _RssSampler(RSS_SAMPLE_SECONDS)
+if hasattr(os, "register_at_fork"):
+    # Nei processi del pool il thread del padre non esiste: si riparte da zero.
+    os.register_at_fork(after_in_child=_SAMPLER._reset)
+
+
+class RssPeak:
+    """Picco di RSS del processo tra due letture, campionato ogni ``RSS_SAMPLE_SECONDS``.
+
+    Il picco comprende la lettura iniziale e quella finale, ma un aumento più breve
+    dell'intervallo di campionamento può sfuggire. È l'RSS dell'intero processo:
+    con più job nello stesso processo comprende anche gli altri job in corso.
+    """
+
+    def __init__(self) -> None:
+        self.peak = 0
+        self.active = False
+
+    def start(self, rss: Optional[int] = None) -> int:
+        rss = current_rss_bytes() if rss is None else rss
+        self.peak = rss
+        self.active = bool(rss)
+        if self.active:
+            _SAMPLER.add(self)
+        return rss
+
+    def observe(self, rss: int) -> None:
+        if rss > self.peak:
+            self.peak = rss
+
+    def lap(self) -> Tuple[int, int]:
+        """Chiude l'intervallo in corso e ne apre subito un altro: restituisce ``(picco, rss finale)``."""
+        rss = current_rss_bytes()
+        self.observe(rss)
+        peak = self.peak
+        self.peak = rss
+        return peak, rss
+
+    def stop(self) -> Tuple[int, int]:
+        result = self.lap()
+        _SAMPLER.discard(self)
+        self.active = False
+        return result
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Rappresentazione compatta di un DataFrame appena letto.
+
+    Le colonne di solo testo diventano categoriche se hanno pochi valori distinti
+    (protocolli, codici tributo) e stringhe Arrow altrimenti (ragioni sociali,
+    identificativi SDI); gli interi vengono ridotti al tipo più piccolo sufficiente.
+    Le colonne miste (es. numeri e testo nella stessa colonna) e i float, che
+    contengono importi, restano invariati.
+    """
+    columns: Dict[Any, pd.Series] = {}
+    for column in df.columns:
+        series = df[column]
+        if series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            non_null = series.dropna()
+            if non_null.empty or not non_null.map(type).eq(str).all():
+                columns[column] = series
+            elif non_null.nunique() <= len(non_null) * CATEGORY_MAX_RATIO:
+                columns[column] = series.astype("category")
+            else:
+                columns[column] = series.astype("str")
+        elif pd.api.types.is_integer_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+            columns[column] = pd.to_numeric(series, downcast="integer")
+        else:
+            columns[column] = series
+    return pd.DataFrame(columns, index=df.index)
+
+
+class MemoryReport:
+    """Occupazione dei DataFrame e picco di memoria del processo per ogni fase di un job.
+
+    Ogni ``record`` chiude la fase iniziata con ``start`` o con il ``record``
+    precedente; il picco è quello di ``RssPeak`` sulla sola fase.
+    """
+
+    def __init__(self, job: str, enabled: bool = True) -> None:
+        self.job = job
+        self.enabled = enabled
+        self.stages: List[Dict[str, Any]] = []
+        self._peak = RssPeak()
+
+    def start(self) -> None:
+        self.stages = []
+        if self.enabled:
+            self._peak.start()
+
+    def finish(self) -> List[Dict[str, Any]]:
+        if self._peak.active:
+            self._peak.stop()
+        return self.stages
+
+    def record(self, stage: str, *frames: pd.DataFrame) -> None:
+        if not self.enabled:
+            return
+        if not self._peak.active:
+            self._peak.start()
+        peak, _ = self._peak.lap()
+        entry = {
+            "stage": stage,
+            "frame_bytes": sum(frame_bytes(df) for df in frames),
+            "peak_rss_bytes": peak,
+        }
+        self.stages.append(entry)
+        logger.info(
+            "Memoria %s [%s]: dataframe %.1f MB, picco processo nella fase %.1f MB",
+            self.job,
+            stage,
+            entry["frame_bytes"] / 1024 / 1024,
+            entry["peak_rss_bytes"] / 1024 / 1024,
+        )
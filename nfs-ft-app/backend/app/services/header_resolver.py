@@ -0,0 +1,107 @@
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Sequence, Tuple
+import re
+
+import pandas as pd
+
+
+HEADER_PLAN_CACHE_SIZE = 256
+NON_ALNUM_PATTERN = re.compile(r"[^A-Z0-9]")
+
+HeaderSignature = Tuple[str, ...]
+AliasRule = Tuple[str, str]
+
+
+@lru_cache(maxsize=4096)
+def _normalize_text(text: str) -> str:
+    return NON_ALNUM_PATTERN.sub("", text.strip().upper())
+
+
+def normalize_header(value: Any) -> str:
+    """Chiave di confronto di un'intestazione: maiuscolo, solo lettere e cifre."""
+    return _normalize_text(str(value))
+
+
+def header_signature(header: Sequence[Any]) -> HeaderSignature:
+    return tuple(str(value).strip() for value in header)
+
+
+class HeaderPlan:
+    """Esito della risoluzione di una riga di intestazione.
+
+    ``labels`` ha un'etichetta per ogni colonna dell'intestazione (il nome canonico
+    se la colonna è stata riconosciuta, altrimenti il nome originale ripulito),
+    ``indices`` sono le colonne che corrispondono ad almeno una regola e vanno
+    quindi lette, ``missing`` le colonne obbligatorie non trovate.
+    """
+
+    __slots__ = ("labels", "indices", "missing")
+
+    def __init__(self, labels: HeaderSignature, indices: Tuple[int, ...], missing: Tuple[str, ...]) -> None:
+        self.labels = labels
+        self.indices = indices
+        self.missing = missing
+
+
+class HeaderResolver:
+    """Riconoscimento delle colonne di un export a partire dalla riga di intestazione.
+
+    Le regole sono coppie ``(alias, nome canonico)`` in ordine di priorità e vengono
+    normalizzate una sola volta alla costruzione. Una colonna che ha già il nome
+    canonico esatto vince su qualsiasi alias; a parità di chiave normalizzata vale
+    l'ultima colonna del file e ogni colonna viene assegnata al più a un nome
+    canonico. I piani sono memorizzati per firma dell'intestazione, quindi un
+    export con lo stesso layout non viene più analizzato.
+    """
+
+    def __init__(self, rules: Sequence[AliasRule], required: Sequence[str]) -> None:
+        compiled: Dict[Tuple[str, str], None] = {}
+        for alias, canonical in rules:
+            compiled[(normalize_header(alias), canonical)] = None
+        self._rules: List[Tuple[str, str]] = list(compiled)
+        self._keys: FrozenSet[str] = frozenset(key for key, _ in self._rules)
+        self._canonical: FrozenSet[str] = frozenset(canonical for _, canonical in self._rules)
+        self.required: Tuple[str, ...] = tuple(required)
+        self._plans: Dict[HeaderSignature, HeaderPlan] = {}
+
+    def resolve(self, header: Sequence[Any]) -> HeaderPlan:
+        signature = header_signature(header)
+        plan = self._plans.get(signature)
+        if plan is None:
+            plan = self._build_plan(signature)
+            if len(self._plans) >= HEADER_PLAN_CACHE_SIZE:
+                self._plans.clear()
+            self._plans[signature] = plan
+        return plan
+
+    def select_columns(self, header: List[Any]) -> List[int]:
+        """Indici delle colonne da leggere, nel formato di ``read_excel_streaming``."""
+        return list(self.resolve(header).indices)
+
+    def rename(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, HeaderPlan]:
+        """``df`` con le colonne riconosciute rinominate ai nomi canonici (senza copia)."""
+        plan = self.resolve(df.columns)
+        return df.set_axis(list(plan.labels), axis=1), plan
+
+    def _build_plan(self, signature: HeaderSignature) -> HeaderPlan:
+        keys = [normalize_header(name) for name in signature]
+        key_to_index = {key: idx for idx, key in enumerate(keys)}
+        labels = list(signature)
+        resolved = {name for name in signature if name in self._canonical}
+        claimed = {idx for idx, name in enumerate(signature) if name in resolved}
+
+        for key, canonical in self._rules:
+            if canonical in resolved:
+                continue
+            idx = key_to_index.get(key)
+            if idx is None or idx in claimed:
+                continue
+            labels[idx] = canonical
+            claimed.add(idx)
+            resolved.add(canonical)
+
+        return HeaderPlan(
+            tuple(labels),
+            tuple(idx for idx, key in enumerate(keys) if key in self._keys),
+            tuple(column for column in self.required if column not in resolved),
+        )
@@ -0,0 +1,202 @@
+from datetime import date, datetime, time as dt_time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_MEMO_SIZE = 256
+MIXED_COLUMNS_KEY = b"nfs_ft_mixed_columns"
+# Versione del formato dei DataFrame in cache: va incrementata quando cambiano le
+# letture dei processor (colonne, tipi, normalizzazioni), così le voci scritte da
+# una versione precedente non vengono più servite.
+CACHE_SCHEMA_VERSION = 2
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _encode_value(value: Any) -> Tuple[str, Optional[str]]:
+    if value is None:
+        return "N", None
+    if isinstance(value, float) and value != value:
+        return "n", None
+    if isinstance(value, bool):
+        return "b", "1" if value else "0"
+    if isinstance(value, int):
+        return "i", str(value)
+    if isinstance(value, float):
+        return "f", repr(value)
+    if isinstance(value, datetime):
+        return "d", value.isoformat()
+    if isinstance(value, date):
+        return "D", value.isoformat()
+    if isinstance(value, dt_time):
+        return "t", value.isoformat()
+    if isinstance(value, pd.Timestamp):
+        return "d", value.to_pydatetime().isoformat()
+    return "s", str(value)
+
+
+def _decode_value(kind: str, text: Optional[str]) -> Any:
+    if kind == "N":
+        return None
+    if kind == "n":
+        return np.nan
+    if kind == "b":
+        return text == "1"
+    if kind == "i":
+        return int(text)
+    if kind == "f":
+        return float(text)
+    if kind == "d":
+        return datetime.fromisoformat(text)
+    if kind == "D":
+        return date.fromisoformat(text)
+    if kind == "t":
+        return dt_time.fromisoformat(text)
+    return text
+
+
+class ParsedInputCache:
+    """Cache su disco (Parquet) dei DataFrame letti dai file caricati.
+
+    La chiave è lo SHA-256 del contenuto del file più una ``variant`` che identifica
+    la lettura (es. ``"nfs"``, ``"pisa-ricevute"``) e ``CACHE_SCHEMA_VERSION``, quindi lo stesso file caricato su
+    endpoint diversi viene letto con openpyxl una sola volta. Le voci più vecchie di
+    ``max_age_hours`` vengono rimosse e, oltre ``max_bytes``, si eliminano quelle
+    usate meno di recente.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int, max_age_hours: int) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_hours * 3600
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+
+    def content_hash(self, path: Path) -> str:
+        stat = Path(path).stat()
+        memo_key = (str(path), stat.st_size, stat.st_mtime_ns)
+        digest = self._hashes.get(memo_key)
+        if digest is None:
+            digest = file_sha256(path)
+            if len(self._hashes) >= HASH_MEMO_SIZE:
+                self._hashes.clear()
+            self._hashes[memo_key] = digest
+        return digest
+
+    def remember_hash(self, path: Path, digest: str) -> None:
+        """Registra l'hash già calcolato (es. durante l'upload) per non rileggere il file."""
+        stat = Path(path).stat()
+        if len(self._hashes) >= HASH_MEMO_SIZE:
+            self._hashes.clear()
+        self._hashes[(str(path), stat.st_size, stat.st_mtime_ns)] = digest
+
+    def _entry_path(self, path: Path, variant: str) -> Path:
+        return self.cache_dir / f"{self.content_hash(path)}_{variant}_v{CACHE_SCHEMA_VERSION}.parquet"
+
+    def get(self, path: Path, variant: str) -> Optional[pd.DataFrame]:
+        entry = self._entry_path(path, variant)
+        if not entry.exists():
+            return None
+        try:
+            table = pq.read_table(entry)
+            df = table.to_pandas()
+            mixed = json.loads((table.schema.metadata or {}).get(MIXED_COLUMNS_KEY, b"[]"))
+            for column in mixed:
+                kinds = df.pop(f"{column}__kind")
+                df[column] = pd.Series(
+                    [_decode_value(kind, text) for kind, text in zip(kinds, df[column])],
+                    index=df.index,
+                    dtype=object,
+                )
+            os.utime(entry)
+        except Exception as exc:
+            logger.warning("Voce di cache non leggibile %s: %s", entry.name, str(exc))
+            entry.unlink(missing_ok=True)
+            return None
+        logger.info("Cache input: trovato %s (%s)", entry.name, variant)
+        return df
+
+    def put(self, path: Path, variant: str, df: pd.DataFrame) -> None:
+        entry = self._entry_path(path, variant)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_dir / f".{uuid.uuid4().hex}.tmp"
+        try:
+            to_store = pd.DataFrame(index=df.index)
+            mixed = []
+            for column in df.columns:
+                series = df[column]
+                if series.dtype == object and series.map(type).nunique(dropna=False) > 1:
+                    encoded = [_encode_value(value) for value in series]
+                    to_store[column] = pd.Series([text for _, text in encoded], index=df.index, dtype=object)
+                    to_store[f"{column}__kind"] = [kind for kind, _ in encoded]
+                    mixed.append(column)
+                else:
+                    to_store[column] = series
+            table = pa.Table.from_pandas(to_store, preserve_index=False)
+            metadata = dict(table.schema.metadata or {})
+            metadata[MIXED_COLUMNS_KEY] = json.dumps(mixed).encode()
+            pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+            os.replace(tmp_path, entry)
+        except Exception as exc:
+            logger.warning("Impossibile salvare in cache %s: %s", entry.name, str(exc))
+            tmp_path.unlink(missing_ok=True)
+            return
+        self.evict()
+
+    def load(self, path: Path, variant: str, loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        df = self.get(path, variant)
+        if df is not None:
+            return df
+        df = loader()
+        self.put(path, variant, df)
+        return df
+
+    def evict(self) -> None:
+        if not self.cache_dir.exists():
+            return
+        now = time.time()
+        entries = []
+        for entry in self.cache_dir.glob("*.parquet"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                entry.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+
+
+def load_cached(
+    cache: Optional[ParsedInputCache], path: Path, variant: str, loader: Callable[[], pd.DataFrame]
+) -> pd.DataFrame:
+    """Legge tramite ``cache`` se configurata, altrimenti chiama direttamente ``loader``."""
+    if cache is None:
+        return loader()
+    return cache.load(path, variant, loader)
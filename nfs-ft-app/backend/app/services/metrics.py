@@ -0,0 +1,202 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import re
+import threading
+import time
+
+from app.services.frame_memory import RssPeak
+
+
+STAGE_SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+RSS_BUCKETS = tuple(mb * 1024 * 1024 for mb in (128, 256, 512, 1024, 2048, 4096, 8192))
+# I fogli mensili ("Dati 01-2025") condividono un'etichetta, così le serie non crescono con i mesi.
+MONTH_SUFFIX_PATTERN = re.compile(r"\b\d{2}-\d{4}\b")
+
+Labels = Tuple[str, ...]
+
+
+class StageTimer:
+    """Tempo reale, tempo CPU e memoria delle fasi di un job.
+
+    Le fasi sono in sequenza: ``mark`` chiude quella in corso e apre la successiva,
+    ``finish`` chiude l'ultima e restituisce le misure. Il tempo CPU è quello del
+    thread che esegue il job. Per la memoria ``peak_rss_bytes`` è il picco di RSS
+    del processo durante la fase, campionato da ``RssPeak`` (vedi lì i limiti);
+    ``rss_bytes`` è l'RSS alla fine e ``rss_growth_bytes`` la differenza rispetto
+    all'inizio (negativa se la fase libera memoria).
+    """
+
+    def __init__(self) -> None:
+        self.stages: List[Dict[str, Any]] = []
+        self._current: Optional[Tuple[str, Optional[str], float, float, int]] = None
+        self._peak = RssPeak()
+
+    def start(self) -> None:
+        self.stages = []
+        self._current = None
+        if self._peak.active:
+            self._peak.stop()
+
+    def mark(self, stage: str, sheet: Optional[str] = None) -> None:
+        if self._current is None:
+            rss = self._peak.start()
+        else:
+            # La fine di una fase è l'inizio della successiva: l'RSS si legge una volta sola.
+            rss = self._close(self._peak.lap())
+        self._current = (stage, sheet, time.perf_counter(), time.thread_time(), rss)
+
+    def finish(self) -> List[Dict[str, Any]]:
+        if self._current is not None:
+            self._close(self._peak.stop())
+        return self.stages
+
+    def _close(self, peak_and_rss: Tuple[int, int]) -> int:
+        stage, sheet, wall_started, cpu_started, rss_started = self._current
+        entry: Dict[str, Any] = {"stage": stage}
+        if sheet is not None:
+            entry["sheet"] = sheet
+        entry["wall_seconds"] = round(time.perf_counter() - wall_started, 4)
+        entry["cpu_seconds"] = round(time.thread_time() - cpu_started, 4)
+        peak, rss = peak_and_rss
+        entry["peak_rss_bytes"] = peak
+        entry["rss_bytes"] = rss
+        entry["rss_growth_bytes"] = rss - rss_started
+        self.stages.append(entry)
+        self._current = None
+        return rss
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """Istogramma cumulativo nel formato di esposizione testuale di Prometheus."""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str], buckets: Sequence[float]) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        counts, total = self._series.setdefault(labels, ([0] * (len(self.buckets) + 1), [0.0]))
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[idx] += 1
+        counts[-1] += 1
+        total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                bucket_labels = _format_labels(self.label_names + ("le",), labels + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            series_labels = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{series_labels} {_format_value(round(total[0], 6))}")
+            lines.append(f"{self.name}_count{series_labels} {counts[-1]}")
+        return lines
+
+
+class TaskActivity:
+    """Task in coda e in esecuzione sull'executor dell'API, per profondità della coda e utilizzo dei worker."""
+
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        self.queued = 0
+        self.running = 0
+        self._lock = threading.Lock()
+
+    def submitted(self) -> None:
+        with self._lock:
+            self.queued += 1
+
+    def started(self) -> None:
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+
+    def finished(self) -> None:
+        with self._lock:
+            self.running -= 1
+
+    def track(self, fn: Callable[..., Any], *args: Any) -> Any:
+        self.started()
+        try:
+            return fn(*args)
+        finally:
+            self.finished()
+
+
+class MetricsRegistry:
+    """Metriche del processo API esposte su ``/api/metrics``.
+
+    Le misure per fase arrivano dal riepilogo restituito dai processor (chiave
+    ``stages``), quindi vengono raccolte anche quando l'elaborazione gira in un
+    processo del pool. Ogni processo uvicorn espone le proprie metriche.
+    """
+
+    PREFIX = "nfs_ft"
+
+    def __init__(self, activity: TaskActivity) -> None:
+        self.activity = activity
+        self._lock = threading.Lock()
+        labels = ("job", "stage", "sheet")
+        self.duration = Histogram(
+            f"{self.PREFIX}_stage_duration_seconds", "Tempo reale per fase di elaborazione.", labels, STAGE_SECONDS_BUCKETS
+        )
+        self.cpu = Histogram(
+            f"{self.PREFIX}_stage_cpu_seconds", "Tempo CPU del thread per fase di elaborazione.", labels, STAGE_SECONDS_BUCKETS
+        )
+        self.rss = Histogram(
+            f"{self.PREFIX}_stage_peak_rss_bytes", "Picco di RSS del processo durante la fase (campionato).", labels, RSS_BUCKETS
+        )
+        self.tasks: Dict[Tuple[str, str], int] = {}
+
+    def observe_job(self, job: str, status: str, stages: Sequence[Dict[str, Any]] = ()) -> None:
+        with self._lock:
+            self.tasks[(job, status)] = self.tasks.get((job, status), 0) + 1
+            for entry in stages:
+                sheet = MONTH_SUFFIX_PATTERN.sub("MM-AAAA", entry.get("sheet") or "")
+                labels = (job, entry["stage"], sheet)
+                self.duration.observe(labels, entry["wall_seconds"])
+                self.cpu.observe(labels, entry["cpu_seconds"])
+                if entry["peak_rss_bytes"]:
+                    self.rss.observe(labels, entry["peak_rss_bytes"])
+
+    def render(self) -> str:
+        activity = self.activity
+        utilization = activity.running / activity.workers if activity.workers else 0.0
+        lines: List[str] = []
+        for name, kind, help_text, value in (
+            ("tasks_queued", "gauge", "Task in attesa di un worker.", activity.queued),
+            ("tasks_running", "gauge", "Task in elaborazione.", activity.running),
+            ("workers", "gauge", "Worker disponibili per le elaborazioni.", activity.workers),
+            ("worker_utilization", "gauge", "Quota di worker occupati (0-1).", round(utilization, 4)),
+        ):
+            lines += [
+                f"# HELP {self.PREFIX}_{name} {help_text}",
+                f"# TYPE {self.PREFIX}_{name} {kind}",
+                f"{self.PREFIX}_{name} {_format_value(value)}",
+            ]
+        with self._lock:
+            lines += [
+                f"# HELP {self.PREFIX}_tasks_total Task conclusi per tipo di job ed esito.",
+                f"# TYPE {self.PREFIX}_tasks_total counter",
+            ]
+            for (job, status), count in sorted(self.tasks.items()):
+                lines.append(f"{self.PREFIX}_tasks_total{_format_labels(('job', 'status'), (job, status))} {count}")
+            for histogram in (self.duration, self.cpu, self.rss):
+                lines += histogram.render()
+        return "\n".join(lines) + "\n"
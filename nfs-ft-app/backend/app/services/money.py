@@ -0,0 +1,47 @@
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+
+CENTS_PER_UNIT = 100
+# Oltre questa soglia il valore in centesimi non sta in un int64.
+MAX_AMOUNT = 9e16
+CURRENCY_PATTERN = r"(?i)eur|[€$£\s]"
+
+
+def _parse_amount_text(values: pd.Series) -> pd.Series:
+    text = values.astype(str).str.strip()
+    negative = (text.str.startswith("(") & text.str.endswith(")")).fillna(False).astype(bool)
+    text = text.str.replace(CURRENCY_PATTERN, "", regex=True).str.strip("()")
+
+    # "1.234,56" e "12,5": la virgola (unica e dopo l'ultimo punto) è il separatore decimale.
+    italian = ((text.str.rfind(",") > text.str.rfind(".")) & text.str.count(",").eq(1)).fillna(False).astype(bool)
+    dotted_thousands = ~italian & text.str.count(r"\.").gt(1).fillna(False).astype(bool)
+    text = text.where(~(italian | dotted_thousands), text.str.replace(".", "", regex=False))
+    text = text.where(~italian, text.str.replace(",", ".", regex=False))
+    text = text.where(italian, text.str.replace(",", "", regex=False))
+
+    amounts = pd.to_numeric(text, errors="coerce")
+    return amounts.where(~negative, -amounts)
+
+
+def to_cents(values: pd.Series) -> pd.Series:
+    """Converte una colonna di importi in centesimi interi (int64).
+
+    Accetta numeri e testi in formato italiano o inglese (``1.234,56``, ``12,5``,
+    ``1,234.56``), con simbolo di valuta e negativi tra parentesi. I valori non
+    interpretabili valgono 0, come il precedente ``to_numeric(...).fillna(0)``.
+    """
+    if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        amounts = values.astype(float)
+    else:
+        amounts = _parse_amount_text(values)
+    amounts = amounts.where(np.isfinite(amounts) & (amounts.abs() < MAX_AMOUNT))
+    return (amounts * CENTS_PER_UNIT).round().fillna(0).astype("int64")
+
+
+def cents_to_amount(cents: Union[int, pd.Series]) -> Union[float, pd.Series]:
+    if isinstance(cents, pd.Series):
+        return cents / CENTS_PER_UNIT
+    return int(cents) / CENTS_PER_UNIT
@@ -0,0 +1,54 @@
+from typing import Dict, List, Optional, Sequence
+import re
+
+import pandas as pd
+
+
+# Valore di ``months`` che seleziona tutti i mesi presenti nei dati.
+ALL_MONTHS = "*"
+MONTH_PATTERN = re.compile(r"^(?:(\d{4})-(\d{1,2})|(\d{1,2})/(\d{4}))$")
+
+
+def parse_months(months: Sequence[str]) -> Optional[List[pd.Period]]:
+    """Mesi richiesti (``AAAA-MM`` o ``MM/AAAA``) ordinati; ``None`` se tutti i mesi."""
+    periods = set()
+    for value in months:
+        text = str(value).strip()
+        if text == ALL_MONTHS:
+            return None
+        match = MONTH_PATTERN.match(text)
+        if match is None:
+            raise ValueError(f"Mese non valido: {text} (formato atteso AAAA-MM)")
+        year = int(match.group(1) or match.group(4))
+        month = int(match.group(2) or match.group(3))
+        if not 1 <= month <= 12:
+            raise ValueError(f"Mese non valido: {text} (formato atteso AAAA-MM)")
+        periods.add(pd.Period(year=year, month=month, freq="M"))
+    if not periods:
+        raise ValueError("Nessun mese indicato")
+    return sorted(periods)
+
+
+def month_keys(dates: pd.Series) -> pd.Series:
+    """Chiave mensile di una colonna di date già convertite (NaT resta NaT)."""
+    return dates.dt.to_period("M")
+
+
+def select_months(keys: pd.Series, months: Optional[Sequence[pd.Period]]) -> List[pd.Period]:
+    if months is not None:
+        return list(months)
+    return sorted(keys.dropna().unique())
+
+
+def partition_by_month(df: pd.DataFrame, keys: pd.Series, months: Sequence[pd.Period]) -> Dict[pd.Period, pd.DataFrame]:
+    """Righe di ``df`` divise per mese con un solo raggruppamento; i mesi senza righe restano vuoti."""
+    groups = {month: df.iloc[positions] for month, positions in df.groupby(keys, sort=False).indices.items()}
+    return {month: groups.get(month, df.iloc[0:0]) for month in months}
+
+
+def month_label(month: pd.Period) -> str:
+    return month.strftime("%m/%Y")
+
+
+def month_sheet_suffix(month: pd.Period) -> str:
+    return month.strftime("%m-%Y")
@@ -0,0 +1,116 @@
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+StageWeights = Sequence[Tuple[str, float]]
+
+# Fasi in ordine e quota del tempo totale di ciascuna (misurata su export NFS da 30.000 righe:
+# la scrittura del file di output pesa più della lettura).
+DEFAULT_STAGE_WEIGHTS: StageWeights = (
+    ("lettura", 0.30),
+    ("validazione", 0.01),
+    ("deduplica", 0.02),
+    ("aggregazione", 0.02),
+    ("scrittura", 0.65),
+)
+# Intervallo minimo tra due notifiche di avanzamento dentro la stessa fase.
+PROGRESS_MIN_INTERVAL = 0.5
+# Ogni quante righe lette o scritte si aggiorna il contatore.
+ROWS_PROGRESS_STEP = 5000
+
+
+class ProgressReporter:
+    """Avanzamento di un'elaborazione per fasi, con percentuale e tempo residuo stimati.
+
+    ``stage`` apre una fase e notifica subito; ``advance`` conta le righe lette o
+    scritte nella fase corrente e notifica al più ogni ``min_interval`` secondi.
+    La percentuale somma il peso delle fasi concluse e la quota di righe della fase
+    in corso rispetto alle righe attese (stimate dalla dimensione del file); il
+    tempo residuo è proiettato dal tempo trascorso. Senza ``callback`` non fa nulla.
+    """
+
+    def __init__(
+        self,
+        callback: Optional[ProgressCallback] = None,
+        weights: StageWeights = DEFAULT_STAGE_WEIGHTS,
+        min_interval: float = PROGRESS_MIN_INTERVAL,
+    ) -> None:
+        self.callback = callback
+        self.min_interval = min_interval
+        self._offsets: Dict[str, Tuple[float, float]] = {}
+        done = 0.0
+        for name, weight in weights:
+            self._offsets[name] = (done, weight)
+            done += weight
+        self._total_weight = done
+        self._started = time.monotonic()
+        self._last_emit = 0.0
+        self._stage: Optional[str] = None
+        self._rows = 0
+        self._rows_total: Optional[int] = None
+        self._details: Dict[str, Any] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.callback is not None
+
+    def start(self) -> None:
+        self._started = time.monotonic()
+        self._stage = None
+
+    def stage(self, name: str, rows_total: Optional[int] = None, **details: Any) -> None:
+        if not self.enabled:
+            return
+        self._stage = name
+        self._rows = 0
+        self._rows_total = rows_total
+        self._details = details
+        self._emit()
+
+    def advance(self, rows: int, **details: Any) -> None:
+        if not self.enabled:
+            return
+        self._rows += rows
+        forced = bool(details) and any(self._details.get(key) != value for key, value in details.items())
+        self._details.update(details)
+        if forced or time.monotonic() - self._last_emit >= self.min_interval:
+            self._emit()
+
+    def finish(self) -> None:
+        if not self.enabled:
+            return
+        self._stage = "completato"
+        self._rows = 0
+        self._rows_total = None
+        self._details = {}
+        self._emit(percent=100.0)
+
+    def _fraction(self) -> float:
+        offset, weight = self._offsets.get(self._stage or "", (0.0, 0.0))
+        if self._rows_total:
+            offset += weight * min(self._rows / self._rows_total, 0.99)
+        return offset / self._total_weight if self._total_weight else 0.0
+
+    def _emit(self, percent: Optional[float] = None) -> None:
+        now = time.monotonic()
+        self._last_emit = now
+        elapsed = now - self._started
+        if percent is None:
+            percent = round(self._fraction() * 100, 1)
+        event: Dict[str, Any] = {"stage": self._stage, **self._details}
+        if self._rows or self._rows_total:
+            event["rows"] = self._rows
+        if self._rows_total:
+            event["rows_total"] = self._rows_total
+        event["percent"] = percent
+        event["elapsed_seconds"] = round(elapsed, 1)
+        event["eta_seconds"] = round(elapsed * (100 - percent) / percent, 1) if percent >= 1 else None
+        try:
+            self.callback(event)
+        except Exception as exc:
+            # L'avanzamento è informativo: un errore nel salvarlo non ferma l'elaborazione.
+            logger.warning("Aggiornamento avanzamento non riuscito: %s", str(exc))
@@ -0,0 +1,86 @@
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Tuple
+import asyncio
+import json
+import threading
+
+from starlette.concurrency import run_in_threadpool
+
+
+Waiter = Tuple[asyncio.AbstractEventLoop, asyncio.Event]
+
+
+def format_sse(data: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(data, default=str)}\n\n"
+
+
+class TaskEvents:
+    """Notifiche dei cambi di stato dei task verso gli stream SSE dello stesso processo.
+
+    ``notify`` viene chiamato dai thread di elaborazione dopo ogni aggiornamento
+    del ``TaskStore`` e sveglia gli stream in ascolto su quel task nel loro event loop.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, List[Waiter]] = {}
+
+    @contextmanager
+    def subscribe(self, task_id: str) -> Iterator[asyncio.Event]:
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(task_id, []).append(waiter)
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(task_id, [])
+                if waiter in waiters:
+                    waiters.remove(waiter)
+                if not waiters:
+                    self._waiters.pop(task_id, None)
+
+    def notify(self, task_id: str) -> None:
+        with self._lock:
+            waiters = list(self._waiters.get(task_id, ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Event loop già chiuso: lo stream è terminato.
+                pass
+
+
+async def task_event_stream(
+    store: Any,
+    events: TaskEvents,
+    task_id: str,
+    is_disconnected: Callable[[], Awaitable[bool]],
+    poll_seconds: float,
+) -> AsyncIterator[str]:
+    """Stream SSE dello stato di un task: un evento per ogni cambiamento, fino a done/error.
+
+    Gli aggiornamenti fatti in questo processo arrivano subito tramite ``events``;
+    ogni ``poll_seconds`` si rilegge comunque lo stato, così lo stream segue anche
+    i task eseguiti da un altro worker e tiene viva la connessione.
+    """
+    last = None
+    with events.subscribe(task_id) as changed:
+        while True:
+            # Si azzera prima di leggere: una notifica arrivata durante la lettura non va persa.
+            changed.clear()
+            task = await run_in_threadpool(store.get, task_id)
+            if task is None:
+                yield format_sse({"status": "error", "error": "Task non trovato"})
+                return
+            if task != last:
+                yield format_sse(task)
+                last = task
+            if task["status"] in ("done", "error"):
+                return
+            if await is_disconnected():
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=poll_seconds)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
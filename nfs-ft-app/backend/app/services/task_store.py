@@ -0,0 +1,153 @@
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+
+TASK_FIELDS = ("status", "started_at", "finished_at", "summary", "progress", "output_path", "download_url", "error")
+JSON_FIELDS = ("summary", "progress")
+TIMESTAMP_FIELDS = ("created_at", "started_at", "finished_at")
+ACTIVE_STATUSES = ("queued", "processing")
+INTERRUPTED_ERROR = "Elaborazione interrotta. Ricarica il file e riprova."
+
+# Distingue questo processo da uno precedente con lo stesso PID (es. dopo il riavvio di un container).
+_PROCESS_TOKEN = uuid.uuid4().hex
+
+
+def _current_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{_PROCESS_TOKEN}"
+
+
+def _owner_is_gone(owner: Optional[str]) -> bool:
+    if not owner:
+        return False
+    host, pid, token = (owner.split(":") + ["", "", ""])[:3]
+    if host != socket.gethostname():
+        return False
+    if pid == str(os.getpid()):
+        return token != _PROCESS_TOKEN
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError):
+        return False
+    return False
+
+
+class TaskStore:
+    """Registro persistente dei task su SQLite (modalità WAL).
+
+    Lo stato è condiviso tra i worker uvicorn e sopravvive ai riavvii; la lettura
+    di un task è una ricerca per chiave primaria. Ogni task registra il processo
+    che lo esegue: se quel processo non esiste più (es. riavvio) il task ancora
+    in corso viene chiuso con errore alla lettura successiva. ``on_change`` riceve
+    l'id del task dopo ogni aggiornamento (es. per gli stream SSE).
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        retention_hours: int,
+        on_change: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.db_path = Path(db_path)
+        self.on_change = on_change
+        self.retention_seconds = retention_hours * 3600
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    owner TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    summary TEXT,
+                    progress TEXT,
+                    output_path TEXT,
+                    download_url TEXT,
+                    error TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at)")
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(tasks)")}
+            if "progress" not in columns:
+                conn.execute("ALTER TABLE tasks ADD COLUMN progress TEXT")
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Nei processi del pool si scrive solo sul database: le notifiche restano al processo che ha creato lo store.
+        state = self.__dict__.copy()
+        state["on_change"] = None
+        return state
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def create(self, task_id: str, output_path: Optional[Path] = None) -> None:
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM tasks WHERE created_at < ?", (now - self.retention_seconds,))
+            conn.execute(
+                "INSERT INTO tasks (task_id, status, owner, created_at, output_path) VALUES (?, 'queued', ?, ?, ?)",
+                (task_id, _current_owner(), now, str(output_path) if output_path else None),
+            )
+
+    def update(self, task_id: str, **fields: Any) -> None:
+        unknown = set(fields) - set(TASK_FIELDS)
+        if unknown:
+            raise ValueError(f"Campi task non validi: {', '.join(sorted(unknown))}")
+        for name in JSON_FIELDS:
+            if name in fields and fields[name] is not None:
+                fields[name] = json.dumps(fields[name], default=str)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"UPDATE tasks SET {assignments} WHERE task_id = ?", (*fields.values(), task_id))
+        if self.on_change is not None:
+            self.on_change(task_id)
+
+    def mark_processing(self, task_id: str) -> None:
+        self.update(task_id, status="processing", started_at=time.time())
+
+    def set_progress(self, task_id: str, progress: Dict[str, Any]) -> None:
+        self.update(task_id, progress=progress)
+
+    def mark_done(self, task_id: str, summary: Dict[str, Any], download_url: str) -> None:
+        self.update(task_id, status="done", finished_at=time.time(), summary=summary, download_url=download_url)
+
+    def mark_error(self, task_id: str, error: str) -> None:
+        self.update(task_id, status="error", finished_at=time.time(), error=error)
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        if row["status"] in ACTIVE_STATUSES and _owner_is_gone(row["owner"]):
+            self.mark_error(task_id, INTERRUPTED_ERROR)
+            return self.get(task_id)
+
+        task: Dict[str, Any] = {"status": row["status"], "file_id": row["task_id"]}
+        for name in TIMESTAMP_FIELDS:
+            if row[name] is not None:
+                task[name] = datetime.fromtimestamp(row[name]).isoformat(timespec="seconds")
+        for name in JSON_FIELDS:
+            if row[name] is not None:
+                task[name] = json.loads(row[name])
+        for name in ("download_url", "error"):
+            if row[name] is not None:
+                task[name] = row[name]
+        return task
@@ -0,0 +1,114 @@
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Coroutine, TypeVar
+import hashlib
+
+from fastapi import HTTPException, Request, Response, UploadFile
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from starlette.types import Message
+
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Margine per intestazioni e separatori multipart oltre alla dimensione dei file.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# I file .xlsx (e gli archivi .zip del batch) iniziano con l'intestazione di un file ZIP.
+ZIP_SIGNATURE = b"PK\x03\x04"
+
+
+class StoredUpload:
+    __slots__ = ("path", "size", "sha256")
+
+    def __init__(self, path: Path, size: int, sha256: str) -> None:
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+
+def _write_chunk(handle: BinaryIO, digest: Any, chunk: bytes) -> None:
+    digest.update(chunk)
+    handle.write(chunk)
+
+
+async def save_upload(upload: UploadFile, destination: Path, max_bytes: int) -> StoredUpload:
+    """Salva un file caricato a blocchi senza bloccare l'event loop.
+
+    Scrittura e hash SHA-256 girano nel threadpool nella stessa passata; la copia
+    si interrompe appena si supera ``max_bytes`` o se il primo blocco non è un file
+    ZIP/xlsx. In caso di errore il file parziale viene rimosso e si solleva
+    ``ValueError`` con il messaggio da mostrare all'utente.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    handle = await run_in_threadpool(destination.open, "wb")
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if size == 0 and not chunk.startswith(ZIP_SIGNATURE):
+                raise ValueError(f"Il file {upload.filename} non è un file Excel (.xlsx) valido")
+            size += len(chunk)
+            if size > max_bytes:
+                raise ValueError(f"File troppo grande. Dimensione massima: {max_bytes / 1024 / 1024:.0f}MB")
+            await run_in_threadpool(_write_chunk, handle, digest, chunk)
+        if size == 0:
+            raise ValueError(f"Il file {upload.filename} è vuoto")
+    except BaseException:
+        await run_in_threadpool(handle.close)
+        destination.unlink(missing_ok=True)
+        raise
+    await run_in_threadpool(handle.close)
+    return StoredUpload(destination, size, digest.hexdigest())
+
+
+Endpoint = TypeVar("Endpoint", bound=Callable[..., Any])
+
+
+def limit_upload_size(max_bytes: int) -> Callable[[Endpoint], Endpoint]:
+    """Dimensione massima del corpo della richiesta per un endpoint di upload (vedi ``UploadLimitRoute``)."""
+
+    def decorator(endpoint: Endpoint) -> Endpoint:
+        endpoint.max_upload_bytes = max_bytes + MULTIPART_OVERHEAD_BYTES
+        return endpoint
+
+    return decorator
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File troppo grande. Dimensione massima: {max_bytes / 1024 / 1024:.0f}MB")
+
+
+class UploadLimitRoute(APIRoute):
+    """Route che applica il limite di ``limit_upload_size`` prima che il corpo venga letto.
+
+    FastAPI legge tutto il corpo multipart (su disco) prima di chiamare l'endpoint,
+    quindi il controllo in ``save_upload`` arriva a upload concluso. Qui la richiesta
+    viene rifiutata con 413 se il ``Content-Length`` dichiarato supera il limite, e
+    la ricezione si interrompe appena i byte ricevuti lo superano (es. upload chunked).
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+        max_bytes = getattr(self.endpoint, "max_upload_bytes", None)
+        if max_bytes is None:
+            return handler
+
+        async def limited_handler(request: Request) -> Response:
+            declared = request.headers.get("content-length", "")
+            if declared.isdigit() and int(declared) > max_bytes:
+                raise _too_large(max_bytes)
+            received = 0
+            receive = request.receive
+
+            async def limited_receive() -> Message:
+                nonlocal received
+                message = await receive()
+                if message["type"] == "http.request":
+                    received += len(message.get("body", b""))
+                    if received > max_bytes:
+                        raise _too_large(max_bytes)
+                return message
+
+            return await handler(Request(request.scope, limited_receive))
+
+        return limited_handler
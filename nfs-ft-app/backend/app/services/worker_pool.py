@@ -0,0 +1,78 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+import logging
+import multiprocessing
+import multiprocessing.util
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+PROCESSING_BACKENDS = ("thread", "process")
+
+_shared_pools: Dict[str, ProcessPoolExecutor] = {}
+_shared_pools_lock = threading.Lock()
+
+
+def _init_worker_process() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+
+class WorkerPool:
+    """Esegue le elaborazioni nel thread chiamante oppure in un pool di processi.
+
+    Con ``backend="process"`` le chiamate a pandas/openpyxl girano in processi
+    separati (quindi non sono limitate dal GIL) e ogni processo viene riavviato
+    dopo ``max_tasks_per_child`` elaborazioni per liberare la memoria accumulata.
+    Il chiamante riceve il valore di ritorno (es. il dizionario di riepilogo) o
+    l'eccezione sollevata nel processo figlio.
+    """
+
+    def __init__(self, backend: str, max_workers: int, max_tasks_per_child: int = 0) -> None:
+        if backend not in PROCESSING_BACKENDS:
+            raise ValueError(f"Backend di elaborazione non valido: {backend}")
+        self.backend = backend
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if backend == "process":
+            self._pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker_process,
+                max_tasks_per_child=max_tasks_per_child if max_tasks_per_child > 0 else None,
+            )
+            logger.info("Pool di processi avviato: %s worker", max_workers)
+
+    def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._pool is None:
+            return fn(*args)
+        return self._pool.submit(fn, *args).result()
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shared_process_pool(name: str, max_workers: int) -> ProcessPoolExecutor:
+    """Pool di processi riusato tra le elaborazioni dello stesso processo (creato al primo uso).
+
+    Evita di pagare l'avvio dei processi (e l'import di pandas) a ogni richiesta;
+    un pool non più utilizzabile (es. un figlio terminato) viene ricreato.
+    """
+    with _shared_pools_lock:
+        pool = _shared_pools.get(name)
+        if pool is None or getattr(pool, "_broken", False):
+            pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker_process,
+            )
+            _shared_pools[name] = pool
+            # In un processo del WorkerPool i figli vengono attesi all'uscita prima che concurrent.futures
+            # chiuda i propri pool: il pool va chiuso prima, e prima che si chiudano le sue code
+            # (finalizer con priorità 10), altrimenti il processo non termina.
+            multiprocessing.util.Finalize(pool, pool.shutdown, exitpriority=100)
+            logger.info("Pool di processi %s avviato: %s worker", name, max_workers)
+        return pool
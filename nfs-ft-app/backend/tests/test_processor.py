@@ -1,10 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+import tracemalloc
+import zipfile
 
+from fastapi import APIRouter, FastAPI, File, UploadFile
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font, PatternFill
 import pytest
 
+from app.services.batch import batch_summary, expand_batch_inputs, run_batch, write_batch_report
+from app.services.date_parser import DateParser
+from app.services.excel_reader import read_excel_streaming, read_header_rows
+from app.services import file_processor as file_processor_module
 from app.services.file_processor import NFSFTFileProcessor, PisaFTFileProcessor, PisaRicevuteFTFileProcessor, CompareFTFileProcessor
+from app.services.frame_memory import compact_frame, frame_bytes
+from app.services.header_resolver import HeaderResolver
+from app.services import input_cache as input_cache_module
+from app.services.input_cache import ParsedInputCache, file_sha256, load_cached
+from app.services.metrics import MetricsRegistry, StageTimer, TaskActivity
+from app.services.money import cents_to_amount, to_cents
+from app.services.task_events import TaskEvents, task_event_stream
+from app.services.task_store import TaskStore
+from app.services.uploads import UploadLimitRoute, limit_upload_size, save_upload
+from app.services.worker_pool import WorkerPool
 
 
 @pytest.fixture
@@ -108,6 +135,50 @@ def test_process_file_pisa_splits_by_sdi(tmp_path: Path):
     assert elettroniche_ws["A2"].value == 0
 
 
+def test_process_file_pisa_emits_month_sheets(tmp_path: Path, monkeypatch):
+    columns = ["Identificativo SDI", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K", "L", "M", "N", "O"]
+    df = pd.DataFrame(
+        [
+            ["", "b1", "c1", "d1", "e1", "2025-01-10", "g1", "Ragione A", "i1", 120.0, "k1", 100.0, "m1", "n1", "o1"],
+            ["123", "b2", "c2", "d2", "e2", "2025-02-03", "g2", "Ragione B", "i2", 220.0, "k2", 200.0, "m2", "n2", "o2"],
+            ["", "b3", "c3", "d3", "e3", "2025-02-20", "g3", "Ragione C", "i3", 320.0, "k3", 300.0, "m3", "n3", "o3"],
+            ["", "b4", "c4", "d4", "e4", "2025-03-01", "g4", "Ragione D", "i4", 420.0, "k4", 400.0, "m4", "n4", "o4"],
+        ],
+        columns=columns,
+    )
+    input_path = tmp_path / "input_pisa.xlsx"
+    output_path = tmp_path / "output_pisa.xlsx"
+    df.to_excel(input_path, index=False)
+
+    calls = []
+    original = PisaFTFileProcessor._sdi_empty_mask
+
+    def counting_mask(self, series):
+        calls.append(len(series))
+        return original(self, series)
+
+    monkeypatch.setattr(PisaFTFileProcessor, "_sdi_empty_mask", counting_mask)
+    stats = PisaFTFileProcessor(months=["2025-01", "02/2025"]).process_file(input_path, output_path)
+
+    # I fogli mensili riusano la classificazione dell'intero periodo.
+    assert calls == [3]
+    assert stats["total_records"] == 3
+    assert stats["months"] == {
+        "01/2025": {"total_records": 1, "fase2_records": 1, "fase3_records": 0},
+        "02/2025": {"total_records": 2, "fase2_records": 1, "fase3_records": 1},
+    }
+    wb = load_workbook(output_path, data_only=True)
+    assert wb.sheetnames[3:] == ["Riepilogo 01-2025", "Dati 01-2025", "Riepilogo 02-2025", "Dati 02-2025"]
+    assert [row for row in wb["Riepilogo 02-2025"].iter_rows(min_row=2, values_only=True)] == [
+        ("Cartacee", 1, 300.0),
+        ("Elettroniche", 1, 200.0),
+        ("TOTALE", 2, 500.0),
+    ]
+
+    with pytest.raises(ValueError, match="Mese non valido"):
+        PisaFTFileProcessor(months=["2025-13"])
+
+
 def test_process_file_pisa_ricevute_splits_by_sdi(tmp_path: Path):
     df = pd.DataFrame(
         [
@@ -274,3 +345,827 @@ def test_compare_files_all_period(tmp_path: Path):
     diff_ws = wb["Differenze tra file"]
     assert diff_ws.max_row >= 2
     assert any(isinstance(cell.value, str) and cell.value.startswith("CART:") for cell in diff_ws["A"])
+
+
+def test_read_excel_flexible_finds_header_after_title_rows(sample_dataframe, tmp_path: Path):
+    input_path = tmp_path / "input_title.xlsx"
+    with pd.ExcelWriter(input_path) as writer:
+        pd.DataFrame([["Estrazione fatture NFS"]]).to_excel(writer, index=False, header=False)
+        sample_dataframe.to_excel(writer, index=False, startrow=3)
+
+    df = NFSFTFileProcessor()._read_excel_flexible(input_path)
+
+    assert list(df.columns) == list(sample_dataframe.columns)
+    assert len(df) == len(sample_dataframe)
+    assert df["FAT_NDOC"].tolist() == ["F001", "F002", "F001"]
+
+
+def test_read_excel_streaming_matches_read_excel(sample_dataframe, tmp_path: Path):
+    input_path = tmp_path / "input.xlsx"
+    sample_dataframe.to_excel(input_path, index=False)
+
+    pd.testing.assert_frame_equal(read_excel_streaming(input_path), pd.read_excel(input_path))
+
+
+def test_nfs_ingestion_materialises_only_needed_columns(sample_dataframe, tmp_path: Path):
+    input_path = tmp_path / "input_wide.xlsx"
+    wide = sample_dataframe.copy()
+    for idx in range(20):
+        wide[f"EXTRA_{idx}"] = idx
+    wide.to_excel(input_path, index=False)
+
+    df = NFSFTFileProcessor()._read_excel_flexible(input_path, project_columns=True)
+    assert set(df.columns) == set(sample_dataframe.columns)
+
+    df_compare = CompareFTFileProcessor()._load_nfs_compare_df(input_path)
+    assert list(df_compare.columns) == CompareFTFileProcessor.NFS_REQUIRED_COLUMNS
+    assert len(df_compare) == len(sample_dataframe)
+
+
+def test_parsed_input_cache_shared_between_processors(sample_dataframe, tmp_path: Path, monkeypatch):
+    cache = ParsedInputCache(tmp_path / "cache", max_bytes=10 * 1024 * 1024, max_age_hours=24)
+    input_path = tmp_path / "input.xlsx"
+    sample_dataframe.assign(FAT_NDOC=["F001", 2, "F001"]).to_excel(input_path, index=False)
+
+    NFSFTFileProcessor(input_cache=cache).process_file(input_path, tmp_path / "output.xlsx")
+    assert len(list((tmp_path / "cache").glob("*.parquet"))) == 1
+
+    def fail_read(*args, **kwargs):
+        raise AssertionError("il file non deve essere riletto")
+
+    monkeypatch.setattr(NFSFTFileProcessor, "_read_excel_flexible", fail_read)
+    df = CompareFTFileProcessor(input_cache=cache)._load_nfs_compare_df(input_path)
+    assert df["FAT_NDOC"].tolist() == ["F001", 2, "F001"]
+
+
+def test_parsed_input_cache_evicts_least_recently_used(tmp_path: Path):
+    cache = ParsedInputCache(tmp_path / "cache", max_bytes=0, max_age_hours=24)
+    input_path = tmp_path / "input.xlsx"
+    input_path.write_bytes(b"contenuto")
+
+    cache.put(input_path, "nfs", pd.DataFrame({"A": [1, 2]}))
+
+    assert cache.get(input_path, "nfs") is None
+
+
+def test_parsed_input_cache_ignores_entries_of_older_schema(tmp_path: Path, monkeypatch):
+    cache = ParsedInputCache(tmp_path / "cache", max_bytes=10 * 1024 * 1024, max_age_hours=24)
+    input_path = tmp_path / "input.xlsx"
+    input_path.write_bytes(b"contenuto")
+    cache.put(input_path, "nfs", pd.DataFrame({"A": [1, 2]}))
+
+    monkeypatch.setattr(input_cache_module, "CACHE_SCHEMA_VERSION", input_cache_module.CACHE_SCHEMA_VERSION + 1)
+
+    assert cache.get(input_path, "nfs") is None
+    assert load_cached(cache, input_path, "nfs", lambda: pd.DataFrame({"A": [3]}))["A"].tolist() == [3]
+    assert load_cached(None, input_path, "nfs", lambda: pd.DataFrame({"A": [4]}))["A"].tolist() == [4]
+
+
+def test_worker_pool_runs_processor_in_child_process(sample_dataframe, tmp_path: Path):
+    input_path = tmp_path / "input.xlsx"
+    output_path = tmp_path / "output.xlsx"
+    sample_dataframe.to_excel(input_path, index=False)
+
+    pool = WorkerPool("process", max_workers=1, max_tasks_per_child=1)
+    try:
+        stats = pool.run(NFSFTFileProcessor().process_file, input_path, output_path)
+        with pytest.raises(ValueError, match="Colonne mancanti"):
+            pool.run(NFSFTFileProcessor().validate_file, pd.DataFrame({"WRONG_COL": [1]}))
+    finally:
+        pool.shutdown()
+
+    assert output_path.exists()
+    assert stats["total_records"] == 2
+
+
+def test_task_store_persists_task_state(tmp_path: Path):
+    db_path = tmp_path / "tasks.db"
+    store = TaskStore(db_path, retention_hours=24)
+    store.create("task-1", tmp_path / "task-1_output.xlsx")
+    store.mark_processing("task-1")
+    store.mark_done("task-1", {"total_records": 2}, "/api/download/task-1")
+
+    task = TaskStore(db_path, retention_hours=24).get("task-1")
+
+    assert task["status"] == "done"
+    assert task["summary"] == {"total_records": 2}
+    assert task["download_url"] == "/api/download/task-1"
+    assert "started_at" in task and "finished_at" in task
+    assert store.get("missing") is None
+
+
+def test_task_store_fails_tasks_of_restarted_process(tmp_path: Path):
+    store = TaskStore(tmp_path / "tasks.db", retention_hours=24)
+    store.create("task-1")
+    store.mark_processing("task-1")
+    with sqlite3.connect(tmp_path / "tasks.db") as conn:
+        conn.execute("UPDATE tasks SET owner = owner || '-old'")
+
+    task = store.get("task-1")
+
+    assert task["status"] == "error"
+    assert "interrotta" in task["error"]
+
+
+def test_dati_sheet_formats_and_totals(sample_dataframe, tmp_path: Path):
+    input_path = tmp_path / "input.xlsx"
+    output_path = tmp_path / "output.xlsx"
+    sample_dataframe.to_excel(input_path, index=False)
+
+    NFSFTFileProcessor().process_file(input_path, output_path)
+
+    ws = load_workbook(output_path)["Dati"]
+    header = [cell.value for cell in ws[1]]
+    assert ws.cell(row=2, column=header.index("Data Fatture") + 1).number_format == "mm/dd/yyyy"
+    assert ws.cell(row=2, column=header.index("Imposta") + 1).number_format == "#,##0.00"
+    assert ws.cell(row=ws.max_row, column=1).value == "TOTALE"
+    assert ws.cell(row=ws.max_row, column=header.index("Imposta") + 1).value == 66.0
+
+
+def test_dati_sheet_rolls_over_to_new_pages(tmp_path: Path):
+    processor = PisaRicevuteFTFileProcessor()
+    df = pd.DataFrame({"Ragione sociale": [f"R{i}" for i in range(5)], "Imponibile": [1.0] * 5})
+    output_path = tmp_path / "paged.xlsx"
+
+    wb = Workbook(write_only=True)
+    processor._add_dataframe_sheet(
+        wb,
+        "Dati",
+        df,
+        PatternFill(),
+        Font(),
+        PatternFill(),
+        Font(),
+        money_columns=["Imponibile"],
+        max_rows_per_sheet=3,
+    )
+    wb.save(output_path)
+
+    wb = load_workbook(output_path)
+    assert wb.sheetnames == ["Dati", "Dati (2)", "Dati (3)"]
+    assert [row[0] for row in wb["Dati"].iter_rows(values_only=True)] == ["Ragione sociale", "R0", "R1"]
+    assert [row[0] for row in wb["Dati (3)"].iter_rows(values_only=True)] == ["Ragione sociale", "R4", "TOTALE"]
+    assert wb["Dati (3)"]["B3"].value == 5.0
+
+
+def test_summary_sheets_aggregate_by_protocol(sample_dataframe, tmp_path: Path):
+    input_path = tmp_path / "input.xlsx"
+    output_path = tmp_path / "output.xlsx"
+    sample_dataframe.to_excel(input_path, index=False)
+
+    NFSFTFileProcessor().process_file(input_path, output_path)
+
+    wb = load_workbook(output_path)
+    elettroniche = {row[0]: row[2:] for row in wb["Fatture Elettroniche"].iter_rows(min_row=2, values_only=True)}
+    cartacee = {row[0]: row[2:] for row in wb["Fatture Cartacee"].iter_rows(min_row=2, values_only=True)}
+    assert elettroniche["EP"] == (1, 100.0)
+    assert elettroniche["P"] == (1, 200.0)
+    assert elettroniche["2EP"] == (0, 0.0)
+    assert cartacee["EP"] == (0, 0.0)
+    assert len(elettroniche) == len(NFSFTFileProcessor().all_protocols) + 1
+
+
+def test_sdi_classification_computed_once(sample_dataframe, tmp_path: Path, monkeypatch):
+    input_path = tmp_path / "input.xlsx"
+    sample_dataframe.to_excel(input_path, index=False)
+    calls = []
+    original = NFSFTFileProcessor._sdi_empty_mask
+
+    def counting_mask(self, series):
+        calls.append(len(series))
+        return original(self, series)
+
+    monkeypatch.setattr(NFSFTFileProcessor, "_sdi_empty_mask", counting_mask)
+    NFSFTFileProcessor().process_file(input_path, tmp_path / "output.xlsx")
+
+    assert calls == [2]
+    headers = next(load_workbook(tmp_path / "output.xlsx")["Dati"].iter_rows(max_row=1, values_only=True))
+    assert "_CARTACEA" not in headers
+
+
+def _normalize_sdi_per_value(series: pd.Series) -> pd.Series:
+    def normalize_value(value):
+        if pd.isna(value):
+            return ""
+        if isinstance(value, int):
+            return str(value)
+        if isinstance(value, float):
+            return str(int(value)) if value.is_integer() else str(value).strip()
+        text = str(value).strip()
+        match = re.fullmatch(r"(\d+)\.0+", text)
+        return match.group(1) if match else text
+
+    return series.map(normalize_value)
+
+
+def test_normalize_sdi_matches_per_value_version():
+    processor = CompareFTFileProcessor()
+    mixed = pd.Series([12, 12.0, 12.5, " 0034.000 ", "٣.0", None, float("nan"), True, "12.0a", 1e20], dtype=object)
+    for series in (mixed, mixed.astype(str), pd.Series([1.0, 2.5, None]), pd.Series([7, 8])):
+        assert processor._normalize_sdi(series).tolist() == _normalize_sdi_per_value(series).tolist()
+
+    # Blocchi omogenei (solo testo, solo float) e misti nella stessa colonna.
+    processor.SDI_TYPE_CHUNK_ROWS = 4
+    chunked = pd.Series([" 12.0", "13", None, "x"] + [1.0, 2.5, float("nan"), 3e5] + [7, "8.00", 9.0, True], dtype=object)
+    assert processor._normalize_sdi(chunked).tolist() == _normalize_sdi_per_value(chunked).tolist()
+
+
+
+@pytest.mark.benchmark
+def test_normalize_sdi_benchmark_1m_identifiers():
+    processor = CompareFTFileProcessor()
+    ids = np.random.default_rng(0).integers(10**9, 10**11, 1_000_000)
+    series = pd.Series(
+        [int(value) if value % 3 == 0 else float(value) if value % 3 == 1 else f" {value}.0" for value in ids],
+        dtype=object,
+    )
+
+    start = time.perf_counter()
+    expected = _normalize_sdi_per_value(series)
+    per_value_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    result = processor._normalize_sdi(series)
+    vectorized_seconds = time.perf_counter() - start
+
+    print(
+        f"\n_normalize_sdi su 1M identificativi misti int/float/str: per valore {per_value_seconds:.2f}s, "
+        f"vettoriale {vectorized_seconds:.2f}s ({per_value_seconds / vectorized_seconds:.1f}x)"
+    )
+    assert result.equals(expected)
+
+
+def test_classify_outcome_ignores_one_cent_differences():
+    to_show = pd.DataFrame(
+        {
+            "NFS Numero": [1, 1, 1, 1, 0],
+            "Pisa Numero": [1, 1, 1, 2, 1],
+            "Delta Importo": [1, -1, 2, 0, -500],
+            "Delta Numero": [0, 0, 0, -1, -1],
+        }
+    )
+    outcome = CompareFTFileProcessor()._classify_outcome(to_show)
+    assert outcome.tolist() == ["", "", "Importo diverso", "Numero diverso", "Solo Pisa"]
+
+
+def test_differences_sheet_aggregates_sides_per_sdi_key():
+    df_nfs = pd.DataFrame(
+        {
+            "_SDI_KEY": ["100", "100", "200"],
+            "_CARTACEA": [False, False, False],
+            "Imponibile": [10.0, 15.0, 7.0],
+            "_CENTESIMI": [1000, 1500, 700],
+            "Ragione sociale": [" Alfa ", "Beta", "Gamma"],
+            "N.fatture": ["F1", "F1 ", None],
+            "Datat reg.": pd.to_datetime(["2025-01-10", None, "2025-01-12"]),
+        }
+    )
+    df_pisa = pd.DataFrame(
+        {
+            "_SDI_KEY": ["100"],
+            "_CARTACEA": [False],
+            "Importo fattura": [20.0],
+            "_CENTESIMI": [2000],
+            "Creditore": ["Alfa"],
+            "Numero fattura": ["F1"],
+            "Data emissione": pd.to_datetime(["2025-01-09"]),
+        }
+    )
+    wb = Workbook()
+    CompareFTFileProcessor()._create_fatture_da_verificare_sheet(wb, df_nfs, df_pisa, PatternFill(), Font())
+
+    rows = {row[0]: row for row in wb["Differenze tra file"].iter_rows(min_row=2, values_only=True)}
+    assert rows["100"][1:6] == ("Importo diverso", "MULTIPLE", "F1", "2025-01-10", 25.0)
+    assert rows["100"][10:] == (1, 5.0)
+    assert rows["200"][1:5] == ("Solo NFS", "Gamma", "", "2025-01-12")
+
+
+def test_classify_outcome_and_row_formats():
+    to_show = pd.DataFrame(
+        {
+            "NFS Numero": [1, 0, 2, 1, 1],
+            "Pisa Numero": [0, 1, 2, 2, 1],
+            "Delta Numero": [1, -1, 0, -1, 0],
+            "Delta Importo": [500, -500, 50, 0, 1],
+        }
+    )
+    outcomes = CompareFTFileProcessor()._classify_outcome(to_show)
+    assert outcomes.tolist() == ["Solo NFS", "Solo Pisa", "Importo diverso", "Numero diverso", ""]
+
+    df_nfs = pd.DataFrame(
+        {
+            "_SDI_KEY": ["300"],
+            "_CARTACEA": [False],
+            "Imponibile": [12.5],
+            "_CENTESIMI": [1250],
+            "Ragione sociale": ["Alfa"],
+            "N.fatture": ["F9"],
+            "Datat reg.": pd.to_datetime(["2025-03-01"]),
+        }
+    )
+    df_pisa = df_nfs.iloc[:0].rename(
+        columns={"Imponibile": "Importo fattura", "Ragione sociale": "Creditore", "N.fatture": "Numero fattura", "Datat reg.": "Data emissione"}
+    )
+    wb = Workbook()
+    CompareFTFileProcessor()._create_fatture_da_verificare_sheet(wb, df_nfs, df_pisa, PatternFill(), Font())
+    ws = wb["Differenze tra file"]
+    assert [cell.value for cell in ws[2]][:2] == ["300", "Solo NFS"]
+    assert ws["E2"].number_format == "dd/mm/yyyy"
+    assert ws["F2"].number_format == "#,##0.00"
+    assert ws["L2"].value == 12.5
+
+
+def test_date_parser_parses_each_distinct_value_once():
+    parser = DateParser()
+    emissione = pd.Series(["05/01/2025", "13/01/2025", None, "05/01/2025", ""] * 100, dtype=object)
+    documento = pd.Series(["13/01/2025", "05/01/2025", "31/12/2024"], dtype=object)
+
+    for series in (emissione, documento):
+        expected = pd.to_datetime(series, errors="coerce", dayfirst=True)
+        assert parser.to_datetime(series, dayfirst=True).equals(expected)
+    assert [len(memo) for memo in parser._parsed.values()] == [4]
+
+    mixed = pd.Series(["2025-01-05", "05/01/2025", "x", None])
+    parsed = parser.to_datetime_iso_or_dayfirst(mixed)
+    assert parsed.tolist()[:2] == [pd.Timestamp("2025-01-05"), pd.Timestamp("2025-01-05")]
+    assert parsed.isna().tolist() == [False, False, True, True]
+
+
+def test_to_cents_parses_italian_amounts():
+    values = pd.Series(["1.234,56", "12,5", "1,234.56", "€ 1.234,56", "(12,30)", "-5", "1.234.567", "abc", None, 0.29, 7])
+    assert to_cents(values).tolist() == [123456, 1250, 123456, 123456, -1230, -500, 123456700, 0, 0, 29, 700]
+    assert to_cents(pd.Series([0.1] * 10)).sum() == 100
+    assert cents_to_amount(to_cents(pd.Series(["0,1"] * 3)).sum()) == 0.3
+
+
+def test_compact_frames_mode_matches_default_output(sample_dataframe, tmp_path: Path):
+    input_path = tmp_path / "input.xlsx"
+    sample_dataframe.to_excel(input_path, index=False)
+
+    compact = compact_frame(pd.DataFrame({"FAT_PROT": ["P", "P", "EP", "P"], "C_NOME": list("ABCD"), "FAT_NUM": [1, 2, 3, 4]}))
+    assert isinstance(compact["FAT_PROT"].dtype, pd.CategoricalDtype)
+    assert compact["C_NOME"].dtype == "str"
+    assert compact["FAT_NUM"].dtype == "int8"
+
+    default_stats = NFSFTFileProcessor().process_file(input_path, tmp_path / "default.xlsx")
+    processor = NFSFTFileProcessor(compact_frames=True, memory_report=True)
+    compact_stats = processor.process_file(input_path, tmp_path / "compact.xlsx")
+
+    # Le misure per fase cambiano a ogni esecuzione.
+    assert [entry["stage"] for entry in compact_stats.pop("stages")] == [entry["stage"] for entry in default_stats.pop("stages")]
+    memory = compact_stats.pop("memory")
+    assert "memory" not in default_stats
+    assert compact_stats == default_stats
+    default_wb = load_workbook(tmp_path / "default.xlsx")
+    compact_wb = load_workbook(tmp_path / "compact.xlsx")
+    for ws in default_wb.worksheets:
+        assert list(ws.values) == list(compact_wb[ws.title].values)
+    assert [stage["stage"] for stage in memory] == ["lettura", "elaborazione", "output"]
+    assert all(stage["frame_bytes"] >= 0 and stage["peak_rss_bytes"] > 0 for stage in memory)
+
+
+def test_output_frames_peak_memory_stays_within_twice_input():
+    n = 20_000
+    protocols = NFSFTFileProcessor.PROTOCOLLI_FASE2 + NFSFTFileProcessor.PROTOCOLLI_FASE3
+    dates = pd.Series(list(pd.date_range("2025-01-01", periods=n, freq="min").to_pydatetime()), dtype=object)
+    df_nfs = pd.DataFrame(
+        {
+            "C_NOME": pd.Series([f"Fornitore {i % 900}" for i in range(n)], dtype=object),
+            "FAT_DATDOC": dates,
+            "FAT_NDOC": pd.Series([f"F{i}" for i in range(n)], dtype=object),
+            "FAT_DATREG": dates,
+            "FAT_PROT": pd.Series([protocols[i % len(protocols)] for i in range(n)], dtype=object),
+            "FAT_NUM": np.arange(n),
+            "IMPONIBILE": np.round(np.arange(n) * 0.37, 2),
+            "FAT_TOTFAT": 1.0,
+            "FAT_TOTIVA": 1.0,
+            "RA_IMPON": 0.0,
+            "RA_CODTRIB": pd.Series(["I9" if i % 3 else "" for i in range(n)], dtype=object),
+            "RA_IMPOSTA": 0.0,
+            "TMC_G8": pd.Series([f"{10**9 + i}" if i % 4 else "" for i in range(n)], dtype=object),
+        }
+    )
+    df_pisa = pd.DataFrame(
+        {
+            "Creditore": df_nfs["C_NOME"],
+            "Numero fattura": df_nfs["FAT_NDOC"],
+            "Identificativo SDI": df_nfs["TMC_G8"],
+            "Data emissione": pd.Series(["05/01/2025"] * n, dtype=object),
+            "Importo fattura": pd.Series(["12,50"] * n, dtype=object),
+        }
+    )
+
+    def peak_bytes(build):
+        tracemalloc.start()
+        try:
+            build()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    nfs_peak = peak_bytes(lambda: NFSFTFileProcessor()._build_output_frames(df_nfs))
+    assert nfs_peak <= 2 * frame_bytes(df_nfs)
+
+    compare_peak = peak_bytes(lambda: CompareFTFileProcessor()._prepare_compare_frames(df_nfs, df_pisa))
+    assert compare_peak <= 2 * (frame_bytes(df_nfs) + frame_bytes(df_pisa))
+
+
+def test_header_resolver_caches_plan_by_signature():
+    resolver = HeaderResolver(
+        [("Ragione sociale", "C_NOME"), ("C_NOME", "C_NOME"), ("FAT_DATREG", "FAT_DATREG"), ("DATA_REG_FATTURA", "FAT_DATREG")],
+        required=["C_NOME", "FAT_DATREG", "TMC_G8"],
+    )
+    header = [" ragione  sociale ", "Note", "Data reg. fattura"]
+
+    plan = resolver.resolve(header)
+    assert plan.labels == ("C_NOME", "Note", "FAT_DATREG")
+    assert plan.indices == (0, 2)
+    assert plan.missing == ("TMC_G8",)
+    assert resolver.resolve(list(header)) is plan
+
+    # Il nome canonico esatto vince sugli alias.
+    plan = resolver.resolve(["Ragione sociale", "C_NOME"])
+    assert plan.labels == ("Ragione sociale", "C_NOME")
+
+    df, plan = resolver.rename(pd.DataFrame({"Ragione Sociale": ["A"], "DATA_REG_FATTURA": ["2025-01-01"]}))
+    assert list(df.columns) == ["C_NOME", "FAT_DATREG"]
+
+
+def test_compare_files_by_month(tmp_path: Path):
+    nfs_df = pd.DataFrame(
+        {
+            "C_NOME": ["A", "B", "C"],
+            "FAT_DATDOC": ["2025-01-05", "2025-02-15", "2025-02-16"],
+            "FAT_NDOC": ["F001", "F002", "F003"],
+            "FAT_DATREG": ["2025-01-10", "2025-02-20", "2025-02-20"],
+            "FAT_PROT": ["P", "EP", "EP"],
+            "FAT_NUM": [1, 2, 3],
+            "IMPONIBILE": [100.0, 200.0, 300.0],
+            "FAT_TOTFAT": [122.0, 244.0, 366.0],
+            "FAT_TOTIVA": [22.0, 44.0, 66.0],
+            "TMC_G8": ["", "123", "456"],
+        }
+    )
+    pisa_df = pd.DataFrame(
+        {
+            "Creditore": ["A", "B", "D"],
+            "Numero fattura": ["F001", "F002", "F004"],
+            "Identificativo SDI": ["", "123", ""],
+            "Data emissione": ["05/01/2025", "15/02/2025", "03/03/2025"],
+            "Importo fattura": ["100,00", "200,00", "50,00"],
+        }
+    )
+    nfs_path = tmp_path / "nfs.xlsx"
+    pisa_path = tmp_path / "pisa.xlsx"
+    nfs_df.to_excel(nfs_path, index=False)
+    pisa_df.to_excel(pisa_path, index=False)
+
+    summary = CompareFTFileProcessor(months=["*"]).process_files(nfs_path, pisa_path, tmp_path / "all.xlsx")
+
+    assert summary["period"] == "01/2025, 02/2025, 03/2025"
+    assert summary["months"]["02/2025"]["nfs"]["elettroniche"]["count"] == 2
+    assert summary["months"]["02/2025"]["pisa"]["elettroniche"]["amount"] == 200.0
+    assert summary["months"]["03/2025"]["nfs"]["cartacee"]["count"] == 0
+    wb = load_workbook(tmp_path / "all.xlsx", data_only=True)
+    assert wb.sheetnames == [
+        "Confronto",
+        "Differenze tra file",
+        "Confronto 01-2025",
+        "Differenze 01-2025",
+        "Confronto 02-2025",
+        "Differenze 02-2025",
+        "Confronto 03-2025",
+        "Differenze 03-2025",
+    ]
+    assert [row[0] for row in wb["Differenze 02-2025"].iter_rows(min_row=2, values_only=True)] == ["456"]
+
+    summary = CompareFTFileProcessor(months=["2025-02"]).process_files(nfs_path, pisa_path, tmp_path / "feb.xlsx")
+
+    assert summary["period"] == "02/2025"
+    assert summary["nfs"]["cartacee"]["count"] == 0
+    assert summary["nfs"]["elettroniche"]["amount"] == 500.0
+    assert summary["pisa"]["cartacee"]["count"] == 0
+
+
+def test_batch_processes_files_and_zip_into_one_report(sample_dataframe, tmp_path: Path):
+    single_path = tmp_path / "ente_a.xlsx"
+    sample_dataframe.to_excel(single_path, index=False)
+    zip_path = tmp_path / "enti.zip"
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        archive.write(single_path, "export/ente_b.xlsx")
+        archive.writestr("export/ente_c.xlsx", b"non un file excel")
+        archive.writestr("__MACOSX/export/._ente_b.xlsx", b"")
+        archive.writestr("leggimi.txt", b"")
+    work_dir = tmp_path / "batch"
+    work_dir.mkdir()
+
+    uploads = [("ente_a.xlsx", single_path), ("enti.zip", zip_path)]
+    sources = expand_batch_inputs(uploads, work_dir, [".xlsx"], 1024 * 1024, max_files=3, max_total_size=10 * 1024 * 1024)
+    assert [name for name, _ in sources] == ["ente_a.xlsx", "enti.zip/export/ente_b.xlsx", "enti.zip/export/ente_c.xlsx"]
+
+    progress = []
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = run_batch(sources, NFSFTFileProcessor, executor.submit, on_progress=progress.append)
+    summary = batch_summary(results)
+
+    assert [result["status"] for result in results] == ["done", "done", "error"]
+    # Dei singoli file serve solo il riepilogo: nessun file di output per sorgente.
+    assert sorted(path.name for path in work_dir.iterdir()) == ["001_ente_b.xlsx", "002_ente_c.xlsx"]
+    assert progress[-1] == {"total": 3, "completed": 3, "failed": 1}
+    assert summary["failed"] == 1
+    assert summary["total"] == {"total_records": 4, "fase2_records": 0, "fase3_records": 4, "duplicates_removed": 2}
+
+    output_path = tmp_path / "batch.xlsx"
+    write_batch_report(results, output_path)
+    ws = load_workbook(output_path)["Riepilogo batch"]
+    assert [row[:3] for row in ws.iter_rows(min_row=2, values_only=True)] == [
+        ("ente_a.xlsx", "Elaborato", 2),
+        ("enti.zip/export/ente_b.xlsx", "Elaborato", 2),
+        ("enti.zip/export/ente_c.xlsx", "Errore", 0),
+        ("TOTALE", None, 4),
+    ]
+
+
+def test_expand_batch_inputs_limits_extracted_files_and_size(sample_dataframe, tmp_path: Path):
+    excel_path = tmp_path / "ente.xlsx"
+    sample_dataframe.to_excel(excel_path, index=False)
+    zip_path = tmp_path / "enti.zip"
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        for idx in range(3):
+            archive.write(excel_path, f"ente_{idx}.xlsx")
+    size = excel_path.stat().st_size
+
+    def expand(max_files, max_total_size):
+        work_dir = tmp_path / f"batch_{max_files}_{max_total_size}"
+        work_dir.mkdir()
+        return expand_batch_inputs([("enti.zip", zip_path)], work_dir, [".xlsx"], size, max_files, max_total_size)
+
+    assert len(expand(3, 3 * size)) == 3
+    with pytest.raises(ValueError, match="Troppi file nel batch"):
+        expand(2, 3 * size)
+    with pytest.raises(ValueError, match="Batch troppo grande"):
+        expand(3, 3 * size - 1)
+
+
+def test_task_store_saves_batch_progress(tmp_path: Path):
+    store = TaskStore(tmp_path / "tasks.db", retention_hours=24)
+    store.create("batch-1")
+    store.set_progress("batch-1", {"total": 3, "completed": 3, "failed": 1})
+    assert store.get("batch-1")["progress"] == {"total": 3, "completed": 3, "failed": 1}
+
+
+def test_compare_parallel_load_matches_sequential(sample_dataframe, tmp_path: Path, monkeypatch, caplog):
+    nfs_path = tmp_path / "nfs.xlsx"
+    pisa_path = tmp_path / "pisa.xlsx"
+    sample_dataframe.to_excel(nfs_path, index=False)
+    pd.DataFrame(
+        {
+            "Creditore": ["ACME Inc", "Test Corp"],
+            "Numero fattura": ["F001", "F002"],
+            "Identificativo SDI": ["ID1", ""],
+            "Data emissione": ["01/01/2025", "02/01/2025"],
+            "Importo fattura": ["100,00", "150,00"],
+        }
+    ).to_excel(pisa_path, index=False)
+
+    pool_futures = []
+    original_pool = file_processor_module.shared_process_pool
+
+    def spying_pool(name, max_workers):
+        pool = original_pool(name, max_workers)
+        submit = pool.submit
+
+        class SpyingPool:
+            def submit(self, fn, *args):
+                pool_futures.append(submit(fn, *args))
+                return pool_futures[-1]
+
+        return SpyingPool()
+
+    monkeypatch.setattr(file_processor_module, "shared_process_pool", spying_pool)
+    sequential = CompareFTFileProcessor().process_files(nfs_path, pisa_path, tmp_path / "sequential.xlsx")
+    processor = CompareFTFileProcessor(parallel_load=True)
+    df_nfs, df_pisa = processor._load_inputs(nfs_path, pisa_path)
+    parallel = processor.process_files(nfs_path, pisa_path, tmp_path / "parallel.xlsx")
+
+    # La lettura Pisa è avvenuta nel pool, senza ricadere sulla lettura in sequenza.
+    assert len(pool_futures) == 2 and all(future.exception() is None for future in pool_futures)
+    assert "rileggo il file Pisa" not in caplog.text and "in sequenza" not in caplog.text
+    pool_futures.clear()
+    unpicklable = CompareFTFileProcessor(parallel_load=True)
+    unpicklable.lock = threading.Lock()
+    _, df_pisa_fallback = unpicklable._load_inputs(nfs_path, pisa_path)
+    assert isinstance(pool_futures[0].exception(), TypeError)
+    assert "rileggo il file Pisa" in caplog.text
+    pd.testing.assert_frame_equal(df_pisa_fallback, df_pisa)
+
+    assert [entry["stage"] for entry in parallel.pop("stages")] == [entry["stage"] for entry in sequential.pop("stages")]
+    assert parallel == sequential
+    pd.testing.assert_frame_equal(df_pisa, CompareFTFileProcessor()._load_pisa_compare_df(pisa_path))
+    sequential_wb = load_workbook(tmp_path / "sequential.xlsx")
+    parallel_wb = load_workbook(tmp_path / "parallel.xlsx")
+    for ws in sequential_wb.worksheets:
+        assert list(ws.values) == list(parallel_wb[ws.title].values)
+
+
+def test_save_upload_hashes_and_enforces_limits(sample_dataframe, tmp_path: Path):
+    source_path = tmp_path / "source.xlsx"
+    sample_dataframe.to_excel(source_path, index=False)
+    content = source_path.read_bytes()
+
+    stored = asyncio.run(save_upload(UploadFile(BytesIO(content), filename="a.xlsx"), tmp_path / "a.xlsx", len(content)))
+    assert stored.size == len(content)
+    assert stored.sha256 == file_sha256(source_path)
+    assert (tmp_path / "a.xlsx").read_bytes() == content
+
+    with pytest.raises(ValueError, match="File troppo grande"):
+        asyncio.run(save_upload(UploadFile(BytesIO(content), filename="b.xlsx"), tmp_path / "b.xlsx", len(content) - 1))
+    with pytest.raises(ValueError, match="non è un file Excel"):
+        asyncio.run(save_upload(UploadFile(BytesIO(b"C_NOME;FAT_PROT"), filename="c.xlsx"), tmp_path / "c.xlsx", len(content)))
+    assert not (tmp_path / "b.xlsx").exists() and not (tmp_path / "c.xlsx").exists()
+
+
+def test_upload_route_rejects_oversized_body_before_reading_it():
+    app = FastAPI()
+    router = APIRouter(route_class=UploadLimitRoute)
+
+    @router.post("/upload")
+    @limit_upload_size(1024 * 1024)
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    app.include_router(router)
+
+    def post(body_chunks, content_length=None):
+        messages = [
+            {"type": "http.request", "body": chunk, "more_body": idx < len(body_chunks) - 1}
+            for idx, chunk in enumerate(body_chunks)
+        ]
+        received = []
+        sent = []
+
+        async def receive():
+            received.append(True)
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        headers = [(b"content-type", b"multipart/form-data; boundary=x")]
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+        scope = {"type": "http", "method": "POST", "path": "/upload", "headers": headers, "query_string": b""}
+        asyncio.run(app(scope, receive, send))
+        return sent[0]["status"], len(received)
+
+    part = b'--x\r\nContent-Disposition: form-data; name="file"; filename="a.xlsx"\r\n\r\n'
+    assert post([part + b"PK" * 10, b"\r\n--x--\r\n"]) == (200, 2)
+    # Content-Length oltre il limite: 413 senza leggere il corpo.
+    assert post([part], content_length=2 * 1024 * 1024) == (413, 0)
+    # Corpo senza Content-Length: la lettura si ferma appena superato il limite.
+    status, chunks_read = post([part] + [b"a" * 256 * 1024] * 40)
+    assert status == 413 and chunks_read < 10
+
+
+def test_preflight_rejects_wrong_file_from_header_rows(sample_dataframe, tmp_path: Path):
+    nfs_path = tmp_path / "nfs.xlsx"
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Estrazione fatture"])
+    ws.append([])
+    ws.append(list(sample_dataframe.columns))
+    for row in sample_dataframe.itertuples(index=False):
+        ws.append(list(row))
+    wb.save(nfs_path)
+    pisa_path = tmp_path / "pisa.xlsx"
+    pd.DataFrame(
+        {col: ["x"] for col in PisaRicevuteFTFileProcessor.INPUT_REQUIRED_COLUMNS}
+    ).to_excel(pisa_path, index=False)
+
+    rows = read_header_rows(nfs_path, max_rows=4)
+    assert rows[0] == ["Estrazione fatture"] and rows[1] == []
+    assert rows[2] == list(sample_dataframe.columns)
+    assert rows[3][:3] == ["ACME Inc", "2025-01-01", "F001"]
+
+    NFSFTFileProcessor.preflight(nfs_path)
+    PisaRicevuteFTFileProcessor.preflight(pisa_path)
+    CompareFTFileProcessor.preflight(nfs_path, pisa_path)
+    with pytest.raises(ValueError, match="Colonne mancanti: C_NOME"):
+        NFSFTFileProcessor.preflight(pisa_path)
+    with pytest.raises(ValueError, match="Colonne mancanti: Creditore"):
+        PisaRicevuteFTFileProcessor.preflight(nfs_path)
+    with pytest.raises(ValueError, match="Colonne mancanti nel file Pisa"):
+        CompareFTFileProcessor.preflight(nfs_path, nfs_path)
+    (tmp_path / "bad.xlsx").write_bytes(b"PK\x03\x04 troncato")
+    with pytest.raises(ValueError, match="non è un file Excel"):
+        NFSFTFileProcessor.preflight(tmp_path / "bad.xlsx")
+
+
+def test_task_event_stream_pushes_each_state_change(tmp_path: Path):
+    events = TaskEvents()
+    store = TaskStore(tmp_path / "tasks.db", retention_hours=24, on_change=events.notify)
+    store.create("task-1")
+
+    def worker() -> None:
+        time.sleep(0.1)
+        store.mark_processing("task-1")
+        store.set_progress("task-1", {"stage": "lettura"})
+        time.sleep(0.1)
+        store.mark_done("task-1", {"total_records": 2}, "/api/download/task-1")
+
+    async def collect() -> list:
+        async def connected() -> bool:
+            return False
+
+        threading.Thread(target=worker).start()
+        # Con un intervallo di rilettura così lungo solo le notifiche possono far avanzare lo stream.
+        return [
+            chunk
+            async for chunk in task_event_stream(store, events, "task-1", connected, poll_seconds=30)
+        ]
+
+    started = time.perf_counter()
+    chunks = asyncio.run(collect())
+    assert time.perf_counter() - started < 5
+    tasks = [json.loads(chunk[len("data: "):]) for chunk in chunks]
+    assert tasks[0]["status"] == "queued"
+    assert tasks[-1]["status"] == "done" and tasks[-1]["download_url"] == "/api/download/task-1"
+    assert tasks[1]["status"] == "processing"
+    assert not events._waiters
+
+
+def test_process_file_reports_stage_progress(sample_dataframe, tmp_path: Path):
+    input_path = tmp_path / "input.xlsx"
+    sample_dataframe.to_excel(input_path, index=False)
+    events = []
+
+    processor = NFSFTFileProcessor(on_progress=events.append)
+    processor.progress.min_interval = 0
+    processor.process_file(input_path, tmp_path / "output.xlsx")
+
+    stages = [event["stage"] for event in events]
+    assert list(dict.fromkeys(stages)) == ["lettura", "validazione", "deduplica", "aggregazione", "scrittura", "completato"]
+    assert events[0]["rows_total"] == len(sample_dataframe) + 1
+    reading = [event for event in events if event["stage"] == "lettura"]
+    assert reading[-1]["rows"] == len(sample_dataframe) + 1
+    assert any(event.get("sheet") == "Dati" for event in events)
+    percents = [event["percent"] for event in events]
+    assert percents == sorted(percents) and percents[-1] == 100.0
+    assert events[-1]["eta_seconds"] == 0.0
+
+
+def test_process_file_reports_stage_timings_and_metrics(sample_dataframe, tmp_path: Path):
+    input_path = tmp_path / "input.xlsx"
+    sample_dataframe.to_excel(input_path, index=False)
+
+    stats = NFSFTFileProcessor().process_file(input_path, tmp_path / "output.xlsx")
+
+    stages = stats["stages"]
+    assert list(dict.fromkeys(entry["stage"] for entry in stages)) == [
+        "lettura",
+        "intestazioni",
+        "deduplica",
+        "normalizzazione",
+        "aggregazione",
+        "scrittura",
+        "salvataggio",
+    ]
+    assert {"Fatture Cartacee", "Fatture Elettroniche", "Dati"} <= {entry.get("sheet") for entry in stages}
+    assert all(entry["wall_seconds"] >= 0 and entry["cpu_seconds"] >= 0 for entry in stages)
+    assert all(entry["rss_bytes"] > 0 for entry in stages)
+    # Ogni fase parte dall'RSS con cui è finita la precedente e il picco comprende inizio e fine.
+    for previous, entry in zip(stages, stages[1:]):
+        assert entry["rss_bytes"] - entry["rss_growth_bytes"] == previous["rss_bytes"]
+        assert entry["peak_rss_bytes"] >= max(previous["rss_bytes"], entry["rss_bytes"])
+
+    # Il picco di fase vede anche la memoria liberata prima della fine della fase.
+    timer = StageTimer()
+    timer.start()
+    timer.mark("picco")
+    buffer = b"x" * (256 * 1024 * 1024)
+    time.sleep(0.3)
+    del buffer
+    timer.mark("dopo")
+    peak_stage, after_stage = timer.finish()
+    assert peak_stage["peak_rss_bytes"] - peak_stage["rss_bytes"] > 128 * 1024 * 1024
+    assert after_stage["peak_rss_bytes"] < peak_stage["peak_rss_bytes"]
+
+    activity = TaskActivity(workers=2)
+    registry = MetricsRegistry(activity)
+    activity.submitted()
+    activity.submitted()
+    activity.started()
+    registry.observe_job("NFSFTFileProcessor", "done", stages)
+    registry.observe_job("NFSFTFileProcessor", "done", stages)
+    registry.observe_job("NFSFTFileProcessor", "error")
+    registry.observe_job("CompareFTFileProcessor", "done", [{"stage": "scrittura", "sheet": "Confronto 03-2025", "wall_seconds": 0.2, "cpu_seconds": 0.1, "peak_rss_bytes": 1, "rss_bytes": 1, "rss_growth_bytes": 0}])
+
+    text = registry.render()
+    assert "nfs_ft_tasks_queued 1\n" in text
+    assert "nfs_ft_worker_utilization 0.5\n" in text
+    assert 'nfs_ft_tasks_total{job="NFSFTFileProcessor",status="done"} 2\n' in text
+    assert 'nfs_ft_tasks_total{job="NFSFTFileProcessor",status="error"} 1\n' in text
+    assert 'nfs_ft_stage_duration_seconds_count{job="NFSFTFileProcessor",stage="lettura",sheet=""} 2\n' in text
+    assert 'nfs_ft_stage_duration_seconds_bucket{job="CompareFTFileProcessor",stage="scrittura",sheet="Confronto MM-AAAA",le="0.25"} 1\n' in text
+    assert 'nfs_ft_stage_cpu_seconds_bucket{job="CompareFTFileProcessor",stage="scrittura",sheet="Confronto MM-AAAA",le="0.05"} 0\n' in text
+    assert "# TYPE nfs_ft_stage_peak_rss_bytes histogram" in text
+    assert 'nfs_ft_stage_peak_rss_bytes_bucket{job="CompareFTFileProcessor",stage="scrittura",sheet="Confronto MM-AAAA",le="134217728"} 1\n' in text
@@ -36,24 +36,75 @@ function getErrorMessage(error, fallbackMessage) {
   }
 }
 
-async function pollTask(taskId, onProgress) {
-  let p = 0
+// Percentuale calcolata dal server (fasi di elaborazione), se disponibile.
+function taskPercent(task) {
+  const percent = task?.progress?.percent
+  return typeof percent === 'number' ? Math.min(99, percent) : null
+}
+
+function taskResult(taskId, task) {
+  const { summary, file_id, download_url } = task
+  return { success: true, file_id: file_id || taskId, summary, download_url }
+}
+
+async function pollTask(taskId, onProgress, initialProgress = 0) {
+  let p = initialProgress
   while (true) {
     await sleep(1500)
     const res = await api.get(`/api/task/${taskId}`)
-    const { status, summary, error, file_id, download_url } = res.data
+    const { status, error } = res.data
     if (status === 'done') {
       onProgress?.(100)
-      return { success: true, file_id: file_id || taskId, summary, download_url }
+      return taskResult(taskId, res.data)
     }
     if (status === 'error') {
       throw new Error(error || 'Errore durante l’elaborazione del file')
     }
-    p = Math.min(90, p + 5)
+    p = taskPercent(res.data) ?? Math.min(90, p + 5)
     onProgress?.(p)
   }
 }
 
+// Lo stato arriva dal server (SSE) appena cambia; se lo stream non è disponibile si torna al polling.
+function watchTask(taskId, onProgress) {
+  if (typeof EventSource === 'undefined') return pollTask(taskId, onProgress)
+
+  return new Promise((resolve, reject) => {
+    let p = 0
+    let serverProgress = false
+    const source = new EventSource(`${API_BASE_URL}/api/task/${taskId}/events`)
+    const timer = setInterval(() => {
+      if (serverProgress) return
+      p = Math.min(90, p + 5)
+      onProgress?.(p)
+    }, 1500)
+    const stop = () => {
+      clearInterval(timer)
+      source.close()
+    }
+
+    source.onmessage = (event) => {
+      const task = JSON.parse(event.data)
+      if (task.status === 'done') {
+        stop()
+        onProgress?.(100)
+        resolve(taskResult(taskId, task))
+      } else if (task.status === 'error') {
+        stop()
+        reject(new Error(task.error || 'Errore durante l’elaborazione del file'))
+      } else if (taskPercent(task) !== null) {
+        serverProgress = true
+        p = taskPercent(task)
+        onProgress?.(p)
+      }
+    }
+    source.onerror = () => {
+      stop()
+      pollTask(taskId, onProgress, p).then(resolve, reject)
+    }
+  })
+}
+
 export const fileAPI = {
   processFile: async (file, onProgress) => {
     const formData = new FormData()
@@ -69,7 +120,7 @@ export const fileAPI = {
       })
       const data = response.data
       if (data?.task_id) {
-        return await pollTask(data.task_id, (p) => onProgress?.(40 + p * 0.6))
+        return await watchTask(data.task_id, (p) => onProgress?.(40 + p * 0.6))
       }
       return data
     } catch (error) {
@@ -90,7 +141,7 @@ export const fileAPI = {
       })
       const data = response.data
       if (data?.task_id) {
-        return await pollTask(data.task_id, (p) => onProgress?.(40 + p * 0.6))
+        return await watchTask(data.task_id, (p) => onProgress?.(40 + p * 0.6))
       }
       return data
     } catch (error) {
@@ -114,7 +165,7 @@ export const fileAPI = {
       })
       const data = response.data
       if (data?.task_id) {
-        return await pollTask(data.task_id, (p) => onProgress?.(40 + p * 0.6))
+        return await watchTask(data.task_id, (p) => onProgress?.(40 + p * 0.6))
       }
       return data
     } catch (error) {